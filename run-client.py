@@ -42,6 +42,8 @@ parser.add_argument('-s', '--syntax', action='store',
 parser.add_argument('-a', '--args', action='store', help="Add extra arguments to supply to the interpreter", nargs=argparse.REMAINDER, type=str)
 parser.add_argument('-c', '--config', action='store_true', help="Load connection info from 'client.cfg'")
 parser.add_argument('--hub', help="Connect to a named Troop server running on the Troop Hub Service")
+parser.add_argument('-z', '--compress', action='store_true', help="Compress messages to and from the server (used by default with --public and --hub)")
+parser.add_argument('-d', '--debug', action='store_true', help="Print the bytes and writes saved by batching messages each second")
 
 args = parser.parse_args()
 
@@ -53,7 +55,7 @@ from getpass import getpass
 
 # Language and syntax
 
-options = { 'lang': args.mode }
+options = { 'lang': args.mode, 'debug': args.debug, 'compress': args.compress or args.public or bool(args.hub) }
 
 if args.syntax:
 
@@ -13,6 +13,7 @@
 
 import argparse
 from src.server import TroopServer
+from src.aioserver import AsyncTroopServer
 from getpass import getpass
 
 if __name__ == '__main__':
@@ -23,6 +24,9 @@ if __name__ == '__main__':
     parser.add_argument("-k", "--keepalive", help="Turn on server keep-alive to force kick 'dead' clients.", default=False, action='store_true')
     parser.add_argument("-l", "--log", help="Turn the logging on. The logs will be saved to the 'logs' directory.", default=False, action='store_true')
     parser.add_argument("--hub", help="Create a public Troop server via the Troop Hub Service.")
+    parser.add_argument("--high-water", help="Number of bytes waiting to be sent to a client before it is sent the whole document instead (default is 1048576).", dest="high_water", default=1048576, type=int)
+    parser.add_argument("--presence-rate", help="Number of times a second that cursor and selection updates are sent to clients, keeping only the latest from each client in between (default is 30, 0 sends them straight away).", dest="presence_rate", default=30, type=float)
+    parser.add_argument("--async", help="Handle all connections on an asyncio event loop instead of a thread per client.", dest="use_async", default=False, action='store_true')
     args = parser.parse_args()
 
     if args.password is None:
@@ -35,7 +39,8 @@ if __name__ == '__main__':
             from src.hub import HubClient, HubParser
             myServer = HubClient(password=password, **HubParser(args.hub))
         else:
-            myServer = TroopServer(password=password, port=args.port, debug=args.debug, log=args.log, keepalive=args.keepalive)
+            server_class = AsyncTroopServer if args.use_async else TroopServer
+            myServer = server_class(password=password, port=args.port, debug=args.debug, log=args.log, keepalive=args.keepalive, high_water=args.high_water, presence_rate=args.presence_rate)
         myServer.start()
     except KeyboardInterrupt:
         # Exit cleanly on Ctrl + c
@@ -0,0 +1,339 @@
+"""
+    Troop Server (asyncio)
+    ----------------------
+
+    Runs the Troop server on a single asyncio event loop instead of one
+    thread per client. Each connection has a coroutine that reads from the
+    socket and a writer task that sends any messages that could not be
+    written straight away, and messages are processed as soon as they are
+    read instead of being polled from a queue.
+
+    The handling of messages is shared with `TroopServer`.
+
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+import socket
+
+from .server import *
+
+
+class AsyncTroopServer(TroopServer):
+    """
+        TroopServer that handles all of its connections on an asyncio
+        event loop. Start it with `start()` in the same way.
+    """
+    presence_timer = None
+    def open_socket(self):
+        """ Binds a listening socket to the first free port from `self.port` """
+
+        port_found = False
+
+        while not port_found:
+
+            try:
+
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.socket.bind((self.ip_addr, self.port))
+                port_found = True
+
+            except socket.error:
+
+                self.socket.close()
+
+                self.port += 1
+
+        self.socket.listen(socket.SOMAXCONN)
+        self.socket.setblocking(False)
+
+        self.server = None
+
+        return
+
+    def enqueue(self, msg):
+        """ Messages are processed straight away on the event loop """
+        return self.process_message(msg)
+
+    def enqueue_task(self, func, *args):
+        """ Tasks are also run straight away on the event loop """
+        return func(*args)
+
+    def schedule_presence_flush(self):
+        """ Flushes presence messages on the event loop once they are due """
+        if self.presence_timer is None:
+            delay = max(0, self.presence_due - time.time())
+            self.presence_timer = asyncio.get_event_loop().call_later(delay, self.flush_presence)
+        return
+
+    def flush_presence(self):
+        if self.presence_timer is not None:
+            self.presence_timer.cancel()
+            self.presence_timer = None
+        return TroopServer.flush_presence(self)
+
+    def start(self):
+
+        self.running = True
+
+        stdout("Server running @ {} on port {}. Ver. {}\n".format(self.ip_pub, self.port, self.version))
+
+        try:
+
+            asyncio.run(self.serve())
+
+        except KeyboardInterrupt:
+
+            stdout("\nStopping...\n")
+
+        return
+
+    async def serve(self):
+        """ Accepts connections and polls users to make sure they are connected
+            until the server is stopped """
+
+        self.server = await asyncio.start_server(self.handle_connection, sock=self.socket)
+
+        try:
+
+            while self.running:
+
+                if self.keepalive_enabled:
+
+                    self.enqueue(MSG_KEEP_ALIVE())
+
+                    self.purge_client_timeouts()
+
+                self.purge_departed_clients()
+
+                if self.debug:
+
+                    self.report_queue_depths()
+
+                    self.report_presence_stats()
+
+                await asyncio.sleep(1)
+
+        finally:
+
+            await self.shutdown()
+
+        return
+
+    async def handle_connection(self, reader, writer):
+        """ Called by the event loop for each new connection """
+        handler = AsyncTroopRequestHandler(reader, writer)
+
+        try:
+
+            await handler.handle()
+
+        except asyncio.CancelledError:
+
+            pass # The server is stopping
+
+        except Exception as e:
+
+            # Don't let an error in one connection go unnoticed or leave the client connected
+
+            stdout("Error in connection from {}: {!r}".format(handler.client_address[0], e))
+
+            handler.handle_client_lost()
+
+        finally:
+
+            writer.close()
+
+        return
+
+    async def shutdown(self):
+        """ Tells clients the server is stopping and closes all connections """
+
+        if self.log_file is not None: self.log_file.close()
+
+        self.running = False
+
+        outgoing = MSG_KILL(-1, "Warning: Server manually killed by keyboard interrupt. Please close the application")
+
+        for client in list(self.clients.values()):
+
+            if client.connected:
+
+                client.send(outgoing)
+
+                await client.flush()
+
+                client.force_disconnect()
+
+        self.server.close()
+
+        return
+
+    def kill(self):
+        """ Stops the event loop running `serve()` """
+        self.running = False
+        return
+
+
+class AsyncTroopRequestHandler(TroopRequestHandler):
+    """ Handles a single connection using asyncio streams """
+    def __init__(self, reader, writer):
+        self.stream = reader
+        self.request = writer
+        self.client_address = writer.get_extra_info("peername")[:2]
+        self.client_id = ERR_LOGIN_FAIL
+
+    def send_reply(self, data):
+        self.request.write(data)
+        return
+
+    def create_client(self, name, is_dummy):
+        return AsyncClient(self, name=name, is_dummy=is_dummy)
+
+    async def get_message(self):
+        data = await self.stream.read(self.master.bytes)
+        data = self.reader.feed(data)
+        return data
+
+    async def handle(self):
+        """ Reads messages from the connection until it is closed """
+
+        # This takes strings read from the socket and returns json objects, using
+        # the defaults for values missing from a login by an older version
+
+        self.reader = NetworkMessageReader(defaults=True)
+
+        # Password test
+
+        try:
+
+            packet = []
+
+            while len(packet) == 0:
+
+                packet = await self.get_message()
+
+        except Exception:
+
+            self.request.close()
+
+            return
+
+        if self.authenticate(packet) < 0:
+
+            await self.request.drain()
+
+            self.request.close()
+
+            return
+
+        # Switch to the wire format agreed during authentication
+
+        self.reader = get_message_reader(self.features)
+
+        # Enter loop
+
+        while self.master.running:
+
+            try:
+
+                packet = await self.get_message()
+
+                # If we get none, just read in again
+
+                if packet is None:
+
+                    self.handle_client_lost()
+
+                    break
+
+            except Exception as e: # TODO be more specific
+
+                # Handle the loss of a client
+
+                self.handle_client_lost()
+
+                break
+
+            self.handle_packet(packet)
+
+        return
+
+
+class AsyncClient(Client):
+    """ A client whose connection is written to without blocking the event loop.
+        Messages go straight into the transport's buffer until it is full, then
+        wait in the outbox for a separate writer task to send them once the
+        connection has drained. """
+    def start_writer(self):
+        self.pending = asyncio.Event()
+        self.writer  = asyncio.ensure_future(self.write_messages())
+        return
+
+    def send(self, message):
+        if not self.connected or self.source.is_closing():
+            raise DeadClientError(self.hostname)
+        data = message.encode(self.features)
+        if len(self.outbox) == 0 and not self.is_paused():
+            self.source.write(self.compress(data))
+        else:
+            self.outbox.append((message, data))
+            self.queued += len(data)
+            self.pending.set()
+        return
+
+    def is_paused(self):
+        """ Returns True if the transport has more data to send than its high-water mark """
+        transport = self.source.transport
+        return transport.get_write_buffer_size() > transport.get_write_buffer_limits()[1]
+
+    async def write_messages(self):
+        """ Writes the outbox to the connection whenever the transport has drained """
+
+        try:
+
+            while True:
+
+                await self.pending.wait()
+
+                self.pending.clear()
+
+                while len(self.outbox):
+
+                    await self.source.drain()
+
+                    data = self.compress(b"".join(data for _, data in self.outbox))
+
+                    self.outbox.clear()
+                    self.queued   = 0
+                    self.snapshot = 0
+
+                    self.source.write(data)
+
+        except (ConnectionError, OSError) as e:
+
+            print(e)
+
+            if self.connected:
+
+                self.force_disconnect()
+
+        return
+
+    def get_backlog(self):
+        return len(self.outbox), self.queued + self.source.transport.get_write_buffer_size()
+
+    async def flush(self):
+        """ Waits until the outbox has been written to the connection """
+        while self.connected and len(self.outbox):
+            await asyncio.sleep(0.01)
+        if self.connected:
+            await self.source.drain()
+        return
+
+    def disconnect(self):
+        self.connected = False
+        self.writer.cancel()
+        self.source.close()
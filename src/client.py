@@ -1,6 +1,7 @@
 from __future__ import absolute_import, print_function
 
 from .interface import *
+from .interface.wakeup import Wakeup
 from .sender import *
 from .receiver import *
 from .message import *
@@ -9,6 +10,7 @@ from .interpreter import *
 
 from time import sleep, time
 from hashlib import md5
+from threading import Thread, Lock
 
 try:
     import queue
@@ -26,17 +28,31 @@ class Client:
     mainloop_started = False
     keepalive = None
     timeout = 3
+    reconnect_attempts = 30
+    reconnect_delay = 1
+    send_wakeup = None
 
-    def __init__(self, **kwargs):
+    def __init__(self, debug=False, **kwargs):
 
         self.is_alive = True
 
+        # Set while trying to reconnect after the connection is lost
+
+        self.reconnecting   = False
+        self.reconnect_lock = Lock()
+        self.new_connection = None
+
+        # Print the bytes and writes saved by batching messages
+
+        self.debug = debug
+        self.send_stats = {"bytes": 0, "writes": 0, "time": time()}
+
         # Start the UI
 
         self.input = ConnectionInput(self, **kwargs)
         self.input.start()
 
-    def setup(self, host="", port="", name="", password="", lang=FOXDOT, syntax=FOXDOT, args="", ipv6=False):
+    def setup(self, host="", port="", name="", password="", lang=FOXDOT, syntax=FOXDOT, args="", ipv6=False, compress=False):
 
         # ConnectionInput(host, port)
 
@@ -50,7 +66,11 @@ class Client:
 
         try:
 
-            self.send = Sender(self).connect(self.hostname, self.port, self.name, ipv6, password)
+            features = FEATURE_FRAMED | FEATURE_PIPELINED | FEATURE_COMPACT_ACK | (FEATURE_COMPRESSED if compress else 0)
+
+            self.connection_args = (self.hostname, self.port, self.name, ipv6, password, features)
+
+            self.send = Sender(self).connect(*self.connection_args)
 
             if not self.send.connected:
 
@@ -128,7 +148,18 @@ class Client:
         self.ui = Interface(self, title, self.lang)
         self.ui.init_local_user(self.id, self.name)
 
-        # Send information about this client to the server
+        # Messages are sent as soon as they are added to the send queue
+
+        self.send_wakeup = Wakeup(self.ui.root, self.update_send)
+
+        # Send operations without waiting for each one to be acknowledged if the server supports it
+
+        self.ui.text.pipelined = bool(self.send.features & FEATURE_PIPELINED)
+
+        # Send information about this client to the server. Editing is blocked until
+        # the server has sent the document
+
+        self.ui.block_messages = True
 
         self.send( MSG_CONNECT(self.id, self.name, self.send.hostname, self.send.port, self.lang.id == -1) )
 
@@ -152,28 +183,108 @@ class Client:
         return conf
 
     def update_send(self):
-        """ Continually polls the queue and sends any messages to the server """
-        try:
-            while self.send.connected:
+        """ Sends every message in the queue to the server in one write. Called by
+            `send_wakeup` when messages are added or a new connection is ready """
 
-                try:
+        # Carry on with a new connection if the last one was lost
+
+        if self.new_connection is not None:
 
-                    msg = self.send_queue.get_nowait()
+            sender, self.new_connection = self.new_connection, None
 
-                    self.send( msg )
+            if sender:
+
+                self.resume(sender)
+
+            else:
+
+                self.ui.freeze_kill('Warning: connection lost.')
+
+        if self.send.connected and not self.reconnecting:
+
+            messages = []
+
+            try:
+
+                while True:
+
+                    messages.append(self.send_queue.get_nowait())
+
+            # Break when the queue is empty
+            except queue.Empty:
+
+                pass
+
+            if len(messages):
+
+                batch = self.collapse_messages(messages)
+
+                try:
+
+                    self.send.send_all(batch)
 
                 except ConnectionError as e:
 
-                    return print(e)
+                    print(e)
+
+                    self.connection_lost()
+
+                if self.debug:
+
+                    self.record_send_stats(messages, batch)
 
                 self.ui.root.update_idletasks()
 
-        # Break when the queue is empty
-        except queue.Empty:
-            pass
+        return
 
-        # Recursive call
-        self.ui.root.after(30, self.update_send)
+    def wake_sender(self):
+        """ Sends the queued messages as soon as the Tkinter loop is free. Safe to
+            call from any thread """
+        if self.send_wakeup is not None:
+            self.send_wakeup.set()
+        return
+
+    @staticmethod
+    def collapse_messages(messages):
+        """ Returns a list of messages without any location or selection message
+            that is followed by a newer one of the same kind """
+
+        seen  = set()
+        batch = []
+
+        for msg in reversed(messages):
+
+            if isinstance(msg, (MSG_SET_MARK, MSG_SELECT)):
+
+                key = (msg.type, msg["reply"])
+
+                if key in seen:
+
+                    continue
+
+                seen.add(key)
+
+            batch.append(msg)
+
+        batch.reverse()
+
+        return batch
+
+    def record_send_stats(self, messages, batch):
+        """ Adds the number of bytes and writes that batching has saved to `send_stats` """
+        features = self.send.features
+        self.send_stats["bytes"]  += sum(len(msg.encode(features)) for msg in messages) - sum(len(msg.encode(features)) for msg in batch)
+        self.send_stats["writes"] += len(messages) - 1
+        return
+
+    def report_send_stats(self):
+        """ Prints the bytes and writes saved by batching each second """
+        now = time()
+        if now >= self.send_stats["time"] + 1:
+            if self.send_stats["writes"] > 0:
+                elapsed = now - self.send_stats["time"]
+                print("Send batching saved {:.0f} bytes/s and {:.0f} writes/s".format(self.send_stats["bytes"] / elapsed, self.send_stats["writes"] / elapsed))
+            self.send_stats = {"bytes": 0, "writes": 0, "time": now}
         return
 
     def is_master(self):
@@ -200,6 +311,114 @@ class Client:
 
     def check_for_timeout(self):
         if self.keepalive and (time() > self.keepalive + self.timeout):
-            self.ui.freeze_kill('Warning: connection lost.')
-        else:
-            self.ui.root.after(1000, self.check_for_timeout)
+            self.connection_lost()
+        if self.debug:
+            self.report_send_stats()
+        self.ui.root.after(1000, self.check_for_timeout)
+
+    def connection_lost(self):
+        """ Starts trying to reconnect to the server in the background. The user
+            can't edit the document until the session has been resumed """
+
+        with self.reconnect_lock:
+
+            if self.reconnecting or not self.is_alive:
+
+                return
+
+            self.reconnecting = True
+
+        print("Warning: connection lost. Reconnecting...")
+
+        self.keepalive = None
+
+        if self.ui is not None:
+
+            self.ui.block_messages = True
+
+        self.recv.kill()
+
+        thread = Thread(target=self.reconnect)
+        thread.daemon = True
+        thread.start()
+
+        return
+
+    def reconnect(self):
+        """ Tries to log in to the server again with the same name. The new connection
+            is picked up by `update_send` """
+
+        for attempt in range(self.reconnect_attempts):
+
+            sleep(self.reconnect_delay)
+
+            try:
+
+                sender = Sender(self).connect(*self.connection_args, client_id=self.id)
+
+            except Exception:
+
+                continue
+
+            # The server gives us our old ID if it still remembers us
+
+            if sender.connected and sender.conn_id == self.id:
+
+                self.new_connection = sender
+
+                self.wake_sender()
+
+                return
+
+            sender.kill()
+
+            # Trying again won't help if the server turned us away
+
+            if sender.conn_id is not None:
+
+                print(sender.error_message())
+
+                break
+
+        self.new_connection = False
+
+        self.wake_sender()
+
+        return
+
+    def resume(self, sender):
+        """ Carries on the session using a new connection, asking the server for the
+            operations missed since the last revision we received """
+
+        # Finish handling messages from the old connection first
+
+        self.ui.text.process_queue()
+
+        revision, checksum = self.ui.text.get_resume_state()
+
+        # Discard messages that were waiting to be sent on the old connection
+
+        try:
+
+            while True:
+
+                self.send_queue.get_nowait()
+
+        except queue.Empty:
+
+            pass
+
+        self.send = sender
+        self.send.ui = self.ui
+
+        self.recv = Receiver(self, self.send.conn)
+        self.recv.ui = self.ui
+        self.recv.start()
+
+        self.send( MSG_CONNECT(self.id, self.name, self.send.hostname, self.send.port, self.lang.id == -1, revision, checksum) )
+
+        self.reconnecting = False
+
+        print("Reconnected to the server")
+
+        return
@@ -0,0 +1,381 @@
+"""
+    document.py
+    -----------
+
+    Data structures used to store the contents of a Troop document so that
+    applying an operation does not have to rebuild the whole text.
+
+"""
+
+from __future__ import absolute_import
+
+from bisect import bisect_right
+from itertools import accumulate
+from operator import itemgetter
+
+from .ot.text_operation import IncompatibleOperationError
+
+
+class FenwickTree:
+    """ Binary indexed tree of integers supporting O(log n) point updates,
+        prefix sums and searches for the position of a prefix sum """
+    def __init__(self, values=()):
+        self.build(values)
+
+    def __len__(self):
+        return len(self.tree) - 1
+
+    def build(self, values):
+        """ Creates the tree from a list of values in O(n) """
+        self.tree = [0] + list(values)
+        size = len(self.tree)
+        for i in range(1, size):
+            j = i + (i & -i)
+            if j < size:
+                self.tree[j] += self.tree[i]
+        return
+
+    def add(self, i, delta):
+        """ Adds delta to the value at position i """
+        i += 1
+        size = len(self.tree)
+        while i < size:
+            self.tree[i] += delta
+            i += i & -i
+        return
+
+    def prefix(self, i):
+        """ Returns the sum of the values at positions 0 to i-1 """
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def search(self, value):
+        """ Returns the smallest position i such that prefix(i + 1) > value and the
+            sum of the values before it. Values must not be negative. """
+        pos  = 0
+        step = 1
+        size = len(self.tree)
+        while step * 2 < size:
+            step *= 2
+        while step > 0:
+            nxt = pos + step
+            if nxt < size and self.tree[nxt] <= value:
+                pos = nxt
+                value -= self.tree[nxt]
+            step //= 2
+        return pos, self.prefix(pos)
+
+
+class Rope:
+    """ A string split into chunks of at most `chunk_size` characters. The
+        length and number of newlines in each chunk are kept in Fenwick trees
+        so that locating an offset or a line takes O(log n) and inserting or
+        deleting text only copies the chunks it touches.
+    """
+    chunk_size = 1024
+
+    def __init__(self, string=""):
+        self.chunks = self.split(string)
+        self.length = len(string)
+        self.rebuild()
+
+    def split(self, string):
+        """ Splits a string into a list of chunks """
+        size = self.chunk_size
+        return [string[i:i + size] for i in range(0, len(string), size)] or [""]
+
+    def rebuild(self):
+        """ Recreates the indices after the list of chunks has changed """
+        self.sizes    = FenwickTree(len(chunk) for chunk in self.chunks)
+        self.newlines = FenwickTree(chunk.count("\n") for chunk in self.chunks)
+        self.string   = None
+        return
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        if self.string is None:
+            self.string = "".join(self.chunks)
+        return self.string
+
+    def __repr__(self):
+        return "Rope({!r})".format(str(self))
+
+    def __eq__(self, other):
+        if isinstance(other, Rope):
+            other = str(other)
+        return str(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return str(self)[key]
+            return self.substring(start, stop)
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError("Rope index out of range")
+        i, offset = self.locate(key)
+        return self.chunks[i][key - offset]
+
+    def locate(self, index):
+        """ Returns the position of the chunk containing the character at `index` and the
+            offset of its first character. The end of the document is in the last chunk. """
+        if index >= self.length:
+            i = len(self.chunks) - 1
+            return i, self.length - len(self.chunks[i])
+        return self.sizes.search(index)
+
+    def substring(self, start, stop):
+        """ Returns the characters between two offsets """
+        if start >= stop:
+            return ""
+        if self.string is not None:
+            return self.string[start:stop]
+        i, offset = self.locate(start)
+        parts = []
+        while offset < stop:
+            chunk = self.chunks[i]
+            parts.append(chunk[max(start - offset, 0):stop - offset])
+            offset += len(chunk)
+            i += 1
+        return "".join(parts)
+
+    # Editing
+    # =======
+
+    def insert(self, index, string):
+        """ Inserts a string at a given offset """
+        if len(string) == 0:
+            return
+        if not 0 <= index <= self.length:
+            raise IndexError("Cannot insert at {} in document of length {}".format(index, self.length))
+        i, offset = self.locate(index)
+        chunk = self.chunks[i]
+        chunk = chunk[:index - offset] + string + chunk[index - offset:]
+        self.length += len(string)
+        if len(chunk) > 2 * self.chunk_size:
+            self.chunks[i:i + 1] = self.split(chunk)
+            self.rebuild()
+        else:
+            self.chunks[i] = chunk
+            self.sizes.add(i, len(string))
+            self.newlines.add(i, string.count("\n"))
+            self.string = None
+        return
+
+    def delete(self, index, length):
+        """ Removes `length` characters starting at a given offset """
+        if length <= 0:
+            return
+        if index < 0 or index + length > self.length:
+            raise IndexError("Cannot delete {} characters at {} in document of length {}".format(length, index, self.length))
+        i, offset = self.locate(index)
+        self.length -= length
+        structure_changed = False
+        while length > 0:
+            chunk = self.chunks[i]
+            start = index - offset
+            end   = min(start + length, len(chunk))
+            removed = chunk[start:end]
+            chunk = chunk[:start] + chunk[end:]
+            length -= len(removed)
+            if len(chunk) == 0 and len(self.chunks) > 1:
+                del self.chunks[i]
+                structure_changed = True
+            else:
+                self.chunks[i] = chunk
+                if not structure_changed:
+                    self.sizes.add(i, -len(removed))
+                    self.newlines.add(i, -removed.count("\n"))
+                offset += len(chunk)
+                i += 1
+        # Join a chunk that has become very small onto its neighbour
+        i = max(0, min(i, len(self.chunks)) - 1)
+        if len(self.chunks) > 1 and len(self.chunks[i]) < self.chunk_size // 4:
+            j = i if i + 1 < len(self.chunks) else i - 1
+            self.chunks[j:j + 2] = self.split(self.chunks[j] + self.chunks[j + 1])
+            structure_changed = True
+        if structure_changed:
+            self.rebuild()
+        else:
+            self.string = None
+        return
+
+    def apply(self, operation):
+        """ Applies a TextOperation to the document in place """
+        size = 0
+        for op in operation:
+            if isinstance(op, int):
+                size += abs(op)
+        if size != self.length:
+            raise IncompatibleOperationError("Cannot apply operation: expected document of length {} but it is {}".format(size, self.length))
+        index = 0
+        for op in operation:
+            if isinstance(op, str):
+                self.insert(index, op)
+                index += len(op)
+            elif op > 0:
+                index += op
+            else:
+                self.delete(index, -op)
+        return self
+
+    # Lines
+    # =====
+
+    def count_lines(self):
+        """ Returns the number of lines in the document """
+        return self.newlines.prefix(len(self.chunks)) + 1
+
+    def line_start(self, line):
+        """ Returns the offset of the first character on a line, starting from 0 """
+        if line <= 0:
+            return 0
+        if line >= self.count_lines():
+            raise IndexError("Line {} is out of range".format(line))
+        # Find the chunk containing the newline that ends the previous line
+        i, newlines = self.newlines.search(line - 1)
+        chunk = self.chunks[i]
+        pos = -1
+        for _ in range(line - newlines):
+            pos = chunk.find("\n", pos + 1)
+        return self.sizes.prefix(i) + pos + 1
+
+    def line_end(self, line):
+        """ Returns the offset of the newline at the end of a line, or the length of the document """
+        if line + 1 >= self.count_lines():
+            return self.length
+        return self.line_start(line + 1) - 1
+
+    def line_of(self, index):
+        """ Returns the line that the character at `index` is on, starting from 0 """
+        index = max(0, min(index, self.length))
+        i, offset = self.locate(index)
+        return self.newlines.prefix(i) + self.chunks[i].count("\n", 0, index - offset)
+
+    def get_line(self, line):
+        """ Returns the contents of a line, not including the newline """
+        return self.substring(self.line_start(line), self.line_end(line))
+
+
+class PeerTagMap:
+    """ Records which peer wrote each character of a document as a list of
+        (peer_id, length) runs. Operations are applied run by run and the number
+        of characters owned by each peer is kept up to date, so the cost of
+        every method depends on the number of runs rather than characters.
+    """
+    def __init__(self, runs=()):
+        self.runs   = []
+        self.length = 0
+        self.totals = {}
+        for peer_id, length in runs:
+            peer_id, length = int(peer_id), int(length)
+            self.extend(self.runs, peer_id, length)
+            self.add_total(peer_id, length)
+        self.length = sum(self.totals.values())
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return "PeerTagMap({!r})".format(self.to_list())
+
+    @staticmethod
+    def extend(runs, peer_id, length):
+        """ Adds `length` characters belonging to `peer_id` to the end of a list of runs """
+        if length <= 0:
+            return
+        if len(runs) and runs[-1][0] == peer_id:
+            runs[-1] = (peer_id, runs[-1][1] + length)
+        else:
+            runs.append((peer_id, length))
+        return
+
+    def add_total(self, peer_id, length):
+        """ Updates the number of characters owned by `peer_id` """
+        total = self.totals.get(peer_id, 0) + length
+        if total > 0:
+            self.totals[peer_id] = total
+        else:
+            self.totals.pop(peer_id, None)
+        return
+
+    def apply(self, operation, peer_id):
+        """ Applies a TextOperation performed by `peer_id` in place """
+        size = 0
+        for op in operation:
+            if isinstance(op, int):
+                size += abs(op)
+        if size != self.length:
+            raise IncompatibleOperationError("Cannot apply operation: expected document of length {} but it is {}".format(size, self.length))
+        runs = []
+        pos  = 0 # offset in the document before the operation
+        i    = 0 # run containing that offset
+        ends = list(accumulate(map(itemgetter(1), self.runs)))
+        for op in operation:
+            if isinstance(op, str):
+                self.extend(runs, peer_id, len(op))
+                self.add_total(peer_id, len(op))
+                size += len(op)
+                continue
+            stop = pos + abs(op)
+            if op > 0:
+                # Runs that are retained completely are copied without splitting them
+                j = bisect_right(ends, stop, i)
+                if j > i:
+                    self.extend(runs, self.runs[i][0], ends[i] - pos)
+                    runs.extend(self.runs[i + 1:j])
+                    pos, i = ends[j - 1], j
+                if pos < stop:
+                    self.extend(runs, self.runs[i][0], stop - pos)
+                    pos = stop
+            else:
+                while pos < stop:
+                    taken = min(stop, ends[i]) - pos
+                    self.add_total(self.runs[i][0], -taken)
+                    size -= taken
+                    pos  += taken
+                    if pos == ends[i]:
+                        i += 1
+        self.runs   = runs
+        self.length = size
+        return self
+
+    def peers(self):
+        """ Returns the ids of the peers that own at least one character """
+        return list(self.totals.keys())
+
+    def counts(self):
+        """ Returns a dictionary of peer id to the number of characters they own """
+        return dict(self.totals)
+
+    def ranges(self, peer_id):
+        """ Returns a list of (start, end) offsets of the text owned by `peer_id` """
+        data  = []
+        start = 0
+        for run_peer, length in self.runs:
+            if run_peer == peer_id:
+                data.append((start, start + length))
+            start += length
+        return data
+
+    def to_list(self):
+        """ Returns the runs as (peer_id, length) tuples for the `peer_tag_loc` of a message """
+        return list(self.runs)
+
+    @classmethod
+    def from_list(cls, data):
+        """ Creates a PeerTagMap from the `peer_tag_loc` of a message """
+        return cls(data)
@@ -0,0 +1,287 @@
+"""
+    interface/highlighter.py
+    ------------------------
+
+    Syntax highlighting for the text box. The tags for a line only depend
+    on its contents, the language and whether it starts inside a comment
+    or string that spans several lines, so they are cached on those and
+    only the lines changed by an operation are looked up again.
+
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+# State of a line that has not been tokenized yet
+
+UNKNOWN = -1
+
+class SyntaxHighlighter:
+    """ Applies the tags found by the language's `re` functions to the lines of a
+        `ThreadSafeText`. The state at the end of each line is None, or the index in
+        the language's `block_comments` of the comment that carries on to the next line.
+        Results are kept in an LRU cache of `cache_size` lines. """
+    cache_size  = 4096
+    comment_tag = "tag_italic"
+    def __init__(self, text):
+
+        self.text = text
+
+        self.cache  = OrderedDict() # (language, line, state) -> (tags, state)
+        self.states = []            # The state at the end of each line
+
+        self.lang      = None
+        self.language  = None
+        self.tag_names = set()
+
+    def get_language(self, lang):
+        """ Returns the values that the tags for a line depend on for an interpreter """
+        return (lang.__class__, getattr(lang, "syntax_lang", None))
+
+    def get_tag_names(self, lang):
+        """ Returns the names of the tags used by an interpreter """
+        names = set(lang.re.keys())
+        if len(getattr(lang, "block_comments", ())):
+            names.add(self.comment_tag)
+        return names
+
+    def tokenize(self, line, state):
+        """ Returns the tags for a line, as a tuple of (tag_name, start, end), and the
+            state at the end of the line, using the cache if possible """
+
+        key = (self.language, line, state)
+
+        try:
+
+            result = self.cache[key]
+
+            self.cache.move_to_end(key)
+
+        except KeyError:
+
+            result = self.cache[key] = self.scan(line, state)
+
+            if len(self.cache) > self.cache_size:
+
+                self.cache.popitem(last=False)
+
+        return result
+
+    def scan(self, line, state):
+        """ Finds the tags for a line that starts in `state` """
+
+        blocks = getattr(self.lang, "block_comments", ())
+
+        tags = []
+
+        pos, comment_start = 0, 0
+
+        while True:
+
+            # Find the end of a comment carried on from before
+
+            if state is not None:
+
+                end = line.find(blocks[state][1], pos)
+
+                if end < 0:
+
+                    if comment_start < len(line):
+
+                        tags.append((self.comment_tag, comment_start, len(line)))
+
+                    return tuple(tags), state
+
+                pos = end + len(blocks[state][1])
+
+                tags.append((self.comment_tag, comment_start, pos))
+
+                state = None
+
+            # Tag the code up to the start of the next multi-line comment, unless a
+            # comment that ends with the line starts first
+
+            start, block = self.find_block_start(line, pos, blocks, getattr(self.lang, "string_chars", ('"', "'")))
+
+            found = {tag_name: func(line[pos:]) for tag_name, func in self.lang.re.items()}
+
+            comments = found.get(self.comment_tag)
+
+            if block is None or (comments and pos + comments[0][0] < start):
+
+                for tag_name, matches in found.items():
+
+                    tags.extend((tag_name, pos + match_start, pos + match_end) for match_start, match_end in matches)
+
+                return tuple(tags), None
+
+            for tag_name, func in self.lang.re.items():
+
+                tags.extend((tag_name, pos + match_start, pos + match_end) for match_start, match_end in func(line[pos:start]))
+
+            pos, comment_start, state = start + len(blocks[block][0]), start, block
+
+    @staticmethod
+    def find_block_start(line, pos, blocks, quotes=('"', "'")):
+        """ Returns the index of the first multi-line comment that starts outside of a
+            string from `pos`, and its index in `blocks`, or (len(line), None). Strings
+            are opened and closed by any of the characters in `quotes` """
+
+        if len(blocks):
+
+            instring = None
+
+            for i in range(pos, len(line)):
+
+                char = line[i]
+
+                if instring is None:
+
+                    for block, (start, end) in enumerate(blocks):
+
+                        if line.startswith(start, i):
+
+                            return i, block
+
+                    if char in quotes:
+
+                        instring = char
+
+                elif char == instring:
+
+                    instring = None
+
+        return len(line), None
+
+    def move_lines(self, first, last):
+        """ Keeps the states in line with the document after an operation that changed
+            rows `first` to `last`. The last row keeps the state of the row it replaced
+            so that the rows after it are only tokenized again if its state changes """
+
+        delta = self.text.document.count_lines() - len(self.states)
+
+        end = last - delta # The row that `last` was before the operation
+
+        if 1 <= first <= end <= len(self.states):
+
+            self.states = self.states[:first - 1] + [UNKNOWN] * (last - first) + self.states[end - 1:]
+
+        else:
+
+            self.states = []
+
+        return
+
+    def highlight(self, rows=None):
+        """ Tokenizes the given rows, numbered from 1, and any rows after them that start
+            in a different state than before, then updates their tags. Every row is done
+            if `rows` is None or the language has changed """
+
+        lang = self.text.root.lang
+
+        document  = self.text.document
+        num_lines = document.count_lines()
+
+        language = self.get_language(lang)
+
+        self.lang = lang
+
+        if rows is None or language != self.language or len(self.states) != num_lines:
+
+            remove = self.tag_names
+
+            self.language  = language
+            self.tag_names = self.get_tag_names(lang)
+
+            remove = remove | self.tag_names
+
+            self.states = [UNKNOWN] * num_lines
+
+            rows  = range(1, num_lines + 1)
+            lines = str(document).split("\n")
+
+        else:
+
+            remove = self.tag_names
+
+            rows  = sorted(row for row in set(rows) if 1 <= row <= num_lines)
+            lines = None
+
+        if len(rows) == 0 or len(remove) == 0:
+
+            return
+
+        updates = []
+
+        i, row = 0, rows[0]
+
+        while row is not None:
+
+            old_state   = self.states[row - 1]
+            start_state = self.states[row - 2] if row > 1 else None
+
+            if start_state == UNKNOWN:
+
+                start_state = None
+
+            line = lines[row - 1] if lines is not None else document.get_line(row - 1)
+
+            tags, self.states[row - 1] = self.tokenize(line, start_state)
+
+            updates.append((row, tags))
+
+            while i < len(rows) and rows[i] <= row:
+
+                i += 1
+
+            # Carry on to the next row if this one ends in a different state
+
+            if self.states[row - 1] != old_state and row < num_lines:
+
+                row += 1
+
+            elif i < len(rows):
+
+                row = rows[i]
+
+            else:
+
+                row = None
+
+        self.apply_tags(updates, remove)
+
+        return
+
+    def apply_tags(self, updates, remove):
+        """ Replaces the tags on the updated rows. Tags are removed from each run of
+            consecutive rows and added with one call for each tag """
+
+        runs   = []
+        ranges = {tag_name: [] for tag_name in remove}
+
+        for row, tags in updates:
+
+            if len(runs) and runs[-1][1] == row - 1:
+
+                runs[-1][1] = row
+
+            else:
+
+                runs.append([row, row])
+
+            for tag_name, start, end in tags:
+
+                ranges[tag_name].extend(("{}.{}".format(row, start), "{}.{}".format(row, end)))
+
+        for tag_name, indices in ranges.items():
+
+            for first, last in runs:
+
+                self.text.tag_remove(tag_name, "{}.0".format(first), "{}.end".format(last))
+
+            if len(indices):
+
+                self.text.tag_add(tag_name, *indices)
+
+        return
@@ -457,48 +457,13 @@ class Interface(BasicInterface):
 
             return
 
-        # For each connected peer, find the range covered by the tag
+        # For each connected peer, find the number of characters they own
 
-        for peer in self.text.peers.values():
-
-            tag_name = peer.text_tag
-
-            loc = self.text.tag_ranges(tag_name)
-
-            count = 0
-
-            if len(loc) > 0:
-
-                for i in range(0, len(loc), 2):
-
-                    start, end = loc[i], loc[i+1]
-
-                    start = self.convert(start)
-                    end   = self.convert(end)
-
-                    # If the range is on the same line, just count
-
-                    if start[0] == end[0]:
-
-                        count += (end[1] - start[1])
+        counts = self.text.peer_tag_doc.counts()
 
-                    else:
+        for p_id, peer in self.text.peers.items():
 
-                        # Get the first line
-
-                        count += (self.convert(self.text.index("{}.end".format(start[0])))[1] - start[1])
-
-                        # If it spans multiple lines, just count all characters
-
-                        for line in range(start[0] + 1, end[0]):
-
-                            count += self.convert(self.text.index("{}.end".format(line)))[1]
-
-                        # Add the number of the last line
-
-                        count += end[1]
-
-            peer.count = count
+            peer.count = counts.get(p_id, 0)
 
         # Once we count all, work out percentages and draw graphs
 
@@ -567,6 +532,8 @@ class Interface(BasicInterface):
 
                 self.client.send_queue.put(message)
 
+                self.client.wake_sender()
+
         else:
 
             raise TypeError("Must be MESSAGE or list")
@@ -620,7 +587,7 @@ class Interface(BasicInterface):
 
         index     = self.text.marker.get_index_num() # possibly just use .index_num
         line_num  = self.text.number_index_to_row_col(index)[0]
-        doc_size  = len(self.text.read())
+        doc_size  = len(self.text.document)
         tail      = doc_size - index
         selection = self.text.marker.selection_size()
 
@@ -726,7 +693,7 @@ class Interface(BasicInterface):
 
     def new_operation(self, *ops):
         """ Returns a list of operations to apply to the document """
-        return new_operation(*(list(ops) + [len(self.text.read())]))
+        return new_operation(*(list(ops) + [len(self.text.document)]))
 
     def get_delete_selection_operation(self):
         """ Returns an operation that deletes the selected area """
@@ -740,7 +707,7 @@ class Interface(BasicInterface):
 
         index = self.text.marker.get_index_num()
         sel_size = self.text.marker.selection_size()
-        doc_size = len(self.text.read())
+        doc_size = len(self.text.document)
 
         if index == self.text.marker.select_end():
             offset = len(insert) - sel_size
@@ -752,7 +719,7 @@ class Interface(BasicInterface):
 
     def get_set_all_operation(self, text):
         """ Returns a new operation that deletes the contents then inserts the text """
-        return [-len(self.text.read()), text]
+        return [-len(self.text.document), text]
 
     def apply_operation(self, operation, index_offset=0, **kwargs):
         """ Handles a text operation locally and sends to the server """
@@ -894,7 +861,7 @@ class Interface(BasicInterface):
             op, offset = self.get_delete_selection_operation()
             self.de_select()
         else:
-            len_text = len(self.text.read())
+            len_text = len(self.text.document)
             index, _, new = self.text.marker.get_index_num(), self.move_marker_ctrl_right(), self.text.marker.get_index_num()
             if len_text == 0: # dont apply operation if there is no text
                 return "break"
@@ -991,7 +958,7 @@ class Interface(BasicInterface):
 
     def move_marker_ctrl_end(self):
         """ Moves the cursor to the end of the document """
-        self.text.marker.move(len(self.text.read()))
+        self.text.marker.move(len(self.text.document))
         return
 
     def move_marker_ctrl_left(self):
@@ -1155,7 +1122,7 @@ class Interface(BasicInterface):
             the marker to 1,0 """
 
         self.text.marker.move(0)
-        self.update_select(0, len(self.text.read()))
+        self.update_select(0, len(self.text.document))
 
         return "break"
 
@@ -1371,7 +1338,7 @@ class Interface(BasicInterface):
     def copy(self, event=None):
         ''' Copies selected text to the clipboard '''
         if self.text.marker.has_selection():
-            text = self.text.read()[self.text.marker.select_start():self.text.marker.select_end()]
+            text = self.text.document[self.text.marker.select_start():self.text.marker.select_end()]
             self.root.clipboard_clear()
             self.root.clipboard_append(text)
         return "break"
@@ -1379,7 +1346,7 @@ class Interface(BasicInterface):
     def cut(self, event=None):
         ''' Copies selected text to the clipboard and then deletes it'''
         if self.text.marker.has_selection():
-            text = self.text.read()[self.text.marker.select_start():self.text.marker.select_end()]
+            text = self.text.document[self.text.marker.select_start():self.text.marker.select_end()]
 
             self.root.clipboard_clear()
             self.root.clipboard_append(text)
@@ -1524,6 +1491,10 @@ class Interface(BasicInterface):
 
         self.lang.start()
 
+        # Re-format the text for the new language
+
+        self.text.apply_language_formatting()
+
         return
 
     def set_constraint(self, name):
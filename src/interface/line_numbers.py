@@ -7,21 +7,90 @@ except:
 from ..config import *
 
 class LineNumbers(Tk.Canvas):
+    frame_interval = 30
     def __init__(self, master, *args, **kwargs):
         Tk.Canvas.__init__(self, *args, **kwargs)
         self.textwidget = master
+
+        # Canvas items are created once and moved or updated when the view changes
+
+        self.number_items = [] # [item, line number, position] for each visible line
+
+        self.highlight = self.create_rectangle(0, 0, 0, 0, fill="gray30", outline="gray30", state=Tk.HIDDEN)
+        self.separator = self.create_line(0, 0, 0, 0, fill="gray50")
+
+        # What was last drawn, to tell if anything needs drawing again
+
+        self.view  = None
+        self.peers = None
+
         self.redraw()
 
+    def get_view(self):
+        """ Returns the values that the line numbers depend on: the scroll position,
+            number of lines, font size, row of the local marker and size of the canvas """
+
+        marker = self.textwidget.marker
+
+        return (self.textwidget.yview(),
+                self.textwidget.get_num_lines(),
+                self.textwidget.char_h,
+                marker.row if marker is not None else None,
+                self.winfo_width(),
+                self.winfo_height())
+
+    def get_peer_locations(self):
+        """ Returns the values that the peer labels depend on, other than the view """
+        return tuple((peer.id, peer.index_num, peer.visible) for peer in self.textwidget.peers.values())
+
     def redraw(self, *args):
-        '''Redraws the line numbers at 30 fps'''
-        self.delete("all")
+        '''Checks for changes at 30 fps and only redraws the line numbers and peer labels if needed'''
+
+        view = self.get_view()
+
+        view_changed = view != self.view
+
+        if view_changed:
+
+            self.view = view
+
+            self.draw()
+
+        # Draw peer_lables
+
+        if self.textwidget.is_refreshing is False:
+
+            peers = self.get_peer_locations()
+
+            if view_changed or peers != self.peers:
+
+                self.peers = peers
+
+                self.textwidget.refresh_peer_labels(view_changed)
+
+        self.after(self.frame_interval, self.redraw)
+
+        return
+
+    def draw(self):
+        ''' Moves the canvas items to the visible lines of the text widget '''
 
         i = self.textwidget.index("@0,0")
 
-        self.config(width=self.textwidget.font.measure(str(max(self.textwidget.get_num_lines(), 10))) + 20)
+        width = self.textwidget.font.measure(str(max(self.textwidget.get_num_lines(), 10))) + 20
+
+        if width != int(self.cget("width")):
+
+            self.config(width=width)
 
         w = self.winfo_width() - 5 # Width
 
+        marker_row = self.view[3]
+
+        highlighted = False
+
+        n = 0
+
         while True:
 
             dline=self.textwidget.dlineinfo(i)
@@ -36,32 +105,59 @@ class LineNumbers(Tk.Canvas):
 
             # If the linenum is the currently edited linenumber, highlight
 
-            if self.textwidget.marker is not None:
+            if linenum == marker_row:
+
+                self.coords(self.highlight, 0, y, w, y + h)
+                self.itemconfig(self.highlight, state=Tk.NORMAL)
+
+                highlighted = True
+
+            # Re-use the text items from the last time, only changing what is different
+
+            if n < len(self.number_items):
+
+                item, old_linenum, old_pos = self.number_items[n]
 
-                if linenum == self.textwidget.marker.row:
+                if old_linenum != linenum:
 
-                    x1, y1 = 0, y
-                    x2, y2 = w, y + h
+                    self.itemconfig(item, text=linenum, state=Tk.NORMAL)
 
-                    self.create_rectangle(x1, y1, x2, y2, fill="gray30", outline="gray30")
+                if old_pos != (w, y):
 
-            self.create_text(w - 4, y, anchor="ne",
-                             justify=Tk.RIGHT,
-                             text=linenum,
-                             font="Font",
-                             fill="#d3d3d3")
+                    self.coords(item, w - 4, y)
 
+                self.number_items[n] = [item, linenum, (w, y)]
+
+            else:
+
+                item = self.create_text(w - 4, y, anchor="ne",
+                                        justify=Tk.RIGHT,
+                                        text=linenum,
+                                        font="Font",
+                                        fill="#d3d3d3")
+
+                self.number_items.append([item, linenum, (w, y)])
+
+            n += 1
 
             i = self.textwidget.index("{}+1line".format(i))
 
-        # Draw a line
+        if not highlighted:
 
-        self.create_line(w, 0, w, self.winfo_height(), fill="gray50")
+            self.itemconfig(self.highlight, state=Tk.HIDDEN)
 
-        # Draw peer_lables
+        # Hide any items that are not needed any more
 
-        if self.textwidget.is_refreshing is False:
+        for entry in self.number_items[n:]:
+
+            if entry[1] is not None:
+
+                self.itemconfig(entry[0], state=Tk.HIDDEN)
+
+                entry[1] = None
+
+        # Draw a line
 
-            self.textwidget.refresh_peer_labels()
+        self.coords(self.separator, w, 0, w, self.winfo_height())
 
-        self.after(30, self.redraw)
+        return
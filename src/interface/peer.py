@@ -185,6 +185,11 @@ class Peer:
         self.mark     = self.get_mark_tag(self.id)
         self.bbox     = None
 
+        # Where the label was last placed and the index its bbox was found for
+
+        self.location   = None
+        self.bbox_index = None
+
         # For refreshing the text
         self.hl_eval    = Highlight(self.root, self.code_tag)
         self.hl_select  = Highlight(self.root, self.sel_tag)
@@ -317,7 +322,7 @@ class Peer:
 
         try:
 
-            document_length = len(self.root.read())
+            document_length = len(self.root.document)
 
             # Make sure the location is valid
 
@@ -335,9 +340,7 @@ class Peer:
 
             # Work with tcl indexing e.g. "1.0"
             
-            index = self.root.number_index_to_tcl(loc)
-
-            row, col = [int(val) for val in index.split(".")]
+            row, col = self.root.number_index_to_row_col(loc)
 
             self.row = row
             self.col = col
@@ -361,7 +364,26 @@ class Peer:
 
             return
 
+        if self.update_bbox() is not None:
+
+            # Label can go on top of the cursor
+
+            self.find_overlapping_peers()
+
+        self.place_label()
+
+        return
+
+    def update_bbox(self):
+        """ Looks up where the peer's index is drawn in the text. `self.bbox` is None
+            if it is not on screen """
         self.bbox = self.root.bbox(self.get_tcl_index())
+        self.bbox_index = self.index_num
+        return self.bbox
+
+    def place_label(self):
+        """ Moves the label to the position given by `self.bbox` and `self.raised`, or
+            out of view if the peer is not on screen. Does nothing if it is already there """
 
         if self.bbox is not None:
 
@@ -369,11 +391,7 @@ class Peer:
 
             self.x_val = x - 2
 
-            # Label can go on top of the cursor
-
-            raised = self.find_overlapping_peers()
-
-            if raised:
+            if self.raised:
 
                 self.y_val = (y - height, y - height)
 
@@ -388,8 +406,12 @@ class Peer:
             self.x_val = -100
             self.y_val = (-100, -100)
 
-        self.label.place(x=self.x_val, y=self.y_val[0], anchor="nw")
-        self.insert.place(x=self.x_val, y=self.y_val[1], anchor="nw")
+        if (self.x_val, self.y_val) != self.location:
+
+            self.location = (self.x_val, self.y_val)
+
+            self.label.place(x=self.x_val, y=self.y_val[0], anchor="nw")
+            self.insert.place(x=self.x_val, y=self.y_val[1], anchor="nw")
 
         return
 
@@ -475,10 +497,8 @@ class Peer:
 
     def hide(self):
         """ Moves a label out of view """
-        self.x_val = -100
-        self.y_val = (-100, -100)
-        self.label.place(x=self.x_val, y=self.y_val[0], anchor="nw")
-        self.insert.place(x=self.x_val, y=self.y_val[1], anchor="nw")
+        self.bbox = None
+        self.place_label()
         self.index_num = -1
         self.visible = False
         return 
@@ -550,10 +570,10 @@ class Peer:
         return self.root.number_index_to_tcl(self.index_num)
 
     def get_row(self):
-        return int(self.get_tcl_index().split(".")[0])
+        return self.root.number_index_to_row_col(self.index_num)[0]
 
     def get_col(self):
-        return int(self.get_tcl_index().split(".")[1])
+        return self.root.number_index_to_row_col(self.index_num)[1]
 
     def get_index_num(self):
         """ Returns the index (a single integer) of this peer """
@@ -4,12 +4,15 @@ from ..utils import *
 from ..config import *
 from ..message import *
 from ..interpreter import *
-from ..ot.client import Client as OTClient
+from ..ot.client import Client as OTClient, synchronized
 from ..ot.text_operation import TextOperation, IncompatibleOperationError
+from ..document import Rope, PeerTagMap
 
 from .peer import *
 from .constraints import TextConstraint
 from .colour_merge import ColourMerge
+from .wakeup import Wakeup
+from .highlighter import SyntaxHighlighter
 
 try:
     from Tkinter import *
@@ -27,6 +30,7 @@ import re
 import time
 import sys
 import json
+import zlib
 
 class ThreadSafeText(Text, OTClient):
     is_refreshing = False
@@ -37,6 +41,10 @@ class ThreadSafeText(Text, OTClient):
         Text.__init__(self, root.root, **options)
         OTClient.__init__(self, revision=0)
 
+        # Numbers the operations sent when pipelined
+
+        self.operation_seq = 0
+
         self.constraint = TextConstraint(self)
 
         self.config(undo=True, autoseparators=True, maxundo=50)
@@ -44,6 +52,13 @@ class ThreadSafeText(Text, OTClient):
         self.redo_stack = []
         self.max_undo_size = 50
 
+        # Operations from other peers that the undo stack has not been transformed
+        # against yet, composed into one operation for each run between local edits
+
+        self.undo_history  = []
+        self.undo_offset   = 0
+        self.undo_run_open = False
+
         # If we are blending font colours
 
         self.merge = ColourMerge(self)
@@ -53,6 +68,14 @@ class ThreadSafeText(Text, OTClient):
         self.queue = queue.Queue()
         self.root = root
 
+        # Widget updates that wait until every queued message has been handled
+
+        self.batching           = False
+        self.pending_ranges     = []
+        self.pending_view       = False
+        self.pending_colours    = False
+        self.pending_highlights = False
+
         self.padx = 2
         self.pady = 2
 
@@ -62,6 +85,7 @@ class ThreadSafeText(Text, OTClient):
 
         self.add_handle(MSG_CONNECT,            self.handle_connect)
         self.add_handle(MSG_OPERATION,          self.handle_operation)
+        self.add_handle(MSG_OPERATION_ACK,      self.handle_operation_ack)
         self.add_handle(MSG_SET_MARK,           self.handle_set_mark)
         self.add_handle(MSG_SELECT,             self.handle_select)
         self.add_handle(MSG_EVALUATE_BLOCK,     self.handle_evaluate)
@@ -106,8 +130,12 @@ class ThreadSafeText(Text, OTClient):
 
         # Create 2 docs - one with chars, one with peer ids
 
-        self.document = ""
-        self.peer_tag_doc = ""
+        self.document = Rope()
+        self.peer_tag_doc = PeerTagMap()
+
+        # Syntax highlighting for the lines that change
+
+        self.highlighter = SyntaxHighlighter(self)
 
         # Begin listening for messages
 
@@ -119,7 +147,11 @@ class ThreadSafeText(Text, OTClient):
     # Override OTClient
     def send_operation(self, revision, operation):
         """Should send an operation and its revision number to the server."""
-        message = MSG_OPERATION(self.marker.id, operation.ops, revision)
+        if self.can_pipeline(revision):
+            self.operation_seq += 1
+            message = MSG_PIPELINED_OPERATION(self.marker.id, operation.ops, revision, self.operation_seq)
+        else:
+            message = MSG_OPERATION(self.marker.id, operation.ops, revision)
         return self.root.add_to_send_queue(message)
 
     def apply_operation(self, operation, peer=None, undo=False):
@@ -127,9 +159,9 @@ class ThreadSafeText(Text, OTClient):
 
         if len(operation.ops):
 
-            if len(self.read()) != len(self.peer_tag_doc):
+            if len(self.document) != len(self.peer_tag_doc):
 
-                print("{} {}".format( len(self.read()) , len(self.peer_tag_doc)))
+                print("{} {}".format( len(self.document) , len(self.peer_tag_doc)))
                 print("Document length mismatch, please restart the Troop server.")
                 return
 
@@ -143,31 +175,33 @@ class ThreadSafeText(Text, OTClient):
 
                 self.transform_undo_stacks(operation)
 
+            else:
+
+                self.undo_run_open = False
+
             # Apply op
 
             try:
 
-                new_text = operation(self.read())
+                self.document.apply(operation)
 
             except IncompatibleOperationError as err:
 
                 # Get some debug info
 
-                print("Length of text is {}".format(len(self.read())))
+                print("Length of text is {}".format(len(self.document)))
                 print("Operation is {}".format(operation.ops))
                 print("Length: {}".format(get_operation_size(operation.ops)))
 
                 raise err
 
-            self.set_text(new_text)
-
             self.insert_peer_id(peer, operation.ops)
 
             peer.de_select()
 
-            # -- new
+            # Update the widget with only the characters that changed
 
-            self.refresh()
+            self.render_operation(operation, peer)
 
         return
 
@@ -205,8 +239,7 @@ class ThreadSafeText(Text, OTClient):
 
     def insert_peer_id(self, peer, ops):
         """ Applies a text operation to the `peer_tag_doc` which contains information about which character relates to which peers """
-        operation = TextOperation(self.get_peer_loc_ops(peer, ops))
-        self.peer_tag_doc = operation(self.peer_tag_doc)
+        self.peer_tag_doc.apply(ops, peer.id)
         return
 
     def get_state(self):
@@ -217,10 +250,11 @@ class ThreadSafeText(Text, OTClient):
         """ Returns a list of peers currently connected """
         return [peer for peer in self.peers.values() if peer.connected]
 
-    def transform(self, op1, op2):
-        """ Transforms two TextOperations and adjusts the first for the length of the document"""
+    def transform(self, op1, op2, size=None):
+        """ Transforms two TextOperations and adjusts the first for the length of the document,
+            or `size` if the second operation was applied to a document of a different length """
         try:
-            size = max(get_doc_size(op1.ops), len(self.read()))
+            size = max(get_doc_size(op1.ops), len(self.document) if size is None else size)
             new_op1 = TextOperation(new_operation(*(list(op1.ops) + [size])))
             new_op2 = TextOperation(new_operation(*(list(op2.ops) + [size])))
             return TextOperation.transform(new_op1, new_op2)
@@ -228,18 +262,36 @@ class ThreadSafeText(Text, OTClient):
             print("Error transforming {} and {}".format(new_op1, new_op2))
             raise e
 
+    def get_undo_revision(self):
+        """ Returns the position in `undo_history` of the next run of operations from other peers """
+        return self.undo_offset + len(self.undo_history)
+
     def transform_undo_stacks(self, operation):
-        """ Transforms operations in the undo_stack so their locations are adjusted after other
-            operations are applied to the text """
+        """ Records an operation from another peer so that the undo stack can be transformed
+            against it when it is next used. Consecutive operations are composed into one. """
         if len(self.undo_stack):
-            self.undo_stack = [self.transform(action, operation)[0] for action in self.undo_stack if len(action.ops)]
+            if self.undo_run_open:
+                composed, size = self.undo_history[-1]
+                self.undo_history[-1] = (composed.compose(operation, keep_order=True), size)
+            else:
+                self.undo_history.append((operation, len(self.document)))
+                self.undo_run_open = True
+        return
+
+    def trim_undo_history(self):
+        """ Discards the operations that are older than every action in the undo stack """
+        start = self.undo_stack[0][0] if len(self.undo_stack) else self.get_undo_revision()
+        if start > self.undo_offset:
+            del self.undo_history[:start - self.undo_offset]
+            self.undo_offset = start
         return
 
     def add_to_undo_stacks(self, operation, document, undo=False, redo=False):
         """ Adds the inverse of an operation to the undo stack """
         # Keep track of operations for use in undo
         if not undo:
-            self.undo_stack = self.undo_stack[-self.max_undo_size:] + [operation.invert(document)]
+            self.undo_stack = self.undo_stack[-self.max_undo_size:] + [(self.get_undo_revision(), operation.invert(document))]
+            self.trim_undo_history()
             if not redo:
                 self.redo_stack = []
         else:
@@ -247,8 +299,17 @@ class ThreadSafeText(Text, OTClient):
         return
 
     def get_undo_operation(self):
-        """ Gets the last operation from the undo stack """
-        return self.undo_stack.pop()
+        """ Gets the last operation from the undo stack, transformed against the operations
+            from other peers since it was added. Actions whose text has since been removed
+            by other peers are skipped. """
+        while True:
+            revision, action = self.undo_stack.pop()
+            for operation, size in self.undo_history[revision - self.undo_offset:]:
+                action = self.transform(action, operation, size)[0]
+            if not empty_operation(action.ops) or len(self.undo_stack) == 0:
+                break
+        self.trim_undo_history()
+        return action
 
     def get_redo_operation(self):
         """ Gets the last operation from the undo stack """
@@ -296,9 +357,10 @@ class ThreadSafeText(Text, OTClient):
             self.root.block_messages = False
         return
 
-    def handle_operation(self, message, client=False):
+    def handle_operation(self, message, client=False, count=1):
         """ Forwards the operation message to the correct handler based on whether it
-            was sent by the client or server """
+            was sent by the client or server. `count` is the number of operations from
+            the server that have been composed into the message """
 
         if client:
 
@@ -326,6 +388,8 @@ class ThreadSafeText(Text, OTClient):
 
                 self.apply_server(operation)
 
+                self.revision += count - 1
+
                 if get_operation_size(message["operation"]) != 0:
 
                     # If the operation is delete/insert, change the indexes of peers that are based after this one
@@ -344,8 +408,16 @@ class ThreadSafeText(Text, OTClient):
 
                 # Return to old view
 
-                self.reset_view()
+                if not self.batching:
 
+                    self.reset_view()
+
+        return
+
+    def handle_operation_ack(self, message):
+        """ The server has applied our oldest unacknowledged operation """
+        self.server_ack()
+        self.revision = message["revision"]
         return
 
     def handle_set_mark(self, message):
@@ -360,7 +432,10 @@ class ThreadSafeText(Text, OTClient):
         peer = self.get_peer(message)
         if peer:
             peer.select_set(message["start"], message["end"])
-            self.update_colours()
+            if self.batching:
+                self.pending_colours = True
+            else:
+                self.update_colours()
         return
 
     def handle_evaluate(self, message):
@@ -398,11 +473,15 @@ class ThreadSafeText(Text, OTClient):
     def handle_set_all(self, message):
         ''' Sets the contents of the text box and updates the location of peer markers '''
 
-        self.reset() # inherited from OTClient
+        self.reset(message["revision"]) # inherited from OTClient
 
-        self.document = message["document"]
+        self.document = Rope(message["document"])
 
-        self.peer_tag_doc = self.create_peer_tag_doc(message["peer_tag_loc"])
+        self.peer_tag_doc = PeerTagMap.from_list(message["peer_tag_loc"])
+
+        # Operations after this cannot be composed with the ones before
+
+        self.undo_run_open = False
 
         self.refresh()
 
@@ -417,8 +496,7 @@ class ThreadSafeText(Text, OTClient):
         return
 
     def handle_soft_reset(self, message):
-        """ Sets the revision number to 0 and sets the document contents """
-        self.revision = 0
+        """ Sets the revision number and the document contents """
         return self.handle_set_all(message)
 
     def handle_kill(self, message):
@@ -462,13 +540,13 @@ class ThreadSafeText(Text, OTClient):
 
     def set_text(self, string):
         """ Sets the contents of the textbox to string"""
-        self.document = string
+        self.document = Rope(string)
         # self.refresh()
         return
 
     def read(self):
         """ Returns the entire contents of the text box as a string """
-        return self.document
+        return str(self.document)
 
     def readlines(self):
         """ Returns the entire document as a list in which each element is a line from the text"""
@@ -498,7 +576,7 @@ class ThreadSafeText(Text, OTClient):
 
         # print("Peer '{}' applying operation of size '{}' at index '{}'".format(str(peer), shift, index))
 
-        doc_size = len(self.read())
+        doc_size = len(self.document)
 
         for other in self.peers.values():
 
@@ -538,21 +616,15 @@ class ThreadSafeText(Text, OTClient):
 
                     other.refresh()
 
-        self.update_colours()
+        if self.batching:
 
-        return
+            self.pending_highlights = True
 
-    def create_peer_tag_doc(self, locations):
-        """ Re-creates the document of peer_id markers """
-        s = []
-        for peer_id, length in locations:
-            s.append("{}".format(get_peer_char(peer_id)) * int(length))
-        return "".join(s)
+        else:
 
-    def get_peer_loc_ops(self, peer, ops):
-        """ Converts a list of operations on the main document to inserting the peer ID """
-        # return [str(peer.id) * len(val) if isinstance(val, str) else val for val in ops]
-        return [peer.char * len(val) if isinstance(val, str) else val for val in ops]
+            self.refresh_highlights()
+
+        return
 
     def get_peer(self, message):
         """ Retrieves the Peer instance using the "src_id" of message """
@@ -574,25 +646,21 @@ class ThreadSafeText(Text, OTClient):
     def update_colours(self):
         """ Sets the peer tags in the text document """
 
-        processed = []
-
         # Go through connected peers and colour the text
 
         for p_id, peer in self.peers.items():
 
-            processed.append(peer.char)
-
             self.update_peer_tag(p_id)
 
             peer.refresh_highlight()
 
         # If there are any other left over peers, keep their colours
 
-        for p_id in set(self.peer_tag_doc):
+        for p_id in self.peer_tag_doc.peers():
 
-            if str(p_id) not in processed:
+            if p_id not in self.peers:
 
-                self.update_peer_tag(get_peer_id_from_char(p_id))
+                self.update_peer_tag(p_id)
 
         return
 
@@ -613,7 +681,7 @@ class ThreadSafeText(Text, OTClient):
 
         self.tag_remove(text_tag, "1.0", END)
 
-        for start, end in get_peer_locs(get_peer_char(p_id), self.peer_tag_doc):
+        for start, end in self.peer_tag_doc.ranges(int(p_id)):
 
             self.tag_add(text_tag, self.number_index_to_tcl(start), self.number_index_to_tcl(end))
 
@@ -623,15 +691,31 @@ class ThreadSafeText(Text, OTClient):
     # =================
 
     def put(self, message):
-        """ Checks if a message from a new user then writes a network message to the queue """
+        """ Writes a network message to the queue and wakes the Tkinter loop to handle it.
+            Called from the receiver thread """
         assert isinstance(message, MESSAGE)
         self.queue.put(message)
+        self.wakeup.set()
         return
 
     def listen(self):
-        """ Continuously reads from the queue of messages read from the server
-            and carries out the specified actions. """
+        """ Handles messages read from the server as soon as they are added to the queue,
+            instead of checking the queue at a fixed interval """
+
+        self.wakeup = Wakeup(self, self.process_queue)
+
+        self.process_queue()
+
+        return
+
+    def process_queue(self):
+        """ Handles every message in the queue, then updates the widget once for the
+            whole batch. Called by `self.wakeup` when messages have been added """
+
+        messages = []
+
         try:
+
             while True:
 
                 # Pop the message from the queue
@@ -644,11 +728,34 @@ class ThreadSafeText(Text, OTClient):
 
                     self.root.log_message(msg)
 
+                messages.append(msg)
+
+        # Break when the queue is empty
+        except queue.Empty:
+
+            pass
+
+        if len(messages) == 0:
+
+            return
+
+        self.batching = True
+
+        try:
+
+            for msg, count in self.coalesce_operations(messages):
+
                 # Get the handler method and call
 
                 try:
 
-                    self.handle(msg)
+                    if count > 1:
+
+                        self.handle_operation(msg, count=count)
+
+                    else:
+
+                        self.handle(msg)
 
                 except Exception as e:
 
@@ -666,19 +773,87 @@ class ThreadSafeText(Text, OTClient):
                     print("Exception occurred in message {!r}: {!r} {!r}".format(func, type(e), e))
                     raise(e)
 
-                # Update any other idle tasks
+        finally:
 
-                self.update_idletasks()
+            self.batching = False
 
-        # Break when the queue is empty
-        except queue.Empty:
+            self.render_batch()
 
-            pass
+        return
+
+    def coalesce_operations(self, messages):
+        """ Returns a list of (message, count) tuples where each run of consecutive
+            operations from the same peer has been composed into one message, as long
+            as the result is still a single insert or delete that leaves the peer's
+            marker in the same place """
+
+        batch = []
+
+        for msg in messages:
+
+            if msg.type == MSG_OPERATION.type and msg["src_id"] != self.marker.id and len(batch):
+
+                last, count = batch[-1]
+
+                if last.type == MSG_OPERATION.type and last["src_id"] == msg["src_id"]:
+
+                    try:
+
+                        operation = TextOperation(last["operation"]).compose(TextOperation(msg["operation"]))
+
+                    except IncompatibleOperationError:
+
+                        operation = None
+
+                    # The peer's marker must end up where the last operation leaves it
+
+                    if operation is not None and operation.get_edit() is not None and get_operation_index(operation.ops) == get_operation_index(msg["operation"]):
+
+                        batch[-1] = (MSG_OPERATION(msg["src_id"], operation.ops, msg["revision"]), count + 1)
+
+                        continue
+
+            batch.append((msg, 1))
+
+        return batch
+
+    def render_batch(self):
+        """ Re-formats the lines changed by the last batch of messages and updates
+            the colours, highlights and view once """
+
+        self.colour_ranges(self.pending_ranges)
+
+        if self.pending_colours:
+
+            self.update_colours()
+
+        elif self.pending_highlights:
+
+            self.refresh_highlights()
+
+        if self.pending_view:
+
+            self.reset_view()
+
+        self.pending_ranges     = []
+        self.pending_view       = False
+        self.pending_colours    = False
+        self.pending_highlights = False
+
+        # Update any other idle tasks
+
+        self.update_idletasks()
 
-        # Recursive call
-        self.after(30, self.listen)
         return
 
+    def get_resume_state(self):
+        """ Returns the revision and the checksum of the document to give the server
+            when reconnecting. The checksum is -1 if the server has not acknowledged
+            all of our operations, in which case the document is sent again. """
+        if self.state is not synchronized:
+            return self.revision, -1
+        return self.revision, zlib.crc32(str(self.document).encode("utf-8"))
+
     def refresh(self):
         """ Clears the text box and loads the current document state, called after an operation """
 
@@ -689,62 +864,158 @@ class ThreadSafeText(Text, OTClient):
         
         # Remove all the text and insert new text
         self.clear()
-        self.insert("1.0", self.document)
+        self.insert("1.0", str(self.document))
 
         # Update the  colours and formatting
         self.update_colours()
         self.apply_language_formatting()
 
+        # Every line has been formatted
+        self.pending_ranges = []
+
         self.is_refreshing = False
         
         return
 
-    def refresh_peer_labels(self):
-        ''' Updates the locations of the peers to their marks. Called from line_numbers on repeat '''
-        
-        for peer_id, peer in self.peers.items():
-             
-             peer.redraw()
-        
+    def render_operation(self, operation, peer):
+        """ Applies an operation that has been applied to `self.document` to the contents of the Tk
+            widget using targeted inserts and deletes, then re-formats only the lines it touched.
+            While a batch of messages is being handled the lines are re-formatted afterwards """
+
+        self.is_refreshing = True
+
+        # Keep the view from before the first change in a batch
+
+        if not self.pending_view:
+
+            self.store_view()
+
+            self.pending_view = self.batching
+
+        # The document already contains the operation so indices before the current
+        # position are the same in the widget and the document
+
+        index  = 0
+        ranges = []
+
+        for op in operation:
+
+            if isinstance(op, str):
+
+                start = self.number_index_to_tcl(index)
+
+                self.insert(start, op, peer.text_tag)
+
+                ranges.append((index, index + len(op)))
+
+                index += len(op)
+
+            elif op > 0:
+
+                index += op
+
+            else:
+
+                start = self.number_index_to_tcl(index)
+
+                self.delete(start, "{}+{}c".format(start, -op))
+
+                ranges.append((index, index))
+
+        if len(ranges):
+
+            self.highlighter.move_lines(self.number_index_to_row_col(ranges[0][0])[0], self.number_index_to_row_col(ranges[-1][1])[0])
+
+        if self.batching:
+
+            # Move the text changed earlier in the batch to where it is now
+
+            self.pending_ranges = [(transform_index(operation.ops, start), transform_index(operation.ops, end, True)) for start, end in self.pending_ranges] + ranges
+
+        else:
+
+            self.colour_ranges(ranges)
+
+        self.is_refreshing = False
+
         return
 
-    # handling key events
+    def colour_ranges(self, ranges):
+        """ Re-formats the lines that contain any of the (start, end) character ranges """
 
-    def apply_language_formatting(self):
-         """ Iterates over each line in the text and updates the correct colour / formatting """
-         for line,  _ in enumerate(self.readlines()):
-             self.colour_line(line + 1)
-         return
+        rows = set()
+
+        for start, end in ranges:
+
+            rows.update(range(self.number_index_to_row_col(start)[0], self.number_index_to_row_col(end)[0] + 1))
+
+        self.highlighter.highlight(rows)
+
+        return
+
+    def refresh_highlights(self):
+        """ Re-applies peers' selection and evaluation highlights """
+        for peer in self.peers.values():
+            peer.refresh_highlight()
+        return
 
-    def colour_line(self, line):
-        """ Embold keywords defined in `Interpreter.py` """
+    def refresh_peer_labels(self, view_changed=True):
+        ''' Updates the locations of the peers' labels. Called from line_numbers when the view or
+            a peer's location has changed. Peers are only looked up in the widget if they have
+            moved or `view_changed` is True, and labels are only placed again if they have moved '''
 
-        # Get contents of the line
+        rows = {}
 
-        start, end = "{}.0".format(line), "{}.end".format(line)
+        for peer in self.peers.values():
 
-        string = self.get(start, end)
+            if peer.visible:
 
-        # Go through the possible tags
+                if view_changed or peer.bbox_index != peer.index_num:
 
-        for tag_name, tag_finding_func in self.root.lang.re.items():
+                    peer.update_bbox()
 
-            self.tag_remove(tag_name, start, end)
+                if peer.bbox is not None:
 
-            for match_start, match_end in tag_finding_func(string):
+                    rows.setdefault(peer.bbox[1], []).append(peer)
 
-                tag_start = "{}.{}".format(line, match_start)
-                tag_end   = "{}.{}".format(line, match_end)
+        # A label is raised if it would cover the label of a peer to its right on the same
+        # row, unless that label is raised too. Working from right to left, the nearest
+        # label to the right that is not raised is the only one that needs checking
 
-                self.tag_add(tag_name, tag_start, tag_end)
+        for row in rows.values():
+
+            row.sort(key=lambda peer: peer.index_num, reverse=True)
+
+            lowered = None
+
+            for peer in row:
+
+                peer.raised = lowered is not None and lowered - peer.index_num < len(str(peer))
+
+                if not peer.raised:
+
+                    lowered = peer.index_num
+
+        for peer in self.peers.values():
+
+            if peer.visible:
+
+                peer.place_label()
 
         return
 
+    # handling key events
+
+    def apply_language_formatting(self):
+         """ Updates the colour / formatting of every line in the text """
+         self.highlighter.highlight()
+         return
+
     def highlight_brackets(self, bracket):
         """ Call this with a bracket """
 
         index = self.marker.get_index_num() - 1
-        assert self.read()[index] == bracket
+        assert self.document[index] == bracket
 
         start = self.find_starting_bracket(index - 1, self.right_brackets[bracket], bracket)
 
@@ -871,34 +1142,25 @@ class ThreadSafeText(Text, OTClient):
         """ Takes a tcl index e.g. '1.0' and returns the single number it represents if the
             text contents were a single list """
         row, col = [int(val) for val in self.index(index).split(".")]
-        return sum([len(line) + 1 for line in self.read().split("\n")[:row-1]]) + col
+        if row > self.document.count_lines():
+            return len(self.document)
+        return self.document.line_start(row - 1) + col
 
 
     def number_index_to_tcl(self, number):
         """ Takes an integer number and returns the tcl index in the from 'row.col' """
-        if number <= 0:
-            return "1.0"
-        text = self.read()
-        # Count columns until a newline, then reset and add 1 to row
-        count = 0; row = 1; col = 0
-        for i in range(1, len(text)+1):
-            char = text[i-1]
-            if char == "\n":
-                row += 1
-                col = 0
-            else:
-                col += 1
-            if i >= number:
-                break
-        return "{}.{}".format(row, col)
+        return "{}.{}".format(*self.number_index_to_row_col(number))
 
     def get_num_lines(self):
         return int(self.index(END).split(".")[0]) - 1
 
     def number_index_to_row_col(self, number):
         """ Takes an integer number and returns the row and column as integers """
-        tcl_index = self.number_index_to_tcl(number)
-        return tuple(int(x) for x in tcl_index.split("."))
+        if number <= 0:
+            return 1, 0
+        number = min(number, len(self.document))
+        line = self.document.line_of(number)
+        return line + 1, number - self.document.line_start(line)
 
     def get_line_contents(self, line):
         """ Returns the contents of a line specified by an integer """
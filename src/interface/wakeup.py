@@ -0,0 +1,123 @@
+"""
+    interface/wakeup.py
+    -------------------
+
+    Lets other threads wake the Tkinter loop to run a callback as soon as
+    there is work for it, instead of the loop checking at a fixed interval.
+
+"""
+
+from __future__ import absolute_import
+
+try:
+    import Tkinter as Tk
+except ImportError:
+    import tkinter as Tk
+
+import os
+
+from threading import Lock
+
+class Wakeup:
+    """ Calls `callback` in the Tkinter thread after `set()` has been called from
+        any thread. Calls to `set()` made before the callback runs are merged into
+        one. A byte written to a pipe that Tkinter watches with a file handler wakes
+        the loop. Where file handlers are not supported (Windows) the flag is checked
+        every `poll_interval` milliseconds instead. """
+    poll_interval = 30
+    def __init__(self, widget, callback):
+
+        self.widget   = widget
+        self.callback = callback
+
+        self.pending = False
+        self.lock    = Lock()
+
+        self.read_fd  = None
+        self.write_fd = None
+
+        if os.name != "nt" and hasattr(widget.tk, "createfilehandler"):
+
+            self.read_fd, self.write_fd = os.pipe()
+
+            os.set_blocking(self.read_fd, False)
+            os.set_blocking(self.write_fd, False)
+
+            widget.tk.createfilehandler(self.read_fd, Tk.READABLE, self.on_readable)
+
+        else:
+
+            self.poll()
+
+    def set(self):
+        """ Asks for the callback to be run. Safe to call from any thread """
+
+        with self.lock:
+
+            if self.pending:
+
+                return
+
+            self.pending = True
+
+        if self.write_fd is not None:
+
+            try:
+
+                os.write(self.write_fd, b"\0")
+
+            except (BlockingIOError, OSError):
+
+                pass # The loop has already been woken, or the pipe is closed
+
+        return
+
+    def run(self):
+        """ Clears the flag then runs the callback, so that `set()` called while the
+            callback is running wakes the loop again """
+
+        with self.lock:
+
+            self.pending = False
+
+        self.callback()
+
+        return
+
+    def on_readable(self, fd, mask):
+        """ Called by Tkinter when the pipe has been written to """
+
+        try:
+
+            os.read(self.read_fd, 4096)
+
+        except (BlockingIOError, OSError):
+
+            pass
+
+        return self.run()
+
+    def poll(self):
+        """ Checks the flag at a fixed interval where file handlers are not available """
+
+        if self.pending:
+
+            self.run()
+
+        self.widget.after(self.poll_interval, self.poll)
+
+        return
+
+    def close(self):
+        """ Stops watching the pipe """
+
+        if self.read_fd is not None:
+
+            self.widget.tk.deletefilehandler(self.read_fd)
+
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+
+            self.read_fd = self.write_fd = None
+
+        return
@@ -52,6 +52,8 @@ def colour_format(text, colour):
 
 class DummyInterpreter:
     name = None
+    block_comments = () # (start, end) pairs of comments or strings that can span lines
+    string_chars = ('"', "'") # characters that open and close a string
     def __init__(self, *args, **kwargs):
         self.re={}
 
@@ -63,6 +65,9 @@ class DummyInterpreter:
 
             self.re = {"tag_bold": self.syntax_lang.find_keyword, "tag_italic": self.syntax_lang.find_comment}
 
+            self.block_comments = self.syntax_lang.block_comments
+            self.string_chars = self.syntax_lang.string_chars
+
             self.syntax_lang.setup()
 
         else:
@@ -328,6 +333,7 @@ class FoxDotInterpreter(BuiltinInterpreter):
     filetype=".py"
     path = "{} -u -m FoxDot --pipe".format(PYTHON_EXECUTABLE)
     name = "FoxDot"
+    block_comments = (('"""', '"""'), ("'''", "'''"))
 
     @classmethod
     def setup(cls):
@@ -368,6 +374,8 @@ class TidalInterpreter(BuiltinInterpreter):
     path = 'ghci'
     filetype = ".tidal"
     name = "TidalCycles"
+    block_comments = (("{-", "-}"),)
+    string_chars = ('"',) # a ' can be part of a name, as in every'
 
     def start(self):
 
@@ -422,7 +430,7 @@ class TidalInterpreter(BuiltinInterpreter):
     def find_comment(cls, string):
         instring, instring_char = False, ""
         for i, char in enumerate(string):
-            if char in ('"', "'"):
+            if char in cls.string_chars:
                 if instring:
                     if char == instring_char:
                         instring = False
@@ -491,6 +499,7 @@ class SuperColliderInterpreter(OSCInterpreter):
     host = 'localhost'
     port = 57120
     name = "SuperCollider"
+    block_comments = (("/*", "*/"),)
 
     def new_osc_message(self, string):
         """ Returns OSC message for Troop Quark """
@@ -5,6 +5,21 @@
     Messages are sent as a series of arguments surrounnded by
     <arrows><like><so>.
 
+    Clients that request `FEATURE_FRAMED` when logging in use a
+    length-prefixed format instead: a 4 byte big-endian payload length
+    followed by the message arguments as a compact JSON array.
+
+    Clients that request `FEATURE_COMPRESSED` send and receive everything
+    after logging in as one zlib stream in each direction, which is flushed
+    after every write.
+
+    Clients that request `FEATURE_PIPELINED` send operations as
+    MSG_PIPELINED_OPERATION without waiting for the previous one to be
+    acknowledged. The server sends every other client a MSG_OPERATION.
+
+    Clients that request `FEATURE_COMPACT_ACK` are sent a MSG_OPERATION_ACK
+    for their own operations instead of the operation itself.
+
 """
 
 from __future__ import absolute_import
@@ -12,6 +27,17 @@ from __future__ import absolute_import
 import re
 import inspect
 import json
+import struct
+import zlib
+
+# Optional wire features, requested by the client in MSG_PASSWORD
+
+FEATURE_FRAMED      = 1
+FEATURE_COMPRESSED  = 2
+FEATURE_PIPELINED   = 4
+FEATURE_COMPACT_ACK = 8
+
+FRAME_HEADER = struct.Struct(">I")
 
 def escape_chars(s):
     return s.replace(">", "\>").replace("<", "\<")
@@ -20,9 +46,15 @@ def unescape_chars(s):
     return s.replace("\>", ">").replace("\<", "<")
 
 class NetworkMessageReader:
-    def __init__(self):
+    """ Reads messages in the <arrows><like><so> format. If `defaults` is True, a
+        message at the end of the data that is missing trailing arguments with
+        default values is read using the defaults, so that a login from an older
+        version can be read. Only use this for a message that the sender waits
+        for a reply to. """
+    def __init__(self, defaults=False):
         self.string = ""
         self.re_msg = re.compile(r"<(.*?>?)>(?=<|$)", re.DOTALL)
+        self.defaults = defaults
 
     def findall(self, string):
         """ Returns all values in a message as a list """
@@ -48,8 +80,9 @@ class NetworkMessageReader:
         # Join with any existing text
         full_message = self.string + string
 
-        # Identify message tags
-        data = self.findall(full_message)
+        # Identify message tags and where each one ends
+        matches = list(self.re_msg.finditer(full_message))
+        data = [match.group(1) for match in matches]
 
         # i is the data, pkg  is the list of messages
         i, pkg = 0, []
@@ -65,7 +98,11 @@ class NetworkMessageReader:
 
             # This tells us how many following items are arguments of this message
 
-            j = len(cls.header())
+            j = len(cls.keys)
+
+            if self.defaults and cls.required <= len(data) - i < j:
+
+                j = len(data) - i
 
             try:
 
@@ -81,7 +118,7 @@ class NetworkMessageReader:
 
                 # Keep track of how much of the string we have processed
 
-                length += len(str(pkg[-1]))
+                length = matches[i + j - 1].end()
 
             except IndexError:
 
@@ -105,20 +142,148 @@ class NetworkMessageReader:
         return pkg
 
 
+class FramedMessageReader:
+    """ Reads length-prefixed messages (see `FEATURE_FRAMED`). Incoming bytes are
+        appended to a single buffer and each frame is decoded in place, so the cost
+        of `feed` only depends on the amount of new data. """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """ Adds bytes read from a connection and returns the complete messages within.
+            Any incomplete frame is kept until the next call to `feed`. """
+
+        if len(data) == 0:
+
+            raise EmptyMessageError()
+
+        self.buffer += data.encode("utf-8") if isinstance(data, str) else data
+
+        pkg = []
+        offset = 0
+        size = len(self.buffer)
+
+        with memoryview(self.buffer) as view:
+
+            while size - offset >= FRAME_HEADER.size:
+
+                length, = FRAME_HEADER.unpack_from(view, offset)
+
+                start = offset + FRAME_HEADER.size
+                end   = start + length
+
+                # Wait for the rest of the frame
+
+                if end > size:
+
+                    break
+
+                values = json.loads(str(view[start:end], "utf-8"))
+
+                try:
+
+                    pkg.append(MESSAGE.from_values(values))
+
+                except (KeyError, TypeError) as e:
+
+                    # Debug info
+
+                    print( "Could not read message {}: {}".format(values, e) )
+
+                offset = end
+
+        # Discard the frames we have read
+
+        del self.buffer[:offset]
+
+        return pkg
+
+
+class CompressedMessageReader:
+    """ Decompresses a connection's zlib stream (see `FEATURE_COMPRESSED`) and
+        passes the result on to the reader for the wire format """
+    def __init__(self, reader):
+        self.reader = reader
+        self.zlib   = zlib.decompressobj()
+
+    def feed(self, data):
+        """ Adds bytes read from a connection and returns the complete messages within """
+
+        if len(data) == 0:
+
+            raise EmptyMessageError()
+
+        data = self.zlib.decompress(data)
+
+        # Wait for the rest of a compressed block
+
+        if len(data) == 0:
+
+            return []
+
+        return self.reader.feed(data)
+
+
+class StreamCompressor:
+    """ Compresses the bytes written to a connection as one zlib stream, so that
+        small messages can refer back to the text of earlier ones. Each write is
+        flushed so that it can be decompressed as soon as it arrives. """
+    def __init__(self, level=6):
+        self.zlib = zlib.compressobj(level)
+
+    def compress(self, data):
+        return self.zlib.compress(data) + self.zlib.flush(zlib.Z_SYNC_FLUSH)
+
+
+def get_message_reader(features=0):
+    """ Returns a reader for the wire format agreed when logging in """
+    if features & FEATURE_FRAMED:
+        reader = FramedMessageReader()
+    else:
+        reader = NetworkMessageReader()
+    if features & FEATURE_COMPRESSED:
+        reader = CompressedMessageReader(reader)
+    return reader
+
+
+def get_stream_compressor(features=0):
+    """ Returns a StreamCompressor if the connection uses `FEATURE_COMPRESSED`, otherwise None """
+    if features & FEATURE_COMPRESSED:
+        return StreamCompressor()
+    return None
+
+
 class MESSAGE(object):
-    """ Abstract base class """
-    data = {}
-    keys = []
-    type = None
-    def __init__(self, src_id, msg_id=0):
-        self.data = {'src_id' : int(src_id), "type" : self.type, "msg_id": msg_id}
-        self.keys = ['type', 'msg_id', 'src_id']
+    """ Abstract base class. The values of a message are stored in a list in the
+        order given by `keys`, which is worked out from the arguments of `__init__`
+        once for each class, and can be accessed by name like a dictionary.
+
+        The bytes returned by `encode` are cached for each wire format until a field
+        is set again, so a message sent to many clients is only serialized once.
+        Values must not be changed in place after being encoded. """
+    __slots__ = ("values", "encoded")
+    keys  = ("type", "msg_id", "src_id")
+    index = {key: i for i, key in enumerate(keys)}
+    type  = None
+    required = len(keys) # The number of values without a default
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        params = list(inspect.signature(cls.__init__).parameters.values())[1:]
+        cls.keys  = ("type", "msg_id") + tuple(param.name for param in params)
+        cls.index = {key: i for i, key in enumerate(cls.keys)}
+        cls.required = 2 + sum(1 for param in params if param.default is param.empty)
+
+    def __init__(self, src_id, *values):
+        self.values  = [self.type, 0, int(src_id), *values]
+        self.encoded = None
 
     def __str__(self):
-        return "".join([self.format(item) for item in self])
+        return "".join([self.format(item) for item in self.values])
 
     def set_msg_id(self, value):
-        self.data["msg_id"] = int(value)
+        self.values[1] = int(value)
+        self.encoded = None
 
     @staticmethod
     def format(value):
@@ -127,6 +292,31 @@ class MESSAGE(object):
     def bytes(self):
         return str(self).encode("utf-8")
 
+    def frame(self):
+        """ Returns the message as a length-prefixed JSON array """
+        payload = json.dumps(self.values, separators=(",", ":")).encode("utf-8")
+        return FRAME_HEADER.pack(len(payload)) + payload
+
+    def encode(self, features=0):
+        """ Returns the bytes to send over a connection using `features`, before
+            any compression """
+        features &= FEATURE_FRAMED
+        if self.encoded is None:
+            self.encoded = {}
+        data = self.encoded.get(features)
+        if data is None:
+            data = self.frame() if features & FEATURE_FRAMED else self.bytes()
+            self.encoded[features] = data
+        return data
+
+    @staticmethod
+    def from_values(values):
+        """ Creates a message from a list of values in the order given by `header` """
+        cls = MESSAGE_TYPE[int(values[0])]
+        msg = cls(*values[2:])
+        msg.set_msg_id(values[1])
+        return msg
+
     def raw_string(self):
         return "<{}>".format(self.type) + "".join(["<{}>".format(repr(item)) for item in self])
         
@@ -134,40 +324,40 @@ class MESSAGE(object):
         return str(self)
 
     def __len__(self):
-        return len(self.data)
+        return len(self.values)
 
     def info(self):
         return self.__class__.__name__ + str(tuple(self))
 
     def __iter__(self):
-        for key in self.keys:
-            yield self.data[key]
+        return iter(self.values)
+
+    @property
+    def data(self):
+        return self.dict()
 
     def dict(self):
-        return self.data
+        """ Returns a new dictionary of the message's keys and values """
+        return dict(zip(self.keys, self.values))
 
     def __getitem__(self, key):
-        return self.data[key]
+        return self.values[self.index[key]]
 
     def __setitem__(self, key, value):
-        if key not in self.keys:
-            self.keys.append(key)
-        self.data[key] = value
+        self.values[self.index[key]] = value
+        self.encoded = None
 
     def __contains__(self, key):
-        return key in self.data
+        return key in self.index
 
     def __eq__(self, other):
         if isinstance(other, MESSAGE):
-            return self.type == other.type and self.data == other.data
+            return self.type == other.type and self.values == other.values
         else:
             return False
 
     def __ne__(self, other):
-        if isinstance(other, MESSAGE):
-            return self.type != other or self.data != other.data
-        else:
-            return True
+        return not self == other
 
     @staticmethod
     def compile(*args):
@@ -179,125 +369,127 @@ class MESSAGE(object):
 
     @classmethod
     def header(cls):
-        # args = inspect.getargspec(cls.__init__).args
-        # args[0] = 'type'
-        args = ['type', 'msg_id'] + inspect.getargspec(cls.__init__).args[1:]
-        return args
+        return list(cls.keys)
 
 # Define types of message
         
 class MSG_CONNECT(MESSAGE):
     type = 1
-    def __init__(self, src_id, name, hostname, port, dummy=False):
-        MESSAGE.__init__(self, src_id)
-        self['name']      = str(name)
-        self['hostname']  = str(hostname)
-        self['port']      = int(port)
-        self['dummy']     = int(dummy)
+    __slots__ = ()
+    def __init__(self, src_id, name, hostname, port, dummy=False, revision=-1, checksum=-1):
+        MESSAGE.__init__(self, src_id, str(name), str(hostname), int(port), int(dummy), int(revision), int(checksum))
 
 class MSG_OPERATION(MESSAGE):
     type = 2
+    __slots__ = ()
     def __init__(self, src_id, operation, revision):
-        MESSAGE.__init__(self, src_id)
-        self["operation"] = [str(item) if not isinstance(item, int) else item for item in operation]
-        self["revision"]  = int(revision)
+        MESSAGE.__init__(self, src_id, [str(item) if not isinstance(item, int) else item for item in operation], int(revision))
 
 class MSG_SET_MARK(MESSAGE):
     type = 3
+    __slots__ = ()
     def __init__(self, src_id, index, reply=1):
-        MESSAGE.__init__(self, src_id)
-        self['index'] = int(index)
-        self['reply'] = int(reply)
+        MESSAGE.__init__(self, src_id, int(index), int(reply))
 
 class MSG_PASSWORD(MESSAGE):
     type = 4
-    def __init__(self, src_id, password, name, version):
-        MESSAGE.__init__(self, src_id)
-        self['password']=str(password)
-        self['name']=str(name)
-        self['version']=str(version)
+    __slots__ = ()
+    def __init__(self, src_id, password, name, version, features=0):
+        MESSAGE.__init__(self, src_id, str(password), str(name), str(version), int(features))
 
 class MSG_REMOVE(MESSAGE):
     type = 5
+    __slots__ = ()
     def __init__(self, src_id):
         MESSAGE.__init__(self, src_id)
 
 class MSG_EVALUATE_STRING(MESSAGE):
     type = 6
+    __slots__ = ()
     def __init__(self, src_id, string, reply=1):
-        MESSAGE.__init__(self, src_id)
-        self['string']=str(string)
-        self['reply']=int(reply)
+        MESSAGE.__init__(self, src_id, str(string), int(reply))
 
 class MSG_EVALUATE_BLOCK(MESSAGE):
     type = 7
+    __slots__ = ()
     def __init__(self, src_id, start, end, reply=1):
-        MESSAGE.__init__(self, src_id)
-        self['start']=int(start)
-        self['end']=int(end)
-        self['reply']=int(reply)
+        MESSAGE.__init__(self, src_id, int(start), int(end), int(reply))
 
 class MSG_GET_ALL(MESSAGE):
     type = 8
+    __slots__ = ()
     def __init__(self, src_id):
         MESSAGE.__init__(self, src_id)
 
 class MSG_SET_ALL(MESSAGE):
     type = 9
-    def __init__(self, src_id, document, peer_tag_loc, peer_loc):
-        MESSAGE.__init__(self, src_id)
-        self['document']     = str(document)
-        self["peer_tag_loc"] = peer_tag_loc
-        self["peer_loc"]     = peer_loc
+    __slots__ = ()
+    def __init__(self, src_id, document, peer_tag_loc, peer_loc, revision=0):
+        MESSAGE.__init__(self, src_id, str(document), peer_tag_loc, peer_loc, int(revision))
 
 class MSG_SELECT(MESSAGE):
     type = 10
+    __slots__ = ()
     def __init__(self, src_id, start, end, reply=1):
-        MESSAGE.__init__(self, src_id)
-        self['start']=int(start)
-        self['end']=int(end)
-        self['reply']=int(reply)
+        MESSAGE.__init__(self, src_id, int(start), int(end), int(reply))
 
 class MSG_RESET(MSG_SET_ALL):
     type = 11 
+    __slots__ = ()
 
 class MSG_KILL(MESSAGE):
     type = 12
+    __slots__ = ()
     def __init__(self, src_id, string):
-        MESSAGE.__init__(self, src_id)
-        self['string']=str(string)
+        MESSAGE.__init__(self, src_id, str(string))
 
 class MSG_CONNECT_ACK(MESSAGE):
     type = 13
+    __slots__ = ()
     def __init__(self, src_id, reply=0):
-        MESSAGE.__init__(self, src_id)
-        self["reply"] = reply
+        MESSAGE.__init__(self, src_id, reply)
 
 class MSG_REQUEST_ACK(MESSAGE):
     type = 14
+    __slots__ = ()
     def __init__(self, src_id, flag, reply=0):
-        MESSAGE.__init__(self, src_id)
-        self['flag'] = int(flag)
-        self["reply"] = reply
+        MESSAGE.__init__(self, src_id, int(flag), reply)
 
 class MSG_CONSTRAINT(MESSAGE):
     type = 15
+    __slots__ = ()
     def __init__(self, src_id, constraint_id):
-        MESSAGE.__init__(self, src_id)
-        self['constraint_id'] = int(constraint_id) 
+        MESSAGE.__init__(self, src_id, int(constraint_id))
         # self.peer_id = int(peer) # 
 
 class MSG_CONSOLE(MESSAGE):
     type = 16
+    __slots__ = ()
     def __init__(self, src_id, string):
-        MESSAGE.__init__(self, src_id)
-        self['string'] = str(string)
+        MESSAGE.__init__(self, src_id, str(string))
 
 
 class MSG_KEEP_ALIVE(MESSAGE):
     type = 17
+    __slots__ = ()
     def __init__(self, src_id=-1):
         MESSAGE.__init__(self, src_id)
+
+class MSG_PIPELINED_OPERATION(MSG_OPERATION):
+    """ An operation numbered with `seq` that may be sent before the client's
+        previous operations have been acknowledged """
+    type = 18
+    __slots__ = ()
+    def __init__(self, src_id, operation, revision, seq):
+        MESSAGE.__init__(self, src_id, [str(item) if not isinstance(item, int) else item for item in operation], int(revision), int(seq))
+
+class MSG_OPERATION_ACK(MESSAGE):
+    """ Tells the client `src_id` that its oldest unacknowledged operation has
+        been applied, making `revision` the number of operations in the history """
+    type = 19
+    __slots__ = ()
+    def __init__(self, src_id, revision):
+        MESSAGE.__init__(self, src_id, int(revision))
  
 # Create a dictionary of message type to message class 
 
@@ -319,6 +511,8 @@ MESSAGE_TYPE = {msg.type : msg for msg in [
         MSG_CONSTRAINT,
         MSG_CONSOLE,
         MSG_KEEP_ALIVE,
+        MSG_PIPELINED_OPERATION,
+        MSG_OPERATION_ACK,
     ]
 }
 
@@ -8,14 +8,30 @@ class Client(object):
     sends them to the server at the right time.
     """
 
-    def __init__(self, revision):
+    def __init__(self, revision, pipelined=False):
         self.revision = revision
         self.state = synchronized
-
-    def reset(self):
-        self.revision = 0
+        # If the server supports it, send every operation straight away
+        # instead of waiting for the previous one to be acknowledged
+        self.pipelined = pipelined
+        # Revision of the last document received from the server
+        self.resync_revision = revision
+
+    def reset(self, revision=0):
+        """Call this method when the server sends the whole document at
+        `revision`, which replaces any pending operations."""
+        self.revision = revision
+        self.resync_revision = revision
         self.state = synchronized
 
+    def can_pipeline(self, revision):
+        """Returns True if an operation based on `revision` can be sent before
+        the previous one is acknowledged. The server ignores pipelined
+        operations based on the revision of the last document it sent, as it
+        cannot tell whether they were sent before the document arrived, so
+        the first operation after a new document waits to be acknowledged."""
+        return self.pipelined and revision > self.resync_revision
+
     def apply_client(self, operation):
         """Call this method when the user (!) changes the document."""
         self.state = self.state.apply_client(self, operation)
@@ -50,6 +66,8 @@ class Synchronized(object):
         # When the user makes an edit, send the operation to the server and
         # switch to the 'AwaitingConfirm' state
         client.send_operation(client.revision, operation)
+        if client.can_pipeline(client.revision):
+            return AwaitingPipeline([operation])
         return AwaitingConfirm(operation)
 
     def apply_server(self, client, operation):
@@ -141,3 +159,37 @@ class AwaitingWithBuffer(object):
         # => send buffer
         client.send_operation(client.revision, self.buffer)
         return AwaitingConfirm(self.buffer)
+
+
+class AwaitingPipeline(object):
+    """In the 'awaitingPipeline' state, the client has sent one or more
+    operations to the server and is waiting for them to be acknowledged in
+    the order they were sent. Only used if the client is pipelined.
+    """
+
+    def __init__(self, outstanding):
+        # Save the pending operations, oldest first
+        self.outstanding = outstanding
+
+    def apply_client(self, client, operation):
+        # Send the user's edit straight away. It is based on the current
+        # revision and the pending operations
+        client.send_operation(client.revision, operation)
+        return AwaitingPipeline(self.outstanding + [operation])
+
+    def apply_server(self, client, operation):
+        # Transform the operation past each pending operation in turn, in the
+        # same way that the server transforms the pending operations against it
+        Operation = operation.__class__
+        outstanding = []
+        for pending in self.outstanding:
+            (pending_p, operation) = Operation.transform(pending, operation)
+            outstanding.append(pending_p)
+        client.apply_operation(operation)
+        return AwaitingPipeline(outstanding)
+
+    def server_ack(self, client):
+        # The oldest pending operation has been acknowledged
+        if len(self.outstanding) == 1:
+            return synchronized
+        return AwaitingPipeline(self.outstanding[1:])
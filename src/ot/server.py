@@ -1,39 +1,145 @@
+class StaleRevisionError(Exception):
+    """An operation was based on a revision whose history has been discarded."""
+    pass
+
+
 class MemoryBackend(object):
-    """Simple backend that saves all operations in the server's memory. This
-    causes the processe's heap to grow indefinitely.
+    """Backend that saves operations in the server's memory. Revision numbers
+    keep counting from the first operation but only the operations that a
+    client could still need are stored: those newer than the lowest revision
+    any client has reported, and never more than `max_operations`.
+
+    Runs of operations are composed into blocks of 2**k revisions, aligned on
+    multiples of their size, so that the operations after any revision can be
+    returned as O(log n) composed operations. Blocks are cached once all of
+    their operations have been saved. Clients that are fewer than
+    `compose_threshold` revisions behind are sent the operations themselves.
     """
 
-    def __init__(self, operations=[]):
+    max_operations = 1000
+    compose_threshold = 8
+
+    def __init__(self, operations=[], max_operations=None):
         self.operations = operations[:]
+        self.users = [None] * len(self.operations)
+        self.offset = 0
         self.last_operation = {}
+        self.acknowledged = {}
+        self.blocks = {}
+        if max_operations is not None:
+            self.max_operations = max_operations
+
+    def get_revision(self):
+        """Return the revision number of the next operation to be saved."""
+        return self.offset + len(self.operations)
 
     def save_operation(self, user_id, operation):
         """Save an operation in the database."""
-        self.last_operation[user_id] = len(self.operations)
+        self.last_operation[user_id] = self.get_revision()
         self.operations.append(operation)
+        self.users.append(user_id)
 
     def get_operations(self, start, end=None):
         """Return operations in a given range."""
-        return self.operations[start:end]
+        if start < self.offset:
+            raise StaleRevisionError("Revision {} is older than the history (starts at {})".format(start, self.offset))
+        if end is not None:
+            end -= self.offset
+        return self.operations[start - self.offset:end]
+
+    def get_history(self, start):
+        """Return (user_id, operation) pairs for the operations from revision
+        `start` onwards."""
+        if start < self.offset:
+            raise StaleRevisionError("Revision {} is older than the history (starts at {})".format(start, self.offset))
+        return list(zip(self.users[start - self.offset:], self.operations[start - self.offset:]))
+
+    def get_composed_operations(self, start):
+        """Return the operations from revision `start` onwards composed into
+        a short list of operations with the same effect."""
+        if start < self.offset:
+            raise StaleRevisionError("Revision {} is older than the history (starts at {})".format(start, self.offset))
+        end = self.get_revision()
+        if end - start <= self.compose_threshold:
+            return self.operations[start - self.offset:]
+        composed = []
+        while start < end:
+            size = 1
+            while start % (size * 2) == 0 and start + size * 2 <= end:
+                size *= 2
+            composed.append(self.get_block(start, size))
+            start += size
+        return composed
+
+    def get_block(self, start, size):
+        """Return the composition of the `size` operations from revision `start`."""
+        if size == 1:
+            return self.operations[start - self.offset]
+        block = self.blocks.get((start, size))
+        if block is None:
+            half = size // 2
+            block = self.get_block(start, half).compose(self.get_block(start + half, half), keep_order=True)
+            self.blocks[(start, size)] = block
+        return block
 
     def get_last_revision_from_user(self, user_id):
         """Return the revision number of the last operation from a given user."""
         return self.last_operation.get(user_id, None)
 
+    def acknowledge(self, user_id, revision):
+        """Store the revision a user has seen every operation up to and discard
+        operations that every user has seen."""
+        self.acknowledged[user_id] = max(revision, self.acknowledged.get(user_id, 0))
+        self.compact()
+
+    def remove_user(self, user_id):
+        """Stop keeping operations for a user that has disconnected."""
+        self.acknowledged.pop(user_id, None)
+        self.last_operation.pop(user_id, None)
+        self.compact()
+
+    def compact(self):
+        """Discard operations older than the lowest acknowledged revision, or
+        the oldest operations if there are more than `max_operations`."""
+        start = min(self.acknowledged.values()) if self.acknowledged else self.get_revision()
+        start = max(start, self.get_revision() - self.max_operations)
+        if start > self.offset:
+            del self.operations[:start - self.offset]
+            del self.users[:start - self.offset]
+            self.offset = start
+            self.blocks = {key: block for key, block in self.blocks.items() if key[0] >= start}
+
+    def clear(self):
+        """Discard all operations but carry on counting revisions."""
+        self.offset = self.get_revision()
+        self.operations = []
+        self.users = []
+        self.acknowledged = {}
+        self.blocks = {}
+
 
 class Server(object):
     """Receives operations from clients, transforms them against all
     concurrent operations and sends them back to all clients.
+
+    Users added with `add_pipelined_user` may send several operations
+    before the first is acknowledged. For each of them the server keeps a
+    bridge: the operations from other users that the user may not have
+    received yet, transformed past the user's own operations as the user's
+    client will transform them when they arrive.
     """
 
     def __init__(self, document, backend):
         self.document = document
         self.backend = backend
+        self.bridges = {}
+        self.sequences = {}
 
     def receive_operation(self, user_id, revision, operation):
         """Transforms an operation coming from a client against all concurrent
         operation, applies it to the current document and returns the operation
-        to send to the clients.
+        to send to the clients. Raises a StaleRevisionError if the concurrent
+        operations are no longer stored.
         """
 
         last_by_user = self.backend.get_last_revision_from_user(user_id)
@@ -42,12 +148,72 @@ class Server(object):
 
         Operation = operation.__class__
 
-        concurrent_operations = self.backend.get_operations(revision)
+        concurrent_operations = self.backend.get_composed_operations(revision)
         for concurrent_operation in concurrent_operations:
             (operation, _) = Operation.transform(operation, concurrent_operation)
 
+        return self.save_operation(user_id, revision, operation)
+
+    def receive_pipelined_operation(self, user_id, revision, seq, operation):
+        """Like `receive_operation` for a pipelined user. `revision` is the
+        number of operations the client had received when it sent this one,
+        so its context is that revision plus the user's earlier operations,
+        and `seq` numbers the user's operations so that repeats are ignored.
+        """
+
+        if seq <= self.sequences.get(user_id, 0):
+            return
+        self.sequences[user_id] = seq
+
+        if revision < self.backend.offset:
+            raise StaleRevisionError("Revision {} is older than the history (starts at {})".format(revision, self.backend.offset))
+
+        Operation = operation.__class__
+
+        bridge = self.bridges.get(user_id)
+        if bridge is None:
+            raise StaleRevisionError("User {} has no operations to transform against".format(user_id))
+
+        # Operations the client had received are already part of this one
+        start = 0
+        while start < len(bridge) and bridge[start][0] < revision:
+            start += 1
+        del bridge[:start]
+
+        for i, (concurrent_revision, concurrent_operation) in enumerate(bridge):
+            (operation, concurrent_operation) = Operation.transform(operation, concurrent_operation)
+            bridge[i] = (concurrent_revision, concurrent_operation)
+
+        return self.save_operation(user_id, revision, operation)
+
+    def save_operation(self, user_id, revision, operation):
+        """Applies a transformed operation to the document, stores it and adds
+        it to the bridges of the other pipelined users."""
+
         self.document = operation(self.document)
 
+        saved_revision = self.backend.get_revision()
         self.backend.save_operation(user_id, operation)
-        
+        self.backend.acknowledge(user_id, revision)
+
+        for other_id, bridge in list(self.bridges.items()):
+            if other_id != user_id:
+                # Clients cannot be behind the stored history without resyncing
+                start = 0
+                while start < len(bridge) and bridge[start][0] < self.backend.offset:
+                    start += 1
+                del bridge[:start]
+                bridge.append((saved_revision, operation))
+
         return operation
+
+    def add_pipelined_user(self, user_id):
+        """Lets a user send operations without waiting for each one to be
+        acknowledged, starting from the current revision."""
+        self.bridges[user_id] = []
+        self.sequences.setdefault(user_id, 0)
+
+    def remove_pipelined_user(self, user_id):
+        """Stops keeping a bridge for a user that has left."""
+        self.bridges.pop(user_id, None)
+        self.sequences.pop(user_id, None)
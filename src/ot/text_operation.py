@@ -47,8 +47,124 @@ def _shorten_ops(a, b):
     return (None, _shorten(b, len_a))
 
 
+def _single_edit(ops):
+    """Return (index, string, deleted, length) if the ops only insert `string`
+    or only delete `deleted` characters at `index` of a document of `length`
+    characters, i.e. they look like [retain, insert or delete, retain] with
+    either retain left out. Return None for any other list of ops.
+    """
+
+    n = len(ops)
+    if n == 0 or n > 3:
+        return None
+    index = ops[0]
+    if type(index) is int and index > 0:
+        i = 1
+    else:
+        index = i = 0
+    if i == n:
+        return None
+    op = ops[i]
+    if type(op) is str:
+        if len(op) == 0:
+            return None
+        string, deleted = op, 0
+    elif type(op) is int and op < 0:
+        string, deleted = "", -op
+    else:
+        return None
+    rest = 0
+    if i + 1 < n:
+        rest = ops[i + 1]
+        if i + 2 < n or type(rest) is not int or rest <= 0:
+            return None
+    return (index, string, deleted, index + deleted + rest)
+
+
+def _edit_operation(index, string, deleted, rest):
+    """Build the operation that retains `index` characters, inserts `string`,
+    deletes `deleted` characters and retains `rest` characters."""
+
+    operation = TextOperation()
+    operation.retain(index)
+    operation.insert(string)
+    operation.delete(deleted)
+    operation.retain(rest)
+    return operation
+
+
+def _compose_edits(edit_a, edit_b):
+    """Compose two single edits that touch the same place into one edit
+    without walking their ops. Return None if the result is not a single
+    edit or the lengths do not match.
+    """
+
+    (index_a, string_a, deleted_a, length) = edit_a
+    (index_b, string_b, deleted_b, length_b) = edit_b
+    if length - deleted_a + len(string_a) != length_b:
+        return None
+    # Typing: the second insert is inside or next to the first
+    if string_a and string_b and index_a <= index_b <= index_a + len(string_a):
+        k = index_b - index_a
+        return _edit_operation(index_a, string_a[:k] + string_b + string_a[k:], 0, length - index_a)
+    # Backspace or delete: the second delete is next to the first
+    if deleted_a and deleted_b and index_b <= index_a <= index_b + deleted_b:
+        return _edit_operation(index_b, "", deleted_a + deleted_b, length - index_b - deleted_a - deleted_b)
+    # Deleting text that has just been inserted
+    if string_a and deleted_b and index_a <= index_b and index_b + deleted_b <= index_a + len(string_a):
+        k = index_b - index_a
+        return _edit_operation(index_a, string_a[:k] + string_a[k + deleted_b:], 0, length - index_a)
+    return None
+
+
+def _transform_edits(edit_a, edit_b):
+    """Transform two single edits against each other without walking their
+    ops, giving the same result as `TextOperation.transform`. Return None if
+    an insert is inside the text deleted by the other edit, which splits the
+    delete in two, or if the lengths do not match.
+    """
+
+    (index_a, string_a, deleted_a, length) = edit_a
+    (index_b, string_b, deleted_b, length_b) = edit_b
+    if length != length_b:
+        return None
+    if string_a and string_b:
+        # Inserts at the same index put a's text first
+        if index_a <= index_b:
+            return (_edit_operation(index_a, string_a, 0, length + len(string_b) - index_a),
+                    _edit_operation(index_b + len(string_a), string_b, 0, length - index_b))
+        return (_edit_operation(index_a + len(string_b), string_a, 0, length - index_a),
+                _edit_operation(index_b, string_b, 0, length + len(string_a) - index_b))
+    if string_a:
+        if index_a <= index_b:
+            return (_edit_operation(index_a, string_a, 0, length - deleted_b - index_a),
+                    _edit_operation(index_b + len(string_a), "", deleted_b, length - index_b - deleted_b))
+        if index_a >= index_b + deleted_b:
+            return (_edit_operation(index_a - deleted_b, string_a, 0, length - index_a),
+                    _edit_operation(index_b, "", deleted_b, length + len(string_a) - index_b - deleted_b))
+        return None
+    if string_b:
+        if index_b <= index_a:
+            return (_edit_operation(index_a + len(string_b), "", deleted_a, length - index_a - deleted_a),
+                    _edit_operation(index_b, string_b, 0, length - deleted_a - index_b))
+        if index_b >= index_a + deleted_a:
+            return (_edit_operation(index_a, "", deleted_a, length + len(string_b) - index_a - deleted_a),
+                    _edit_operation(index_b - deleted_a, string_b, 0, length - index_b))
+        return None
+    # Both delete: each deletes whatever the other has not already deleted
+    overlap = max(0, min(index_a + deleted_a, index_b + deleted_b) - max(index_a, index_b))
+    start_a = index_a - max(0, min(index_a, index_b + deleted_b) - index_b)
+    start_b = index_b - max(0, min(index_b, index_a + deleted_a) - index_a)
+    return (_edit_operation(start_a, "", deleted_a - overlap, length - deleted_b - start_a - deleted_a + overlap),
+            _edit_operation(start_b, "", deleted_b - overlap, length - deleted_a - start_b - deleted_b + overlap))
+
+
 class TextOperation(object):
-    """Diff between two strings."""
+    """Diff between two strings. Operations that insert or delete text at
+    a single place, which is what typing produces, are applied, composed and
+    transformed without walking their ops."""
+
+    __slots__ = ("ops",)
 
     def __init__(self, ops=[]):
         self.ops = ops[:]
@@ -77,6 +193,13 @@ class TextOperation(object):
                 s += op
         return s
 
+    def get_edit(self):
+        """Returns (index, string, deleted, length) if this operation only
+        inserts `string` or only deletes `deleted` characters at `index` of
+        a document of `length` characters, otherwise None.
+        """
+        return _single_edit(self.ops)
+
     def retain(self, r):
         """Skips a given number of characters at the current cursor position."""
 
@@ -110,6 +233,19 @@ class TextOperation(object):
             self.ops.append(s)
         return self
 
+    def append_insert(self, s):
+        """Inserts the given string at the current cursor position without
+        moving it in front of a preceding delete op.
+        """
+
+        if len(s) == 0:
+            return self
+        if len(self.ops) > 0 and isinstance(self.ops[-1], str):
+            self.ops[-1] += s
+        else:
+            self.ops.append(s)
+        return self
+
     def delete(self, d):
         """Deletes a given number of characters at the current cursor position."""
 
@@ -126,6 +262,15 @@ class TextOperation(object):
     def __call__(self, doc):
         """Apply this operation to a string, returning a new string."""
 
+        edit = _single_edit(self.ops)
+        if edit is not None:
+            (index, string, deleted, length) = edit
+            if length > len(doc):
+                raise IncompatibleOperationError("Cannot apply operation: operation is too long.")
+            if length < len(doc):
+                raise IncompatibleOperationError("Cannot apply operation: operation is too short.")
+            return doc[:index] + string + doc[index + deleted:]
+
         i = 0
         parts = []
 
@@ -169,14 +314,26 @@ class TextOperation(object):
 
         return inverse
 
-    def compose(self, other):
+    def compose(self, other, keep_order=False):
         """Combine two consecutive operations into one that has the same effect
-        when applied to a document.
+        when applied to a document. If `keep_order` is True, inserts next to
+        a delete are kept in the order they happen rather than moved first, so
+        that transforming an operation against the result is the same as
+        transforming it against `self` and then `other`.
         """
 
+        edit_a = _single_edit(self.ops)
+        if edit_a is not None:
+            edit_b = _single_edit(other.ops)
+            if edit_b is not None:
+                operation = _compose_edits(edit_a, edit_b)
+                if operation is not None:
+                    return operation
+
         iter_a = iter(self)
         iter_b = iter(other)
         operation = TextOperation()
+        insert = operation.append_insert if keep_order else operation.insert
 
         a = b = None
         while True:
@@ -194,12 +351,11 @@ class TextOperation(object):
                 a = None
                 continue
             if _is_insert(b):
-                operation.insert(b)
+                insert(b)
                 b = None
                 continue
 
             if a == None:
-                print(self.ops, other.ops)
                 raise IncompatibleOperationError("Cannot compose operations: first operation is too short")
             if b == None:
                 raise IncompatibleOperationError("Cannot compose operations: first operation is too long")
@@ -208,7 +364,7 @@ class TextOperation(object):
             if _is_retain(a) and _is_retain(b):
                 operation.retain(min_len)
             elif _is_insert(a) and _is_retain(b):
-                operation.insert(a[:min_len])
+                insert(a[:min_len])
             elif _is_retain(a) and _is_delete(b):
                 operation.delete(min_len)
             # remaining case: _is_insert(a) and _is_delete(b)
@@ -226,6 +382,14 @@ class TextOperation(object):
         the operations' intentions in the process.
         """
 
+        edit_a = _single_edit(operation_a.ops)
+        if edit_a is not None:
+            edit_b = _single_edit(operation_b.ops)
+            if edit_b is not None:
+                operations = _transform_edits(edit_a, edit_b)
+                if operations is not None:
+                    return operations
+
         iter_a = iter(operation_a)
         iter_b = iter(operation_b)
         a_prime = TextOperation()
@@ -242,14 +406,16 @@ class TextOperation(object):
                 # end condition: both operations have been processed
                 break
 
+            # Inserts are not moved in front of deletes so that transforming
+            # against a composed operation matches transforming step by step
             if _is_insert(a):
-                a_prime.insert(a)
+                a_prime.append_insert(a)
                 b_prime.retain(len(a))
                 a = None
                 continue
             if _is_insert(b):
                 a_prime.retain(len(b))
-                b_prime.insert(b)
+                b_prime.append_insert(b)
                 b = None
                 continue
 
@@ -33,7 +33,7 @@ class Receiver:
         self.running = False
         self.bytes = 2048
 
-        self.reader = NetworkMessageReader()
+        self.reader = get_message_reader(self.client.send.features)
 
         # Information about other clients
 
@@ -76,25 +76,19 @@ class Receiver:
 
                     raise EmptyMessageError
 
-            except(OSError, socket.error) as e:
+            except(OSError, socket.error, EmptyMessageError) as e:
 
-                print(e)
+                # Try to reconnect unless the connection was closed on purpose
 
-                self.kill()
+                if self.running:
 
-                break
-
-            # Ignore empty message errors if we are no longer running
-
-            except EmptyMessageError as e:
+                    print(e)
 
-                if self.client.is_alive:
+                    self.kill()
 
-                    raise(e)
+                    self.client.connection_lost()
 
-                else:
-
-                    pass
+                break
 
             for msg in packet:
 
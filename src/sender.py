@@ -19,6 +19,7 @@ class Sender:
         Sends messages to the Server
 
     """
+    features_timeout = 5 # Seconds to wait for the server to reply with the features it accepts
     def __init__(self, client):
 
         self.client = client
@@ -31,18 +32,22 @@ class Sender:
         self.conn      = None
         self.conn_id   = None
         self.connected = False
+        self.features  = 0
+        self.compressor = None
         self.connection_errors = {
             ERR_LOGIN_FAIL : "Login attempt failed",
             ERR_MAX_LOGINS : "Failed to connect: Maximum number of users connected. Please try again later.",
             ERR_NAME_TAKEN : "A user with that name has already connected from your location.",
-            ERR_VERSION_MISMATCH: "Your client, Troop v{}, does not match the version of the server. Please update your versions to match before connecting.".format(self.client.version)
+            ERR_VERSION_MISMATCH: "Your client, Troop v{}, does not match the version of the server. Please update your versions to match before connecting.".format(self.client.version),
+            ERR_RESUME_FAIL : "The server could not resume your session."
         }
 
         self.ui        = None
 
-    def connect(self, hostname, port=57890, username="", using_ipv6=False, password=""):
+    def connect(self, hostname, port=57890, username="", using_ipv6=False, password="", features=FEATURE_FRAMED, client_id=-1):
         """ Connects to the master Troop server and
-            start a listening instance on this machine """
+            start a listening instance on this machine. A client that has
+            lost its connection gives its `client_id` to resume its session """
         if not self.connected:
 
             # Get details of remote
@@ -78,12 +83,38 @@ class Sender:
 
             # Send the password
 
-            self.conn_msg = MSG_PASSWORD(-1, md5(password.encode("utf-8")).hexdigest(), self.name, self.client.version)
+            self.conn_msg = MSG_PASSWORD(client_id, md5(password.encode("utf-8")).hexdigest(), self.name, self.client.version, features)
 
             self.send( self.conn_msg )
 
             self.conn_id   = int(self.conn.recv(4)) # careful here
             self.connected = bool(self.conn_id >= 0)
+
+            # The server replies with the features it accepts, all messages after this use them
+
+            if self.connected and features:
+
+                try:
+
+                    # A server from an older version does not reply and can't read the rest of
+                    # our messages, so treat it as a version mismatch
+
+                    self.conn.settimeout(self.features_timeout)
+
+                    self.features = int(self.conn.recv(4))
+
+                    self.conn.settimeout(None)
+
+                except socket.timeout:
+
+                    self.conn.close()
+
+                    self.conn_id   = ERR_VERSION_MISMATCH
+                    self.connected = False
+
+                    return self
+
+                self.compressor = get_stream_compressor(self.features)
             
         return self
 
@@ -95,9 +126,21 @@ class Sender:
 
     def __call__(self, message):
         """ Send data to the server """
+        return self.write(message.encode(self.features))
+
+    def send_all(self, messages):
+        """ Sends a list of messages to the server in a single write """
+        return self.write(b"".join([message.encode(self.features) for message in messages]))
+
+    def write(self, data):
+        """ Writes bytes to the server connection """
         try:
 
-            self.conn.sendall(message.bytes())
+            if self.compressor is not None:
+
+                data = self.compressor.compress(data)
+
+            self.conn.sendall(data)
 
         except Exception as e:
 
@@ -26,19 +26,23 @@ import sys
 import time
 import os.path
 import json
+import zlib
 
+from collections import deque
 from datetime import datetime
+from functools import partial
 from time import sleep
 from getpass import getpass
 from hashlib import md5
-from threading import Thread
+from threading import Thread, Condition, Lock
 
 from .threadserv import ThreadedServer
+from .document import PeerTagMap
 from .message import *
 from .interpreter import *
 from .config import *
 from .utils import *
-from .ot.server import Server as OTServer, MemoryBackend
+from .ot.server import Server as OTServer, MemoryBackend, StaleRevisionError
 from .ot.text_operation import TextOperation, IncompatibleOperationError as OTError
 
 
@@ -50,12 +54,14 @@ class TroopServer(OTServer):
     """
     bytes   = 2048
     version = VERSION
-    def __init__(self, password="", port=57890, log=False, debug=False, keepalive=False):
+    features = FEATURE_FRAMED | FEATURE_COMPRESSED | FEATURE_PIPELINED | FEATURE_COMPACT_ACK
+    resume_timeout = 60 # seconds to keep operations for a client that has lost its connection
+    def __init__(self, password="", port=57890, log=False, debug=False, keepalive=False, high_water=1048576, presence_rate=30):
 
         # Operation al transform info
 
         OTServer.__init__(self, "", MemoryBackend())
-        self.peer_tag_doc = ""
+        self.peer_tag_doc = PeerTagMap()
 
         # Address information
         # self.hostname = str(socket.gethostname())
@@ -79,36 +85,46 @@ class TroopServer(OTServer):
 
             pass
 
-        # Look for an empty port
-        port_found = False
+        # Look for an empty port and start listening
 
-        while not port_found:
+        self.open_socket()
 
-            try:
+        # Is keep alive enabled?
+        self.keepalive_enabled = False
 
-                self.server = ThreadedServer((self.ip_addr, self.port), TroopRequestHandler)
-                port_found  = True
+        self.text_constraint = MSG_CONSTRAINT(-1, 0) # default
 
-            except socket.error:
+        # Number of bytes waiting to be sent to a client before it is resynced
 
-                self.port += 1
+        self.high_water = int(high_water)
 
-        # Is keep alive enabled?
-        self.keepalive_enabled = False
+        self.debug = debug
 
-        # Reference to the thread that is listening for new connections
-        self.server_thread = Thread(target=self.server.serve_forever)
-
-        self.waiting_for_ack = False # Flagged True after new connected client
+        # Cursor and selection messages waiting to be sent, keyed by client and type so only the
+        # latest of each is kept, and sent at most `presence_rate` times a second
 
-        self.text_constraint = MSG_CONSTRAINT(-1, 0) # default
+        self.presence          = {}
+        self.presence_interval = 1.0 / presence_rate if presence_rate > 0 else 0
+        self.presence_due      = 0
+        self.presence_stats    = {"received": 0, "sent": 0, "dropped": 0}
 
         # Dict of IDs to Client instances
         self.clients = {}
 
+        # Clients waiting to be sent the document or the operations they missed,
+        # and the time that disconnected clients left
+
+        self.joining  = {}
+        self.departed = {}
+
+        # Checksum of the document at each revision still in the history
+
+        self.checksums = {}
+
         # ID numbers
         self.max_id  = len(PEER_CHARS) - 1
         self.last_id = -1
+        self.id_lock = Lock()
 
         # Give request handler information about this server
         TroopRequestHandler.master = self
@@ -151,6 +167,27 @@ class TroopServer(OTServer):
             self.is_logging = False
             self.log_file = None
 
+    def open_socket(self):
+        """ Binds the server to the first free port from `self.port` """
+
+        port_found = False
+
+        while not port_found:
+
+            try:
+
+                self.server = ThreadedServer((self.ip_addr, self.port), TroopRequestHandler)
+                port_found  = True
+
+            except socket.error:
+
+                self.port += 1
+
+        # Reference to the thread that is listening for new connections
+        self.server_thread = Thread(target=self.server.serve_forever)
+
+        return
+
     def get_client_from_addr(self, client_hostname, username):
         """ Returns the server-side representation of a client
             using the client address tuple """
@@ -168,43 +205,152 @@ class TroopServer(OTServer):
 
     def get_client_ranges(self):
         """ Converts the peer_tag_doc into pairs of tuples to be reconstructed by the client """
-        if len(self.peer_tag_doc) == 0:
-            return []
-        else:
-            data = []
-            p_char = self.peer_tag_doc[0]
-            count = 1
-            for char in self.peer_tag_doc[1:]:
-                if char != p_char:
-                    data.append((get_peer_id_from_char(p_char), int(count)))
-                    p_char = char
-                    count = 1
-                else:
-                    count += 1
-            if count > 0:
-                data.append((get_peer_id_from_char(p_char), int(count)))
-            return data
+        return self.peer_tag_doc.to_list()
 
     def get_text_constraint(self):
         return self.text_constraint
 
     def get_contents(self):
-        return [self.document, self.get_client_ranges(), self.get_client_locs()]
+        self.store_checksum()
+        return [self.document, self.get_client_ranges(), self.get_client_locs(), self.backend.get_revision()]
 
-    def update_all_clients(self):
-        """ Sends a reset message with the contents from the server to make sure new user starts the  same  """
+    def store_checksum(self):
+        """ Stores the checksum of the document at the current revision and discards those
+            of revisions that are no longer in the history """
 
-        msg = MSG_RESET(-1, *self.get_contents())
+        self.checksums[self.backend.get_revision()] = zlib.crc32(self.document.encode("utf-8"))
 
-        for client in list(self.clients.values()):
+        # Revisions are stored in ascending order
 
-            # Tell other clients about the new connection
+        while next(iter(self.checksums)) < self.backend.offset:
 
-            if client.connected:
+            del self.checksums[next(iter(self.checksums))]
 
-                client.send(msg)
-                client.send(self.get_text_constraint())
+        return
+
+    def resync_client(self, client):
+        """ Sends a client the current document when the operations it needs to catch up
+            have been discarded from the history, or when it has fallen too far behind
+            on the messages sent to it. Operations waiting to be sent to the client are
+            replaced by the new document and any operations it sent before receiving
+            the new document are ignored. """
+
+        if not client.connected:
+
+            return
+
+        msg = MSG_SET_ALL(-1, *self.get_contents())
+
+        try:
+
+            client.send_snapshot(msg)
+
+        except DeadClientError as err:
+
+            # Remove client if no longer contactable
+
+            self.remove_client(client.id)
+
+            print(err)
+
+            return
+
+        client.resync_revision = msg["revision"]
+
+        self.backend.acknowledge(client.id, msg["revision"])
+
+        # Operations the client sent before this document are ignored
+
+        if client.features & FEATURE_PIPELINED:
+
+            self.add_pipelined_user(client.id)
+
+        return
+
+    def get_queue_depths(self):
+        """ Returns a dictionary of client id to the number of messages and bytes waiting to be sent """
+        return { client.id: client.get_backlog() for client in list(self.clients.values()) if client.connected }
 
+    def report_queue_depths(self):
+        """ Prints the send queue of any client with messages waiting """
+        for client_id, (messages, size) in self.get_queue_depths().items():
+            if messages > 0:
+                stdout("Send queue for '{}': {} messages, {} bytes".format(self.clients[client_id].name, messages, size))
+        return
+
+    # Presence
+    # ========
+
+    def queue_presence(self, msg):
+        """ Holds a cursor or selection message until the next presence flush, replacing
+            any message of the same type from the same client that is still waiting """
+
+        key = (msg["src_id"], msg.type)
+
+        self.presence_stats["received"] += 1
+
+        if self.presence.pop(key, None) is not None:
+
+            self.presence_stats["dropped"] += 1
+
+        self.presence[key] = msg
+
+        # Send straight away if nothing has been sent for a while
+
+        if time.time() >= self.presence_due:
+
+            self.flush_presence()
+
+        else:
+
+            self.schedule_presence_flush()
+
+        return
+
+    def flush_presence(self):
+        """ Sends the waiting cursor and selection messages in the order they arrived """
+
+        pending, self.presence = self.presence, {}
+
+        self.presence_due = time.time() + self.presence_interval
+
+        for msg in pending.values():
+
+            if msg["src_id"] in self.clients:
+
+                self.presence_stats["sent"] += 1
+
+                self.respond(msg)
+
+        return
+
+    def transform_presence(self, src_id, ops):
+        """ Moves the locations in waiting cursor and selection messages to where they are
+            after an operation, which is sent before them """
+
+        for (client_id, _), msg in self.presence.items():
+
+            after_insert = client_id == src_id
+
+            if isinstance(msg, MSG_SET_MARK):
+
+                msg["index"] = transform_index(ops, msg["index"], after_insert)
+
+            else:
+
+                msg["start"] = transform_index(ops, msg["start"], after_insert)
+                msg["end"]   = transform_index(ops, msg["end"], after_insert)
+
+        return
+
+    def schedule_presence_flush(self):
+        """ The queue thread flushes presence messages once they are due (see `update_send`) """
+        return
+
+    def report_presence_stats(self):
+        """ Prints how many cursor and selection messages have been dropped by coalescing """
+        if self.presence_stats["dropped"] > 0:
+            stdout("Presence messages: {received} received, {sent} sent, {dropped} dropped".format(**self.presence_stats))
         return
 
     # Operation info
@@ -214,9 +360,37 @@ class TroopServer(OTServer):
         """ Handles a new MSG_OPERATION by updating the document, performing operational transformation
             (if necessary) on it and storing it. """
 
+        client = self.clients[message["src_id"]]
+
+        # Operations based on a revision from before a resync cannot be transformed. Pipelined
+        # operations based on the resync revision may also have been sent before the client
+        # received the new document, so the client sends its first operation after it unpipelined
+
+        if message["revision"] < client.resync_revision:
+
+            return
+
+        if isinstance(message, MSG_PIPELINED_OPERATION) and message["revision"] == client.resync_revision:
+
+            return
+
         # Apply to document
         try:
-            op = self.receive_operation(message["src_id"], message["revision"], TextOperation(message["operation"]))
+
+            if isinstance(message, MSG_PIPELINED_OPERATION):
+
+                op = self.receive_pipelined_operation(message["src_id"], message["revision"], message["seq"], TextOperation(message["operation"]))
+
+            else:
+
+                op = self.receive_operation(message["src_id"], message["revision"], TextOperation(message["operation"]))
+
+        # The client is too far behind to transform its operation
+        except StaleRevisionError:
+
+            self.resync_client(client)
+
+            return
 
         # debug
         except OTError as err:
@@ -231,14 +405,26 @@ class TroopServer(OTServer):
 
             return
 
-        message["operation"] = op.ops
+        # Every client is sent a plain operation, which the sender takes as its acknowledgement
+
+        if isinstance(message, MSG_PIPELINED_OPERATION):
+
+            message = MSG_OPERATION(message["src_id"], op.ops, message["revision"])
+
+        else:
+
+            message["operation"] = op.ops
+
+        self.store_checksum()
+
+        if len(self.presence):
+
+            self.transform_presence(message["src_id"], op.ops)
 
         # Apply to peer tags
-        peer_op = TextOperation([get_peer_char(message["src_id"]) * len(val) if isinstance(val, str) else val for val in op.ops])
-        self.peer_tag_doc = peer_op(self.peer_tag_doc)
+        self.peer_tag_doc.apply(op, message["src_id"])
 
         # Get location of peer
-        client = self.clients[message["src_id"]]
         client.set_index(get_operation_index(message["operation"]))
 
         return message
@@ -271,10 +457,20 @@ class TroopServer(OTServer):
 
                 if self.keepalive_enabled:
 
-                    self.msg_queue.put(MSG_KEEP_ALIVE())
+                    self.enqueue(MSG_KEEP_ALIVE())
 
                     self.purge_client_timeouts()
 
+                # The backend is only changed on the thread that processes messages
+
+                self.enqueue_task(self.purge_departed_clients)
+
+                if self.debug:
+
+                    self.report_queue_depths()
+
+                    self.report_presence_stats()
+
                 sleep(1)
 
             except KeyboardInterrupt:
@@ -287,78 +483,106 @@ class TroopServer(OTServer):
         return
 
     def get_next_id(self):
-        """ Increases the ID counter and returns it. If it goes over the maximum number allowed, it tries to go to back to the start and
-            checks if that client is connected. If all clients are connected, it returns -1, signalling the client to terminate """
-        if self.last_id < self.max_id:
-            self.last_id += 1
-        else:
-            for n in list(range(self.last_id, self.max_id)) + list(range(self.last_id)):
-                if n not in self.clients:
-                    self.last_id = n
-            else:
-                return ERR_MAX_LOGINS # error message for max clients exceeded
-        return self.last_id
+        """ Returns the next ID after the last one given out that is free, going back to the start after the maximum number
+            allowed. An ID is free if it has not been used or its client has disconnected and can no longer resume its session.
+            If no ID is free, it returns ERR_MAX_LOGINS, signalling the client to terminate """
+        with self.id_lock:
+            for n in list(range(self.last_id + 1, self.max_id + 1)) + list(range(self.last_id + 1)):
+                client = self.clients.get(n)
+                if n in self.joining or (client is not None and (client.connected or n in self.departed)):
+                    continue
+                # Forget the old client so that it can't be found when reconnecting
+                self.clients.pop(n, None)
+                self.last_id = n
+                return n
+        return ERR_MAX_LOGINS # error message for max clients exceeded
 
-    def clear_history(self):
-        """ Removes revision history - make sure clients' revision numbers reset """
-        self.backend = MemoryBackend()
-        self.msg_queue = queue.Queue()
+    def connected_clients(self):
+        """ Returns a list of all the connected clients_id's """
+        return (client_id for client_id, client in self.clients.items() if client.connected)
+
+    def purge_client_timeouts(self):
+        """
+        Iterate over connected client and check if they have
+        received keepalive messages recently. Disconnect those
+        that has passed the timeout periods
+        """
+        for client_id in self.connected_clients():
+            client = self.get_client(client_id)
+            if client.has_timedout():
+                self.remove_client(client_id)
+        return
+
+    def purge_departed_clients(self):
+        """ Stops keeping operations for clients that have been disconnected for
+            longer than `resume_timeout` """
+        for client_id, departed in list(self.departed.items()):
+            if time.time() > departed + self.resume_timeout:
+                del self.departed[client_id]
+                self.backend.remove_user(client_id)
+                self.remove_pipelined_user(client_id)
         return
 
-    def wait_for_ack(self, flag):
-        """ Sets flag to disregard messages that are not MSG_CONNECT_ACK until all clients have responded """
-        if flag == True:
+    def join_client(self, message):
+        """ Adds a client to the session without stopping or resetting the other
+            clients. This is called in order with operations, so the client is sent
+            the document at the current revision and then receives every operation
+            after it. If the client is reconnecting, the operations since the revision
+            in `message` are still stored, and the checksum of its document matches the
+            server's at that revision, only those operations are sent instead. """
 
-            self.waiting_for_ack = True
-            self.acknowledged_clients = []
+        client = self.joining.pop(message["src_id"], None)
 
-        for client in list(self.clients.values()):
+        if client is None or not client.connected:
 
-            if client.connected:
+            return
 
-                client.send(MSG_REQUEST_ACK(-1, int(flag)))
+        self.departed.pop(client.id, None)
 
-        return
+        try:
 
-    def connect_ack(self, message):
-        """ Handle response from clients confirming the new connected client """
+            client.handler.connect_clients(client)
 
-        client_id = message["src_id"]
+            # The client's operations are transformed against everything after this point
 
-        self.acknowledged_clients.append(client_id)
+            if client.features & FEATURE_PIPELINED:
 
-        # When we have all clients acknowledged, stop waiting
+                self.add_pipelined_user(client.id)
 
-        if all([client_id in self.acknowledged_clients for client_id in self.connected_clients()]):
+            revision = message["revision"]
 
-            # Send set_text to all to reset the text
+            try:
 
-            self.update_all_clients()
+                if revision < 0 or message["checksum"] < 0 or self.checksums.get(revision) != message["checksum"]:
 
-            # Stop waiting
+                    raise StaleRevisionError("Document checksum does not match revision {}".format(revision))
 
-            self.waiting_for_ack = False
+                for user_id, operation in self.backend.get_history(revision):
 
-            self.acknowledged_clients = []
+                    client.send(MSG_OPERATION(user_id, operation.ops, revision))
 
-            self.wait_for_ack(False)
+                    revision += 1
 
-        return
+                self.backend.acknowledge(client.id, message["revision"])
 
-    def connected_clients(self):
-        """ Returns a list of all the connected clients_id's """
-        return (client_id for client_id, client in self.clients.items() if client.connected)
+            except StaleRevisionError:
+
+                self.resync_client(client)
+
+            client.send(self.get_text_constraint())
+
+            # Tell the client it can start editing
+
+            client.send(MSG_REQUEST_ACK(-1, 0))
+
+        # The client has lost its connection while joining
+
+        except DeadClientError as err:
+
+            self.remove_client(client.id)
+
+            print(err)
 
-    def purge_client_timeouts(self):
-        """
-        Iterate over connected client and check if they have
-        received keepalive messages recently. Disconnect those
-        that has passed the timeout periods
-        """
-        for client_id in self.connected_clients():
-            client = self.get_client(client_id)
-            if client.has_timedout():
-                self.remove_client(client_id)
         return
 
     @staticmethod
@@ -370,41 +594,86 @@ class TroopServer(OTServer):
                 conf[line[0]] = line[1]
         return conf['host'], int(conf['port'])
 
+    def enqueue(self, msg):
+        """ Adds a message received from a client to the queue to be processed """
+        self.msg_queue.put(msg)
+        return
+
+    def enqueue_task(self, func, *args):
+        """ Calls `func` with `args` on the thread that processes messages, in order with them """
+        self.msg_queue.put(partial(func, *args))
+        return
+
     def update_send(self):
-        """ This continually sends any operations to clients
+        """ This continually sends any operations to clients. Blocks until a message
+            arrives, waking up periodically to check the server is still running.
         """
 
         while self.running:
 
+            # Wake up in time to send any waiting presence messages
+
+            timeout = max(0, self.presence_due - time.time()) if len(self.presence) else 0.5
+
             try:
 
-                msg = self.msg_queue.get_nowait()
+                msg = self.msg_queue.get(timeout=timeout)
+
+            except queue.Empty:
 
-                # If logging is set to true, store the message info
+                msg = None
 
-                if self.is_logging:
+            if isinstance(msg, partial):
 
-                    self.log_file.write("%.4f" % time.clock() + " " + repr(str(msg)) + "\n")
+                msg()
 
-                # Store the response of the messages
+            elif msg is not None:
 
-                if isinstance(msg, MSG_OPERATION):
+                self.process_message(msg)
 
-                    msg = self.handle_operation(msg)
+            if len(self.presence) and time.time() >= self.presence_due:
 
-                elif isinstance(msg, MSG_SET_MARK):
+                self.flush_presence()
 
-                    msg = self.handle_set_mark(msg)
+        return
 
-                elif isinstance(msg, MSG_CONSTRAINT):
+    def process_message(self, msg):
+        """ Updates the server state with a message from a client and sends the
+            result on to the connected clients """
 
-                    self.text_constraint = msg
+        # If logging is set to true, store the message info
 
-                self.respond(msg)
+        if self.is_logging:
 
-            except queue.Empty:
+            self.log_file.write("%.4f" % time.time() + " " + repr(str(msg)) + "\n")
 
-                sleep(0.01)
+        # Cursors and selections are coalesced and sent at a limited rate
+
+        if isinstance(msg, (MSG_SET_MARK, MSG_SELECT)):
+
+            if isinstance(msg, MSG_SET_MARK):
+
+                self.handle_set_mark(msg)
+
+            self.queue_presence(msg)
+
+            return
+
+        # Store the response of the messages
+
+        if isinstance(msg, MSG_OPERATION):
+
+            msg = self.handle_operation(msg)
+
+        elif isinstance(msg, MSG_CONSTRAINT):
+
+            self.text_constraint = msg
+
+        elif isinstance(msg, MSG_CONNECT):
+
+            msg = self.join_client(msg)
+
+        self.respond(msg)
 
         return
 
@@ -416,19 +685,54 @@ class TroopServer(OTServer):
 
             return
 
-        for client in list(self.clients.values()):
+        # Clients that asked for it are only sent an acknowledgement of their own operations
+
+        if isinstance(msg, MSG_OPERATION):
+
+            sender = self.clients.get(msg["src_id"])
+
+            if sender is not None and sender.features & FEATURE_COMPACT_ACK:
+
+                self.broadcast(msg, [client for client in list(self.clients.values()) if client is not sender])
+
+                self.broadcast(MSG_OPERATION_ACK(sender.id, self.backend.get_revision()), [sender])
+
+                return
+
+        # Send to all other clients and the sender if "reply" flag is true
+
+        if ('reply' not in msg) or (msg['reply'] == 1):
+
+            self.broadcast(msg)
+
+        else:
+
+            self.broadcast(msg, [client for client in list(self.clients.values()) if client.id != msg['src_id']])
+
+        return
+
+    def broadcast(self, msg, clients=None):
+        """ Sends a message to every connected client in `clients`, or to all clients.
+            The message is only encoded once for each wire format and the same bytes
+            are queued for each client. """
+
+        if clients is None:
+
+            clients = list(self.clients.values())
+
+        for client in clients:
 
             if client.connected:
 
                 try:
 
-                    # Send to all other clients and the sender if "reply" flag is true
+                    client.send(msg)
 
-                    if not self.waiting_for_ack:
+                    # Replace the backlog of a client that can't keep up with the document
 
-                        if (client.id != msg['src_id']) or ('reply' not in msg.data) or (msg['reply'] == 1):
+                    if client.get_backlog_size() > self.high_water:
 
-                            client.send(msg)
+                        self.resync_client(client)
 
                 except DeadClientError as err:
 
@@ -441,6 +745,9 @@ class TroopServer(OTServer):
         return
 
     def remove_client(self, client_id):
+        """ Disconnects a client. This is called from the connection threads, so the
+            other clients are notified on the thread that processes messages, where
+            a client that falls behind can be resynced safely """
 
         # Remove from list(s)
 
@@ -448,13 +755,13 @@ class TroopServer(OTServer):
 
             self.clients[client_id].disconnect()
 
-        # Notify other clients
+            # Keep the operations the client will need if it reconnects soon
 
-        for client in list(self.clients.values()):
+            self.departed[client_id] = time.time()
 
-            if client.connected:
+        # Notify other clients
 
-                client.send(MSG_REMOVE(client_id))
+        self.enqueue_task(self.broadcast, MSG_REMOVE(client_id))
 
         return
 
@@ -470,6 +777,8 @@ class TroopServer(OTServer):
 
                 client.send(outgoing)
 
+                client.flush()
+
                 client.force_disconnect()
 
         sleep(0.5)
@@ -484,13 +793,7 @@ class TroopServer(OTServer):
         """ Replaces sys.stdout """
         if string != "\n":
 
-            outgoing = MSG_RESPONSE(-1, string)
-
-            for client in list(self.clients.values()):
-
-                if client.connected:
-
-                  client.send(outgoing)
+            self.broadcast(MSG_RESPONSE(-1, string))
 
         return
 
@@ -518,7 +821,55 @@ class TroopRequestHandler(socketserver.BaseRequestHandler):
         username = packet[0]['name']
         version  = packet[0]['version']
 
-        if password == self.master.password.hexdigest():
+        # A client that has lost its connection logs in with its old ID to resume
+
+        resume_id = packet[0]['src_id']
+
+        # Agree on the optional features this connection will use
+
+        self.features = packet[0]['features'] & self.master.features
+
+        if password != self.master.password.hexdigest():
+
+            # Negative ID indicates failed login
+
+            stdout("Failed login from {}".format(addr))
+
+            self.client_id = ERR_LOGIN_FAIL
+
+        elif version != self.master.version:
+
+            stdout("User '{}' attempted connection with wrong version".format(username))
+
+            self.client_id = ERR_VERSION_MISMATCH
+
+        elif resume_id >= 0:
+
+            client = self.master.clients.get(resume_id)
+
+            self.client_info = (addr, username)
+
+            if client is None or client.name != username:
+
+                stdout("User '{}' could not resume session as client {}".format(username, resume_id))
+
+                self.client_id = ERR_RESUME_FAIL
+
+            else:
+
+                # The old connection may not have noticed that it was lost, so close it
+
+                if client.connected:
+
+                    stdout("Replacing connection for user '{}'".format(username))
+
+                    client.force_disconnect()
+
+                stdout("{} re-connected user from {}".format(username, addr))
+
+                self.client_id = client.id
+
+        else:
 
             # See if this is a reconnecting client
 
@@ -550,67 +901,64 @@ class TroopRequestHandler(socketserver.BaseRequestHandler):
 
                 # Reply with the client id
 
-                if version != self.master.version:
-
-                    stdout("User '{}' attempted connection with wrong version".format(username))
-
-                    self.client_id = ERR_VERSION_MISMATCH
-
-                else:
-
-                    self.client_id = self.master.get_next_id()
+                self.client_id = self.master.get_next_id()
 
-                    if self.client_id > 0:
+                if self.client_id > 0:
 
-                        stdout("New connected user '{}' from {}".format(username, addr))
+                    stdout("New connected user '{}' from {}".format(username, addr))
 
-        else:
+        # Send back the user_id as a 4 digit number
 
-            # Negative ID indicates failed login
+        reply = "{:04d}".format( self.client_id )
 
-            stdout("Failed login from {}".format(addr))
+        # Reply with the features we accept if the client asked for any
 
-            self.client_id = ERR_LOGIN_FAIL
+        if self.client_id >= 0 and packet[0]['features']:
 
-        # Send back the user_id as a 4 digit number
+            reply += "{:04d}".format( self.features )
 
-        reply = "{:04d}".format( self.client_id ).encode()
-
-        self.request.send(reply)
+        self.send_reply(reply.encode())
 
         return self.client_id
 
+    def send_reply(self, data):
+        """ Sends the result of authentication to the client """
+        self.request.send(data)
+        return
+
     def get_message(self):
         data = self.request.recv(self.master.bytes)
         data = self.reader.feed(data)
         return data
 
     def handle_client_lost(self, verbose=True):
-        """ Terminates cleanly """
+        """ Terminates cleanly. Does nothing if the client has already been removed or
+            has resumed its session on another connection """
+        client = self.master.clients.get(self.client_id)
+        if client is None or client.handler is not self or not client.connected:
+            return
         if verbose:
             stdout("Client '{}' @ {} has disconnected".format(self.client_name, self.client_address[0]))
         self.master.remove_client(self.client_id)
         return
 
     def handle_connect(self, msg):
-        """ Stores information about the new client. Wait for acknowledgement from all connected peers before continuing processing messages """
-        assert isinstance(msg, MSG_CONNECT)
-
-        # Create the client and connect to other clients
-
-        if self.client_address not in list(self.master.clients.values()):
+        """ Creates the client for a new connection and queues it to join the session
+            in order with the messages from other clients """
 
-            new_client = Client(self, name=msg['name'], is_dummy=msg['dummy'])
+        new_client = self.create_client(name=msg['name'], is_dummy=msg['dummy'])
 
-            self.client_name = new_client.name
+        self.client_name = new_client.name
 
-            self.connect_clients(new_client) # Contacts other clients
+        self.master.joining[new_client.id] = new_client
 
-            # Don't accept more messages while connecting
+        self.master.enqueue(msg)
 
-            self.master.wait_for_ack(True)
+        return new_client
 
-            return new_client
+    def create_client(self, name, is_dummy):
+        """ Returns the server-side representation of the client on this connection """
+        return Client(self, name=name, is_dummy=is_dummy)
 
     def leader(self):
         """ Returns the peer client that is "leading" """
@@ -622,21 +970,37 @@ class TroopRequestHandler(socketserver.BaseRequestHandler):
             self.client_address = (address, port)
         """
 
-        # This takes strings read from the socket and returns json objects
+        # This takes strings read from the socket and returns json objects. Clients
+        # from older versions send fewer values when logging in, so use the defaults
+        # for these to be able to tell them that their version does not match.
 
-        self.reader = NetworkMessageReader()
+        self.reader = NetworkMessageReader(defaults=True)
 
         # self.messages  = []
         # self.msg_count = 0
 
         # Password test
 
-        packet = self.get_message()
+        try:
+
+            packet = []
+
+            while len(packet) == 0:
+
+                packet = self.get_message()
+
+        except Exception:
+
+            return
 
         if self.authenticate(packet) < 0:
 
             return
 
+        # Switch to the wire format agreed during authentication
+
+        self.reader = get_message_reader(self.features)
+
         # Enter loop
 
         while self.master.running:
@@ -661,31 +1025,30 @@ class TroopRequestHandler(socketserver.BaseRequestHandler):
 
                 break
 
-            for msg in packet:
-
-                if isinstance(msg, MSG_CONNECT):
+            self.handle_packet(packet)
 
-                    # Add the new client
+        return
 
-                    new_client = self.handle_connect(msg)
+    def handle_packet(self, packet):
+        """ Deals with connection messages and passes the rest on to the server """
 
-                    # Clear server history
+        for msg in packet:
 
-                    self.master.clear_history()
+            if isinstance(msg, MSG_CONNECT):
 
-                elif isinstance(msg, MSG_KEEP_ALIVE):
+                # Add the new or reconnecting client
 
-                    self.client().recv_keepalive()
+                self.handle_connect(msg)
 
-                elif self.master.waiting_for_ack and isinstance(msg, MSG_CONNECT_ACK):
+            elif isinstance(msg, MSG_KEEP_ALIVE):
 
-                    self.master.connect_ack(msg)
+                self.client().recv_keepalive()
 
-                elif not self.master.waiting_for_ack:
+            else:
 
-                    # Add any other messages to the send queue
+                # Add any other messages to the send queue
 
-                    self.master.msg_queue.put(msg)
+                self.master.enqueue(msg)
 
         return
 
@@ -728,7 +1091,24 @@ class TroopRequestHandler(socketserver.BaseRequestHandler):
 
             if client.connected:
 
-                client.send(msg1)
+                # Other clients that have lost their connection are removed, but the
+                # new client's error is left to `join_client`
+
+                try:
+
+                    client.send(msg1)
+
+                except DeadClientError as err:
+
+                    if client is new_client:
+
+                        raise
+
+                    self.master.remove_client(client.id)
+
+                    print(err)
+
+                    continue
 
                 # Tell the new client about other clients
 
@@ -740,15 +1120,6 @@ class TroopRequestHandler(socketserver.BaseRequestHandler):
 
         return
 
-    def update_client(self):
-        """ Send all the previous operations to the client to keep it up to date """
-
-        client = self.client()
-        client.send(MSG_SET_ALL(-1, *self.master.get_contents()))
-        client.send(self.master.get_text_constraint())
-
-        return
-
 # Keeps information about each connected client
 
 class Client:
@@ -765,6 +1136,11 @@ class Client:
         self.port     = self.address[1]
 
         self.source   = self.handler.request
+        self.features = self.handler.features
+
+        # Compresses everything written after logging in, if agreed
+
+        self.compressor = get_stream_compressor(self.features)
 
         self.keepalive = None
 
@@ -778,12 +1154,41 @@ class Client:
         self.index = 0
         self.connected = True
 
+        # Revision of the last document this client was sent to resync it
+
+        self.resync_revision = 0
+
         # A list of messages to process
 
         self.messages = []
 
+        # Messages waiting to be sent, stored with their encoded bytes
+
+        self.outbox   = deque()
+        self.queued   = 0 # bytes in the outbox
+        self.snapshot = 0 # bytes of a resync document in the outbox
+        self.sending  = False
+
+        self.outbox_ready = Condition()
+
+        self.start_writer()
+
+    def start_writer(self):
+        """ Starts the thread that writes messages to the socket """
+        self.writer = Thread(target=self.write_messages)
+        self.writer.daemon = True
+        self.writer.start()
+        return
+
     def disconnect(self):
         self.connected = False
+        with self.outbox_ready:
+            self.outbox_ready.notify_all()
+        # Wake up the handler if it is still reading from the connection
+        try:
+            self.source.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         self.source.close()
 
     def connect(self, socket):
@@ -800,11 +1205,88 @@ class Client:
         return repr(self.address)
 
     def send(self, message):
-        try:
-            self.source.sendall(message.bytes())
-        except Exception as e:
-            print(e)
+        """ Adds a message to the outbox without waiting for it to be sent """
+        if not self.connected:
             raise DeadClientError(self.hostname)
+        data = message.encode(self.features)
+        with self.outbox_ready:
+            self.outbox.append((message, data))
+            self.queued += len(data)
+            self.outbox_ready.notify()
+        return
+
+    def send_snapshot(self, message):
+        """ Sends the whole document in place of any operations and marks still in the
+            outbox, which it makes out of date """
+        with self.outbox_ready:
+            keep = [item for item in self.outbox if not isinstance(item[0], (MSG_OPERATION, MSG_OPERATION_ACK, MSG_SET_MARK, MSG_SET_ALL))]
+            self.outbox.clear()
+            self.outbox.extend(keep)
+            self.queued = sum(len(data) for _, data in keep)
+            self.send(message)
+            if len(self.outbox) and self.outbox[-1][0] is message:
+                self.snapshot = len(self.outbox[-1][1])
+        return
+
+    def compress(self, data):
+        """ Returns the bytes to write to the connection for `data` """
+        if self.compressor is None:
+            return data
+        return self.compressor.compress(data)
+
+    def write_messages(self):
+        """ Writes everything in the outbox to the socket in one go whenever messages are added """
+
+        while True:
+
+            with self.outbox_ready:
+
+                while self.connected and len(self.outbox) == 0:
+
+                    self.outbox_ready.wait()
+
+                if not self.connected:
+
+                    return
+
+                data = self.compress(b"".join(data for _, data in self.outbox))
+
+                self.outbox.clear()
+                self.queued   = 0
+                self.snapshot = 0
+                self.sending  = True
+
+            try:
+
+                self.source.sendall(data)
+
+            except Exception as e:
+
+                print(e)
+
+                if self.connected:
+
+                    self.force_disconnect()
+
+            with self.outbox_ready:
+
+                self.sending = False
+                self.outbox_ready.notify_all()
+
+        return
+
+    def get_backlog(self):
+        """ Returns the number of messages and bytes waiting to be sent """
+        return len(self.outbox), self.queued
+
+    def get_backlog_size(self):
+        """ Returns the number of bytes waiting to be sent, not counting a resync document """
+        return self.queued - self.snapshot
+
+    def flush(self, timeout=1):
+        """ Waits until the outbox has been written to the socket """
+        with self.outbox_ready:
+            self.outbox_ready.wait_for(lambda: not self.connected or (len(self.outbox) == 0 and not self.sending), timeout)
         return
 
     def recv_keepalive(self):
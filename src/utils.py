@@ -4,6 +4,7 @@ ERR_LOGIN_FAIL = -1
 ERR_MAX_LOGINS = -2
 ERR_NAME_TAKEN = -3
 ERR_VERSION_MISMATCH = -4
+ERR_RESUME_FAIL = -5
 
 # List of all the possible characters used to represent peers in the document
 
@@ -87,6 +88,24 @@ def get_operation_size(ops):
             count += op
     return count
 
+def transform_index(ops, index, after_insert=False):
+    """ Returns where `index` is in the document after the operation has been applied.
+        Text inserted at `index` is put before it if `after_insert` is True """
+    pos = 0
+    new_index = index
+    for op in ops:
+        if pos > index:
+            break
+        if isinstance(op, str):
+            if pos < index or after_insert:
+                new_index += len(op)
+        elif op > 0:
+            pos += op
+        else:
+            new_index -= max(0, min(-op, index - pos))
+            pos -= op
+    return new_index
+
 def empty_operation(ops):
     """ Returns True if the operation is an empty list or only contains positive integers """
     return (ops == [] or all([isinstance(x, int) and (x > 0) for x in ops]))
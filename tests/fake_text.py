@@ -0,0 +1,231 @@
+"""
+    A stand-in for the Tk widgets used by ThreadSafeText so that the text
+    box can be tested without a display. The contents of the widget are kept
+    as a string and each tag as a set of character offsets.
+"""
+
+import re
+import unittest
+from unittest import mock
+
+try:
+    import tkinter as Tk
+except ImportError:
+    Tk = None
+
+if Tk is not None:
+    from src.interface import textbox, peer, constraints
+    from src.interface.textbox import ThreadSafeText
+    from src.interface.peer import Peer
+    from src.interpreter import DummyInterpreter
+    from src.message import MSG_SET_ALL
+else:
+    ThreadSafeText = object
+
+
+class Var:
+    def __init__(self, *args, **kwargs):
+        self.value = None
+    def set(self, value):
+        self.value = value
+    def get(self):
+        return self.value
+
+
+class Label:
+    def __init__(self, *args, **kwargs):
+        pass
+    def config(self, **kwargs):
+        pass
+    def place(self, **kwargs):
+        pass
+
+
+class Font:
+    def measure(self, text):
+        return 8 * len(text)
+    def metrics(self, name):
+        return 16
+
+
+class FakeText(ThreadSafeText):
+    """ A ThreadSafeText whose widget contents are stored in Python """
+
+    re_index = re.compile(r"^(?P<base>end|\d+\.(\d+|end)|[\w-]+?)(?P<offset>[+-]\d+c)?$")
+
+    def __init__(self, root):
+        self.text  = ""
+        self.tags  = {}
+        self.marks = {}
+        self.frames = 0
+        self.tk = Tk.Tcl().tk
+        ThreadSafeText.__init__(self, root)
+
+    def offset(self, index):
+        """ Returns the character offset of a tcl index """
+        index = str(index).replace(" ", "")
+        if index.startswith("@"):
+            return 0
+        match = self.re_index.match(index)
+        base, extra = match.group("base"), match.group("offset")
+        if base == "end":
+            result = len(self.text)
+        elif base in self.marks:
+            result = self.marks[base]
+        elif "." in base:
+            row, col = base.split(".")
+            lines = self.text.split("\n")
+            row = int(row)
+            if row > len(lines):
+                return len(self.text)
+            start = sum(len(line) + 1 for line in lines[:row - 1])
+            col = len(lines[row - 1]) if col == "end" else min(int(col), len(lines[row - 1]))
+            result = start + col
+        else:
+            result = 0
+        if extra:
+            result += int(extra[:-1])
+        return max(0, min(result, len(self.text)))
+
+    def range(self, start, end=None):
+        start = self.offset(start)
+        end = self.offset(end) if end is not None else min(start + 1, len(self.text))
+        return start, max(start, end)
+
+    def tcl(self, offset):
+        before = self.text[:offset]
+        return "{}.{}".format(before.count("\n") + 1, offset - (before.rfind("\n") + 1))
+
+    def insert(self, index, text, *tags):
+        start = self.offset(index)
+        self.text = self.text[:start] + text + self.text[start:]
+        for name in self.tags:
+            self.tags[name] = {i + len(text) if i >= start else i for i in self.tags[name]}
+        for name in tags:
+            self.tags.setdefault(name, set()).update(range(start, start + len(text)))
+
+    def delete(self, start, end=None):
+        start, end = self.range(start, end)
+        self.text = self.text[:start] + self.text[end:]
+        for name in self.tags:
+            self.tags[name] = {i - (end - start) if i >= end else i for i in self.tags[name] if not start <= i < end}
+
+    def get(self, start, end=None):
+        start, end = self.range(start, end)
+        return self.text[start:end]
+
+    def index(self, index):
+        return self.tcl(self.offset(index))
+
+    def tag_add(self, name, *indices):
+        for i in range(0, len(indices), 2):
+            start, end = self.range(*indices[i:i + 2])
+            self.tags.setdefault(name, set()).update(range(start, end))
+
+    def tag_remove(self, name, start, end=None):
+        start, end = self.range(start, end)
+        self.tags.setdefault(name, set()).difference_update(range(start, end))
+
+    def get_tag(self, name):
+        """ Returns the (start, end) ranges of a tag """
+        ranges = []
+        for i in sorted(self.tags.get(name, ())):
+            if len(ranges) and ranges[-1][1] == i:
+                ranges[-1][1] = i + 1
+            else:
+                ranges.append([i, i + 1])
+        return [tuple(item) for item in ranges]
+
+    def mark_set(self, name, index):
+        self.marks[name] = self.offset(index)
+
+    def tag_config(self, *args, **kwargs):
+        pass
+
+    tag_configure = tag_config
+
+    def tag_raise(self, *args):
+        pass
+
+    def config(self, **kwargs):
+        pass
+
+    configure = config
+
+    def configure_font(self):
+        self.font = self.font_bold = self.font_italic = Font()
+        self.font_names = []
+
+    def yview(self, *args):
+        return (0.0, 1.0)
+
+    def see(self, index):
+        pass
+
+    def bbox(self, index):
+        return None
+
+    def winfo_height(self):
+        return 600
+
+    def winfo_width(self):
+        return 800
+
+    def update_idletasks(self):
+        self.frames += 1
+
+    def after(self, ms, func=None, *args):
+        pass
+
+
+class Client:
+    def __init__(self):
+        self.peers = {}
+
+
+class Root:
+    """ The parts of the Interface used by the text box """
+    is_logging = False
+    def __init__(self):
+        self.root   = None
+        self.client = Client()
+        self.lang   = DummyInterpreter()
+        self.sent   = []
+    def add_to_send_queue(self, message):
+        self.sent.append(message)
+
+
+@unittest.skipIf(Tk is None, "tkinter is not available")
+class TextTestCase(unittest.TestCase):
+    """ Creates a FakeText with peers 0 (the local user), 1 and 2 """
+
+    peer_ids = (0, 1, 2)
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(textbox.Text, "__init__", lambda *args, **kwargs: None),
+            mock.patch.object(peer.Tk, "StringVar", Var),
+            mock.patch.object(peer.Tk, "Label", Label),
+            mock.patch.object(constraints, "BooleanVar", Var),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.root = Root()
+        self.text = self.make_text()
+
+    def make_text(self, document=""):
+        """ Returns a FakeText showing `document`, written by peer 0 """
+        self.root.client.peers.clear()
+        text = FakeText(self.root)
+        for peer_id in self.peer_ids:
+            self.root.client.peers[peer_id] = Peer(peer_id, "peer{}".format(peer_id), False, text)
+        text.marker = self.root.client.peers[0]
+        text.handle_set_all(MSG_SET_ALL(-1, document, [[0, len(document)]] if document else [], {}, 0))
+        return text
+
+    def assertWidgetMatches(self, text):
+        """ Checks that the widget shows the document and the text of each peer """
+        self.assertEqual(text.text, str(text.document))
+        for peer_id, user in text.peers.items():
+            self.assertEqual(text.get_tag(user.text_tag), text.peer_tag_doc.ranges(peer_id))
@@ -0,0 +1,88 @@
+import socket
+import threading
+import time
+import unittest
+from hashlib import md5
+from unittest import mock
+
+from src.aioserver import AsyncTroopServer, AsyncTroopRequestHandler
+from src.config import VERSION
+from src.message import *
+
+
+class TestAsyncTroopServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = AsyncTroopServer(password="pw", port=58990)
+        self.thread = threading.Thread(target=self.server.start)
+        self.thread.start()
+        self.connections = []
+
+    def tearDown(self):
+        for conn in self.connections:
+            conn.close()
+        self.server.kill()
+        self.thread.join(5)
+
+    def join(self, name):
+        """ Logs in and waits until the server has sent the document """
+        for _ in range(50):
+            try:
+                conn = socket.create_connection(("localhost", self.server.port))
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+        conn.settimeout(5)
+        self.connections.append(conn)
+        conn.sendall(MSG_PASSWORD(-1, md5(b"pw").hexdigest(), name, VERSION).bytes())
+        client_id = int(conn.recv(4))
+        conn.sendall(MSG_CONNECT(client_id, name, "localhost", 0).bytes())
+        reader = NetworkMessageReader()
+        self.wait_for(conn, reader, MSG_REQUEST_ACK)
+        return conn, reader, client_id
+
+    def wait_for(self, conn, reader, cls):
+        """ Returns the first message of type `cls` read from a connection """
+        while True:
+            for msg in reader.feed(conn.recv(4096)):
+                if isinstance(msg, cls):
+                    return msg
+
+    def test_operations_are_sent_to_other_clients(self):
+        conn_a, reader_a, id_a = self.join("a")
+        conn_b, reader_b, id_b = self.join("b")
+        conn_a.sendall(MSG_OPERATION(id_a, ["hello"], 0).bytes())
+        msg = self.wait_for(conn_b, reader_b, MSG_OPERATION)
+        self.assertEqual((msg["src_id"], msg["operation"]), (id_a, ["hello"]))
+        self.assertEqual(self.wait_for(conn_a, reader_a, MSG_OPERATION)["operation"], ["hello"])
+        self.assertEqual(self.server.document, "hello")
+
+    def test_error_in_connection(self):
+        conn_a, reader_a, id_a = self.join("a")
+        conn_b, reader_b, id_b = self.join("b")
+        with mock.patch.object(AsyncTroopRequestHandler, "handle_packet", side_effect=ValueError("error")):
+            conn_a.sendall(MSG_SET_MARK(id_a, 0).bytes())
+            # The connection is closed and the other client is told
+            while conn_a.recv(4096):
+                pass
+            self.assertEqual(self.wait_for(conn_b, reader_b, MSG_REMOVE)["src_id"], id_a)
+        self.assertFalse(self.server.clients[id_a].connected)
+
+
+class TestDebug(unittest.TestCase):
+
+    def test_reports_presence_stats(self):
+        server = AsyncTroopServer(port=58990, debug=True)
+        reported = threading.Event()
+        with mock.patch.object(server, "report_presence_stats", reported.set):
+            thread = threading.Thread(target=server.start)
+            thread.start()
+            try:
+                self.assertTrue(reported.wait(5))
+            finally:
+                server.kill()
+                thread.join(5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from src.client import Client
+from src.message import *
+
+
+class TestCollapseMessages(unittest.TestCase):
+    """ Marks and selections waiting to be sent are dropped if a newer one of
+        the same kind is waiting after them """
+
+    def test_superseded_dropped(self):
+        messages = [MSG_SET_MARK(0, 1), MSG_SELECT(0, 1, 2), MSG_SET_MARK(0, 2), MSG_SELECT(0, 1, 3), MSG_SET_MARK(0, 3)]
+        self.assertEqual(Client.collapse_messages(messages), [MSG_SELECT(0, 1, 3), MSG_SET_MARK(0, 3)])
+
+    def test_reply_kept_apart(self):
+        messages = [MSG_SET_MARK(0, 1, 0), MSG_SET_MARK(0, 2), MSG_SET_MARK(0, 3, 0)]
+        self.assertEqual(Client.collapse_messages(messages), [MSG_SET_MARK(0, 2), MSG_SET_MARK(0, 3, 0)])
+
+    def test_order_with_operations(self):
+        messages = [
+            MSG_SET_MARK(0, 1),
+            MSG_OPERATION(0, [1, "a"], 0),
+            MSG_SET_MARK(0, 2),
+            MSG_EVALUATE_STRING(0, "a"),
+            MSG_OPERATION(0, [2, "b"], 0),
+            MSG_SET_MARK(0, 3),
+            MSG_CONSOLE(0, "x"),
+        ]
+        # The newest mark stays after the operations that were sent before it
+        self.assertEqual(Client.collapse_messages(messages), [
+            MSG_OPERATION(0, [1, "a"], 0),
+            MSG_EVALUATE_STRING(0, "a"),
+            MSG_OPERATION(0, [2, "b"], 0),
+            MSG_SET_MARK(0, 3),
+            MSG_CONSOLE(0, "x"),
+        ])
+
+    def test_nothing_dropped(self):
+        messages = [MSG_OPERATION(0, ["a"], 0), MSG_SET_MARK(0, 1), MSG_SELECT(0, 0, 1), MSG_OPERATION(0, [1, "b"], 1)]
+        self.assertEqual(Client.collapse_messages(messages), messages)
+        self.assertEqual(Client.collapse_messages([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
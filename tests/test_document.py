@@ -0,0 +1,178 @@
+import random
+import unittest
+
+from src.document import FenwickTree, Rope, PeerTagMap
+from src.ot.text_operation import TextOperation, IncompatibleOperationError
+
+
+class SmallRope(Rope):
+    """ Uses small chunks so that edits split and join them """
+    chunk_size = 8
+
+
+def random_operation(length, rand):
+    """ Returns an operation that makes a few random edits to a document """
+    points = sorted(rand.randint(0, length) for _ in range(rand.randint(1, 3)))
+    operation = TextOperation()
+    i = 0
+    for point in points:
+        if point < i:
+            continue
+        operation.retain(point - i)
+        i = point
+        if rand.random() < 0.6:
+            operation.insert("".join(rand.choice("ab\n") for _ in range(rand.randint(1, 20))))
+        if rand.random() < 0.5:
+            deleted = rand.randint(0, min(30, length - i))
+            operation.delete(deleted)
+            i += deleted
+    operation.retain(length - i)
+    return operation
+
+
+def tag_string(runs):
+    """ Returns the per-character string of peer ids that the runs stand for """
+    return "".join(chr(65 + peer_id) * length for peer_id, length in runs)
+
+
+class TestFenwickTree(unittest.TestCase):
+
+    def test_prefix_and_search(self):
+        rand = random.Random(0)
+        values = [rand.randint(0, 5) for _ in range(50)]
+        tree = FenwickTree(values)
+        for _ in range(200):
+            i = rand.randrange(len(values))
+            delta = rand.randint(-values[i], 5)
+            values[i] += delta
+            tree.add(i, delta)
+            for j in range(len(values) + 1):
+                self.assertEqual(tree.prefix(j), sum(values[:j]))
+            value = rand.randint(0, sum(values))
+            pos, before = tree.search(value)
+            self.assertEqual(before, sum(values[:pos]))
+            if pos < len(values):
+                self.assertGreater(sum(values[:pos + 1]), value)
+
+
+class TestRope(unittest.TestCase):
+    """ A Rope must behave like the string it stores """
+
+    def check(self, rope, string):
+        self.assertEqual(str(rope), string)
+        self.assertEqual(len(rope), len(string))
+        self.assertEqual(rope.count_lines(), string.count("\n") + 1)
+        self.assertTrue(all(0 < len(chunk) <= 2 * rope.chunk_size for chunk in rope.chunks) or len(rope.chunks) == 1)
+
+    def test_edits(self):
+        rand = random.Random(1)
+        string = "".join(rand.choice("abc\n") for _ in range(100))
+        rope = SmallRope(string)
+        for _ in range(2000):
+            index = rand.randint(0, len(string))
+            if rand.random() < 0.5:
+                text = "".join(rand.choice("xy\n") for _ in range(rand.randint(0, 40)))
+                rope.insert(index, text)
+                string = string[:index] + text + string[index:]
+            else:
+                length = rand.randint(0, min(30, len(string) - index))
+                rope.delete(index, length)
+                string = string[:index] + string[index + length:]
+            self.check(rope, string)
+            start = rand.randint(0, len(string))
+            stop = rand.randint(start, len(string))
+            self.assertEqual(rope.substring(start, stop), string[start:stop])
+            self.assertEqual(rope[start:stop], string[start:stop])
+            if len(string):
+                self.assertEqual(rope[start % len(string)], string[start % len(string)])
+
+    def test_apply(self):
+        rand = random.Random(2)
+        string = "hello\nworld"
+        rope = SmallRope(string)
+        for _ in range(500):
+            operation = random_operation(len(string), rand)
+            rope.apply(operation)
+            string = operation(string)
+            self.check(rope, string)
+
+    def test_lines(self):
+        rand = random.Random(4)
+        for _ in range(100):
+            string = "".join(rand.choice("ab\n") for _ in range(rand.randint(0, 60)))
+            rope = SmallRope(string)
+            lines = string.split("\n")
+            self.assertEqual(rope.count_lines(), len(lines))
+            start = 0
+            for line, contents in enumerate(lines):
+                self.assertEqual(rope.line_start(line), start)
+                self.assertEqual(rope.line_end(line), start + len(contents))
+                self.assertEqual(rope.get_line(line), contents)
+                start += len(contents) + 1
+            for index in range(len(string) + 1):
+                self.assertEqual(rope.line_of(index), string[:index].count("\n"))
+            with self.assertRaises(IndexError):
+                rope.line_start(len(lines))
+
+    def test_apply_wrong_length(self):
+        with self.assertRaises(IncompatibleOperationError):
+            Rope("abc").apply(TextOperation([2, "x"]))
+        with self.assertRaises(IndexError):
+            Rope("abc").insert(4, "x")
+        with self.assertRaises(IndexError):
+            Rope("abc").delete(2, 2)
+
+
+class TestPeerTagMap(unittest.TestCase):
+    """ A PeerTagMap must give the same owners as a string with a character
+        for the peer that wrote each character of the document """
+
+    def check(self, tags, string):
+        self.assertEqual(tag_string(tags.to_list()), string)
+        self.assertEqual(len(tags), len(string))
+        runs = tags.to_list()
+        self.assertTrue(all(a[0] != b[0] for a, b in zip(runs, runs[1:])))
+        self.assertTrue(all(length > 0 for _, length in runs))
+        counts = {}
+        for char in string:
+            counts[ord(char) - 65] = counts.get(ord(char) - 65, 0) + 1
+        self.assertEqual(tags.counts(), counts)
+        self.assertEqual(sorted(tags.peers()), sorted(counts))
+        for peer_id in counts:
+            ranges = tags.ranges(peer_id)
+            self.assertEqual(sum(end - start for start, end in ranges), counts[peer_id])
+            self.assertTrue(all(set(string[start:end]) == {chr(65 + peer_id)} for start, end in ranges))
+
+    def test_apply(self):
+        rand = random.Random(3)
+        tags = PeerTagMap([(0, 20), (1, 5)])
+        string = "A" * 20 + "B" * 5
+        for _ in range(1000):
+            peer_id = rand.randint(0, 4)
+            operation = random_operation(len(string), rand)
+            tags.apply(operation, peer_id)
+            model = []
+            i = 0
+            for op in operation:
+                if isinstance(op, str):
+                    model.append(chr(65 + peer_id) * len(op))
+                elif op > 0:
+                    model.append(string[i:i + op])
+                    i += op
+                else:
+                    i -= op
+            string = "".join(model)
+            self.check(tags, string)
+
+    def test_from_list(self):
+        tags = PeerTagMap.from_list([[1, 3], [1, 2], [2, 4]])
+        self.assertEqual(tags.to_list(), [(1, 5), (2, 4)])
+        self.assertEqual(PeerTagMap.from_list(tags.to_list()).to_list(), tags.to_list())
+
+    def test_apply_wrong_length(self):
+        with self.assertRaises(IncompatibleOperationError):
+            PeerTagMap([(0, 3)]).apply(TextOperation([2, "x"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import random
+import re
+import unittest
+
+from tests.fake_text import TextTestCase
+
+from src.interface.highlighter import SyntaxHighlighter
+from src.interpreter import FoxDotInterpreter, TidalInterpreter, SuperColliderInterpreter
+from src.message import *
+from src.ot.text_operation import TextOperation
+from src.utils import get_operation_size
+
+
+class Language:
+    """ The parts of an interpreter used by the highlighter, with the comments
+        and strings of `syntax_lang` """
+    def __init__(self, syntax_lang):
+        self.syntax_lang = syntax_lang
+        self.block_comments = syntax_lang.block_comments
+        self.string_chars = syntax_lang.string_chars
+        self.re = {"tag_bold": self.find_keyword, "tag_italic": syntax_lang.find_comment}
+    @staticmethod
+    def find_keyword(string):
+        return [(match.start(), match.end()) for match in re.finditer(r"\bd1\b|>>", string)]
+
+
+def expected_tags(document, lang):
+    """ Returns the offsets of each tag when the whole document is tokenized at once """
+    highlighter = SyntaxHighlighter(None)
+    highlighter.lang = lang
+    tags, state, start = {}, None, 0
+    for line in document.split("\n"):
+        line_tags, state = highlighter.scan(line, state)
+        for tag_name, tag_start, tag_end in line_tags:
+            tags.setdefault(tag_name, set()).update(range(start + tag_start, start + tag_end))
+        start += len(line) + 1
+    return {tag_name: offsets for tag_name, offsets in tags.items() if offsets}
+
+
+class TestHighlighter(TextTestCase):
+    """ Only the lines changed by an operation, and the lines after them whose
+        starting state changes, are tokenized again. The tags must be the same
+        as tokenizing the whole document """
+
+    pieces = ["a", " ", "\n", "d1", ">>", "#", "--", "//", '"', "'", "every' ", '"""', "'''", "{-", "-}", "/*", "*/"]
+
+    def random_insert(self, length, rand):
+        index = rand.randint(0, length)
+        string = "".join(rand.choice(self.pieces) for _ in range(rand.randint(1, 3)))
+        return [op for op in (index, string, length - index) if op]
+
+    def random_delete(self, length, rand):
+        index = rand.randint(0, length - 1)
+        deleted = rand.randint(1, min(6, length - index))
+        return [op for op in (index, -deleted, length - index - deleted) if op]
+
+    def assertTagsMatch(self, text):
+        tags = {tag_name: offsets for tag_name, offsets in text.tags.items() if offsets and tag_name in ("tag_bold", "tag_italic")}
+        self.assertEqual(tags, expected_tags(str(text.document), self.root.lang))
+
+    def check_language(self, syntax_lang, seed):
+        rand = random.Random(seed)
+        self.root.lang = Language(syntax_lang)
+        text = self.make_text("d1 >> play('x')\n")
+        self.assertTagsMatch(text)
+        for revision in range(150):
+            length = len(text.document)
+            if rand.random() < 0.3:
+                # Local edits are highlighted straight away
+                ops = self.random_delete(length, rand) if length and rand.random() < 0.3 else self.random_insert(length, rand)
+                text.apply_operation(TextOperation(ops), peer=text.marker)
+            else:
+                # Remote edits are highlighted once for each batch
+                for _ in range(rand.randint(1, 3)):
+                    ops = self.random_delete(length, rand) if length and rand.random() < 0.3 else self.random_insert(length, rand)
+                    text.queue.put(MSG_OPERATION(rand.choice((1, 2)), ops, revision))
+                    length += get_operation_size(ops)
+                text.process_queue()
+            self.assertTagsMatch(text)
+
+    def test_foxdot(self):
+        for seed in range(10):
+            self.check_language(FoxDotInterpreter, seed)
+
+    def test_tidal(self):
+        for seed in range(10):
+            self.check_language(TidalInterpreter, seed)
+
+    def test_supercollider(self):
+        for seed in range(10):
+            self.check_language(SuperColliderInterpreter, seed)
+
+    def test_language_change(self):
+        self.root.lang = Language(FoxDotInterpreter)
+        text = self.make_text('x = """\nd1 >> {-\n"""\n')
+        self.root.lang = Language(TidalInterpreter)
+        text.highlighter.highlight([1])
+        self.assertTagsMatch(text)
+
+    def test_tidal_primes(self):
+        # A ' after a name does not start a string, so the comment carries on
+        self.root.lang = Language(TidalInterpreter)
+        text = self.make_text("d1 $ every' 2 rev {- one\ntwo -}\nd1")
+        self.assertEqual(text.get_tag("tag_italic"), [(18, 24), (25, 31)])
+        self.assertTagsMatch(text)
+
+
+class TestBlockStart(unittest.TestCase):
+
+    def test_quotes(self):
+        line = "d1 $ every' 3 (fast 2) $ s \"bd\" {- start"
+        blocks = TidalInterpreter.block_comments
+        self.assertEqual(SyntaxHighlighter.find_block_start(line, 0, blocks, TidalInterpreter.string_chars), (line.index("{-"), 0))
+        self.assertEqual(SyntaxHighlighter.find_block_start('"{-" {-', 0, blocks), (5, 0))
+        self.assertEqual(SyntaxHighlighter.find_block_start("'{-'", 0, blocks), (4, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
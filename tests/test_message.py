@@ -0,0 +1,131 @@
+import unittest
+from unittest import mock
+
+from src.message import *
+
+
+class TestNetworkMessageReader(unittest.TestCase):
+
+    def test_read_messages(self):
+        messages = [MSG_OPERATION(2, [5, "abc", -1], 10), MSG_SET_MARK(3, 7), MSG_EVALUATE_STRING(1, "a <b> c")]
+        reader = NetworkMessageReader()
+        self.assertEqual(reader.feed("".join(str(msg) for msg in messages)), messages)
+
+    def test_read_split_message(self):
+        msg = MSG_PASSWORD(-1, "hash", "name", "0.10.4", FEATURE_FRAMED)
+        data = str(msg)
+        reader = NetworkMessageReader()
+        self.assertEqual(reader.feed(data[:20]), [])
+        self.assertEqual(reader.feed(data[20:]), [msg])
+
+    def test_missing_values_wait_for_more_data(self):
+        # A login without the features is only complete when using the defaults
+        data = MESSAGE.compile(MSG_PASSWORD.type, 0, -1, "hash", "name", "0.10.3")
+        self.assertEqual(NetworkMessageReader().feed(data), [])
+
+    def test_read_login_from_older_version(self):
+        data = MESSAGE.compile(MSG_PASSWORD.type, 0, -1, "hash", "name", "0.10.3")
+        packet = NetworkMessageReader(defaults=True).feed(data)
+        self.assertEqual(len(packet), 1)
+        self.assertEqual(packet[0]['version'], "0.10.3")
+        self.assertEqual(packet[0]['features'], 0)
+
+    def test_defaults_need_required_values(self):
+        data = MESSAGE.compile(MSG_PASSWORD.type, 0, -1, "hash")
+        self.assertEqual(NetworkMessageReader(defaults=True).feed(data), [])
+
+    def test_document_without_revision_waits_for_more_data(self):
+        # Only a login is read using defaults, so a document is never read before its revision arrives
+        data = MESSAGE.compile(MSG_SET_ALL.type, 0, -1, "text", [], {})
+        reader = NetworkMessageReader()
+        self.assertEqual(reader.feed(data), [])
+        self.assertEqual(reader.feed(MESSAGE.compile(12)), [MSG_SET_ALL(-1, "text", [], {}, 12)])
+
+    def test_read_login_with_features(self):
+        msg = MSG_PASSWORD(-1, "hash", "name", "0.10.4", FEATURE_FRAMED | FEATURE_COMPRESSED)
+        self.assertEqual(NetworkMessageReader(defaults=True).feed(str(msg)), [msg])
+
+
+class TestFramedMessageReader(unittest.TestCase):
+
+    def test_read_frames(self):
+        messages = [MSG_OPERATION(2, [5, "abc", -1], 10), MSG_SELECT(3, 1, 4), MSG_CONNECT(4, "name", "host", 57890)]
+        data = b"".join(msg.encode(FEATURE_FRAMED) for msg in messages)
+        reader = FramedMessageReader()
+        result = []
+        for i in range(0, len(data), 7):
+            result.extend(reader.feed(data[i:i+7]))
+        self.assertEqual(result, messages)
+
+    def test_read_compressed_frames(self):
+        features = FEATURE_FRAMED | FEATURE_COMPRESSED
+        messages = [MSG_OPERATION(2, ["abc" * 10], 10), MSG_OPERATION(2, [30, "abc" * 10], 11)]
+        compressor = get_stream_compressor(features)
+        reader = get_message_reader(features)
+        result = []
+        for msg in messages:
+            result.extend(reader.feed(compressor.compress(msg.encode(features))))
+        self.assertEqual(result, messages)
+
+
+class TestMessageValues(unittest.TestCase):
+
+    def test_keys_follow_arguments(self):
+        self.assertEqual(MSG_SET_MARK.header(), ["type", "msg_id", "src_id", "index", "reply"])
+        self.assertEqual(MSG_RESET.keys, MSG_SET_ALL.keys)
+        self.assertEqual(MSG_KEEP_ALIVE.required, 2)
+        self.assertEqual(MSG_PASSWORD.required, 6)
+        for cls in MESSAGE_TYPE.values():
+            self.assertEqual(cls.index, {key: i for i, key in enumerate(cls.keys)})
+
+    def test_access_by_name(self):
+        msg = MSG_SELECT(3, 1, 4)
+        self.assertEqual((msg["type"], msg["src_id"], msg["start"], msg["end"], msg["reply"]), (MSG_SELECT.type, 3, 1, 4, 1))
+        self.assertIn("start", msg)
+        self.assertNotIn("index", msg)
+        msg["end"] = 5
+        self.assertEqual(msg.dict(), {"type": MSG_SELECT.type, "msg_id": 0, "src_id": 3, "start": 1, "end": 5, "reply": 1})
+        with self.assertRaises(KeyError):
+            msg["index"]
+
+    def test_from_values(self):
+        messages = [MSG_CONNECT(1, "name", "host", 57890, 0, 4, 123), MSG_OPERATION(2, [1, "a"], 3),
+                    MSG_SET_ALL(-1, "abc", [[0, 3]], {"0": 1}, 7), MSG_RESET(-1, "", [], {}),
+                    MSG_EVALUATE_BLOCK(1, 2, 3), MSG_KEEP_ALIVE(), MSG_PIPELINED_OPERATION(1, ["x"], 2, 3),
+                    MSG_OPERATION_ACK(1, 5)]
+        for msg in messages:
+            self.assertFalse(hasattr(msg, "__dict__"))
+            msg.set_msg_id(9)
+            self.assertEqual(MESSAGE.from_values(list(msg)), msg)
+            self.assertEqual(NetworkMessageReader().feed(str(msg)), [msg])
+
+    def test_equality(self):
+        self.assertEqual(MSG_SET_MARK(1, 2), MSG_SET_MARK(1, 2))
+        self.assertNotEqual(MSG_SET_MARK(1, 2), MSG_SET_MARK(1, 3))
+        self.assertNotEqual(MSG_SET_ALL(1, "", [], {}), MSG_RESET(1, "", [], {}))
+
+
+class TestEncode(unittest.TestCase):
+
+    def test_encoded_once_per_format(self):
+        msg = MSG_OPERATION(2, [5, "abc", -1], 10)
+        with mock.patch.object(MSG_OPERATION, "bytes", wraps=msg.bytes) as legacy:
+            with mock.patch.object(MSG_OPERATION, "frame", wraps=msg.frame) as framed:
+                data = [msg.encode(features) for features in (0, FEATURE_FRAMED, 0, FEATURE_FRAMED | FEATURE_COMPRESSED)]
+        self.assertEqual(legacy.call_count, 1)
+        self.assertEqual(framed.call_count, 1)
+        self.assertIs(data[0], data[2])
+        self.assertIs(data[1], data[3])
+        self.assertEqual(data[0], str(msg).encode())
+
+    def test_changes_are_encoded(self):
+        msg = MSG_SET_MARK(3, 7)
+        msg.encode()
+        msg.set_msg_id(4)
+        self.assertEqual(NetworkMessageReader().feed(msg.encode())[0]["msg_id"], 4)
+        msg["index"] = 9
+        self.assertEqual(FramedMessageReader().feed(msg.encode(FEATURE_FRAMED))[0]["index"], 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,253 @@
+import random
+import unittest
+
+from src.ot.client import Client, synchronized
+from src.ot.server import MemoryBackend, Server, StaleRevisionError
+from src.ot.text_operation import TextOperation
+
+
+def random_operation(doc, rand):
+    operation = TextOperation()
+    i = 0
+    while i < len(doc):
+        n = rand.randint(1, min(8, len(doc) - i))
+        if rand.random() < 0.6:
+            operation.retain(n)
+        else:
+            operation.delete(n)
+        i += n
+        if rand.random() < 0.3:
+            operation.insert(rand.choice(["a", "bc", "\n", "xyz"]))
+    if rand.random() < 0.3:
+        operation.insert("q")
+    return operation
+
+
+class TestComposedOperations(unittest.TestCase):
+    """ Transforming against the blocks returned by `get_composed_operations`
+        must give the same result as transforming against each operation """
+
+    def setUp(self):
+        self.rand = random.Random(0)
+
+    def make_history(self, count):
+        doc = "".join(self.rand.choice("abc\n") for _ in range(self.rand.randint(0, 40)))
+        backend = MemoryBackend(max_operations=10**6)
+        backend.acknowledge(0, 0)
+        docs = [doc]
+        for _ in range(count):
+            operation = random_operation(docs[-1], self.rand)
+            backend.save_operation(1, operation)
+            docs.append(operation(docs[-1]))
+        return backend, docs
+
+    def transform_all(self, operation, concurrent):
+        for concurrent_operation in concurrent:
+            operation, _ = TextOperation.transform(operation, concurrent_operation)
+        return operation
+
+    def test_transform_against_blocks(self):
+        for _ in range(60):
+            backend, docs = self.make_history(self.rand.randint(1, 70))
+            for start in range(len(docs)):
+                operation = random_operation(docs[start], self.rand)
+                step = self.transform_all(operation, backend.get_operations(start))
+                composed = self.transform_all(operation, backend.get_composed_operations(start))
+                self.assertEqual(step(docs[-1]), composed(docs[-1]))
+
+    def test_blocks_apply(self):
+        backend, docs = self.make_history(100)
+        for start in range(len(docs)):
+            doc = docs[start]
+            for operation in backend.get_composed_operations(start):
+                doc = operation(doc)
+            self.assertEqual(doc, docs[-1])
+
+    def test_blocks_are_short(self):
+        backend, docs = self.make_history(100)
+        self.assertLessEqual(len(backend.get_composed_operations(0)), 7)
+        self.assertEqual(len(backend.get_composed_operations(95)), 5)
+
+    def test_after_compacting(self):
+        backend, docs = self.make_history(50)
+        backend.get_composed_operations(0)
+        backend.acknowledge(0, 21)
+        self.assertEqual(backend.offset, 21)
+        with self.assertRaises(StaleRevisionError):
+            backend.get_composed_operations(20)
+        for start in range(21, len(docs)):
+            doc = docs[start]
+            for operation in backend.get_composed_operations(start):
+                doc = operation(doc)
+            self.assertEqual(doc, docs[-1])
+
+    def test_receive_operation(self):
+        backend, docs = self.make_history(40)
+        server = Server(docs[-1], backend)
+        operation = random_operation(docs[3], self.rand)
+        expected = self.transform_all(operation, backend.get_operations(3))
+        self.assertEqual(server.receive_operation(2, 3, operation), expected)
+        self.assertEqual(server.document, expected(docs[-1]))
+
+
+class SimulatedClient(Client):
+    """ A client whose messages to and from the server wait in lists until the
+        session delivers them, so that they can arrive in any interleaving """
+
+    def __init__(self, user_id, document, pipelined):
+        Client.__init__(self, 0, pipelined)
+        self.user_id = user_id
+        self.document = document
+        self.seq = 0
+        self.outbox = [] # (revision, seq, operation) sent to the server
+        self.inbox  = [] # (kind, value) sent by the server
+
+    def send_operation(self, revision, operation):
+        if self.can_pipeline(revision):
+            self.seq += 1
+            self.outbox.append((revision, self.seq, operation))
+        else:
+            self.outbox.append((revision, None, operation))
+
+    def apply_operation(self, operation):
+        self.document = operation(self.document)
+
+    def edit(self, rand):
+        operation = random_operation(self.document, rand)
+        self.document = operation(self.document)
+        self.apply_client(operation)
+
+    def receive(self):
+        kind, value = self.inbox.pop(0)
+        if kind == "ack":
+            self.server_ack()
+        elif kind == "operation":
+            self.apply_server(value)
+        else:
+            self.document, revision = value
+            self.reset(revision)
+
+
+class Session(object):
+    """ Passes messages between a Server and SimulatedClients in the same way as
+        TroopServer: operations based on a revision from before a client was
+        resynced, and pipelined operations based on the resync revision, are
+        ignored, and stale operations resync their client """
+
+    def __init__(self, document, pipelined, max_operations):
+        self.server = Server(document, MemoryBackend(max_operations=max_operations))
+        self.clients = [SimulatedClient(user_id, document, flag) for user_id, flag in enumerate(pipelined)]
+        self.resync_revision = {}
+        self.resyncs = 0
+        for client in self.clients:
+            self.server.backend.acknowledge(client.user_id, 0)
+            if client.pipelined:
+                self.server.add_pipelined_user(client.user_id)
+
+    def deliver(self, client):
+        """ Handles the oldest message from a client on the server """
+        revision, seq, operation = client.outbox.pop(0)
+        resync_revision = self.resync_revision.get(client.user_id, 0)
+        if revision < resync_revision or (seq is not None and revision == resync_revision):
+            return
+        try:
+            if seq is None:
+                operation = self.server.receive_operation(client.user_id, revision, operation)
+            else:
+                operation = self.server.receive_pipelined_operation(client.user_id, revision, seq, operation)
+        except StaleRevisionError:
+            self.resync(client)
+            return
+        if operation is None:
+            return
+        for other in self.clients:
+            other.inbox.append(("ack", None) if other is client else ("operation", operation))
+
+    def resync(self, client):
+        """ Replaces the messages waiting to be sent to a client with the document """
+        revision = self.server.backend.get_revision()
+        client.inbox = [("document", (self.server.document, revision))]
+        self.resync_revision[client.user_id] = revision
+        self.server.backend.acknowledge(client.user_id, revision)
+        if client.pipelined:
+            self.server.add_pipelined_user(client.user_id)
+        self.resyncs += 1
+
+    def step(self, rand, edit=True, repeat=0):
+        """ Makes one client edit, or delivers one message in either direction """
+        client = rand.choice(self.clients)
+        action = rand.random()
+        if edit and action < 0.3:
+            client.edit(rand)
+        elif action < 0.65 and len(client.outbox):
+            # Messages are sometimes sent again, which the server must ignore
+            if client.outbox[0][1] is not None and rand.random() < repeat:
+                client.outbox.insert(1, client.outbox[0])
+            self.deliver(client)
+        elif len(client.inbox):
+            client.receive()
+
+    def run(self, rand, steps, repeat=0):
+        for _ in range(steps):
+            self.step(rand, repeat=repeat)
+        while any(len(client.outbox) or len(client.inbox) for client in self.clients):
+            self.step(rand, edit=False)
+        for client in self.clients:
+            self.assertConverged(client)
+
+    def assertConverged(self, client):
+        assert client.document == self.server.document, (client.user_id, client.document, self.server.document)
+        assert client.state is synchronized
+        assert client.revision == self.server.backend.get_revision()
+
+
+class TestPipelining(unittest.TestCase):
+    """ Pipelined clients send operations without waiting for each to be
+        acknowledged and must end up with the same document as the server
+        and the clients that wait, whatever order messages arrive in """
+
+    def run_sessions(self, count, pipelined, max_operations=1000, repeat=0):
+        resyncs = 0
+        for n in range(count):
+            rand = random.Random(n)
+            session = Session("".join(rand.choice("abc\n") for _ in range(20)), pipelined, max_operations)
+            session.run(rand, rand.randint(10, 120), repeat)
+            resyncs += session.resyncs
+        return resyncs
+
+    def test_pipelined_clients(self):
+        self.run_sessions(200, (True, True, True))
+
+    def test_mixed_clients(self):
+        self.run_sessions(200, (True, False, True, False))
+
+    def test_repeated_seq(self):
+        self.run_sessions(200, (True, False, True), repeat=0.3)
+
+    def test_resync(self):
+        # A short history makes clients that fall behind resync, resetting their bridge
+        resyncs = self.run_sessions(300, (True, False, True), max_operations=4)
+        self.assertGreater(resyncs, 0)
+
+    def test_repeated_seq_ignored(self):
+        server = Server("abc", MemoryBackend())
+        server.add_pipelined_user(0)
+        first = server.receive_pipelined_operation(0, 0, 1, TextOperation().retain(3).insert("d"))
+        self.assertEqual(first.ops, [3, "d"])
+        self.assertIsNone(server.receive_pipelined_operation(0, 0, 1, TextOperation().retain(3).insert("d")))
+        self.assertEqual(server.document, "abcd")
+        self.assertEqual(server.backend.get_revision(), 1)
+
+    def test_bridge(self):
+        # User 0 sends two operations before receiving user 1's
+        server = Server("abc", MemoryBackend())
+        server.add_pipelined_user(0)
+        server.receive_pipelined_operation(0, 0, 1, TextOperation().insert("x").retain(3))
+        server.receive_operation(1, 0, TextOperation().retain(3).insert("y"))
+        operation = server.receive_pipelined_operation(0, 0, 2, TextOperation().retain(1).insert("z").retain(3))
+        self.assertEqual(operation.ops, [1, "z", 4])
+        self.assertEqual(server.document, "xzabcy")
+
+
+if __name__ == "__main__":
+    unittest.main()
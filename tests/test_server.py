@@ -0,0 +1,542 @@
+import random
+import socket
+import threading
+import time
+import unittest
+import zlib
+from hashlib import md5
+from unittest import mock
+
+from src.config import VERSION
+from src.message import *
+from src.server import TroopServer, TroopRequestHandler, Client
+from src.utils import *
+
+
+class Connection:
+    """ A client connection using the wire features agreed at login """
+    def __init__(self, conn, client_id, features):
+        self.conn = conn
+        self.id = client_id
+        self.features = features
+        self.compressor = get_stream_compressor(features)
+        self.reader = get_message_reader(features)
+        self.received = []
+
+    def send(self, msg):
+        data = msg.encode(self.features)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.conn.sendall(data)
+
+    def wait_for(self, cls):
+        """ Returns the first message of type `cls` that has not been read yet """
+        while True:
+            for i, msg in enumerate(self.received):
+                if isinstance(msg, cls):
+                    del self.received[:i + 1]
+                    return msg
+            self.received.extend(self.reader.feed(self.conn.recv(4096)))
+
+
+class ServerTestCase(unittest.TestCase):
+    """ Runs a TroopServer with its connection and dispatch threads """
+
+    def setUp(self):
+        self.server = TroopServer(password="pw", port=58890)
+        self.server.running = True
+        self.server.server_thread.start()
+        self.server.msg_queue_thread.start()
+        self.connections = []
+
+    def tearDown(self):
+        for conn in self.connections:
+            conn.close()
+        self.server.running = False
+        self.server.server.shutdown()
+        self.server.server.server_close()
+        self.server.msg_queue_thread.join()
+
+    def connect(self):
+        conn = socket.create_connection(("localhost", self.server.port))
+        conn.settimeout(5)
+        self.connections.append(conn)
+        return conn
+
+    def login(self, name, client_id=-1, version=VERSION, password="pw"):
+        conn = self.connect()
+        conn.sendall(MSG_PASSWORD(client_id, md5(password.encode("utf-8")).hexdigest(), name, version).bytes())
+        return conn, int(conn.recv(4))
+
+    def join(self, name, client_id=-1):
+        conn, client_id = self.login(name, client_id)
+        conn.sendall(MSG_CONNECT(client_id, name, "localhost", 0).bytes())
+        reader = NetworkMessageReader()
+        self.received = []
+        while not any(isinstance(msg, MSG_REQUEST_ACK) for msg in self.received):
+            self.received.extend(reader.feed(conn.recv(4096)))
+        return conn, client_id
+
+    def open_session(self, name, features):
+        """ Logs in asking for `features` and joins the session """
+        conn = self.connect()
+        conn.sendall(MSG_PASSWORD(-1, md5(b"pw").hexdigest(), name, VERSION, features).bytes())
+        client_id = int(conn.recv(4))
+        session = Connection(conn, client_id, int(conn.recv(4)) if features else 0)
+        session.send(MSG_CONNECT(client_id, name, "localhost", 0))
+        session.wait_for(MSG_REQUEST_ACK)
+        return session
+
+
+class TestLogin(ServerTestCase):
+
+    def test_login(self):
+        _, client_id = self.login("a")
+        self.assertEqual(client_id, 0)
+        _, client_id = self.login("b")
+        self.assertEqual(client_id, 1)
+
+    def test_wrong_password(self):
+        _, client_id = self.login("a", password="wrong")
+        self.assertEqual(client_id, ERR_LOGIN_FAIL)
+
+    def test_older_version(self):
+        conn = self.connect()
+        conn.sendall(MESSAGE.compile(MSG_PASSWORD.type, 0, -1, md5(b"pw").hexdigest(), "a", "0.10.3").encode())
+        self.assertEqual(int(conn.recv(4)), ERR_VERSION_MISMATCH)
+
+    def test_join_sends_document_and_revision(self):
+        self.server.document = "hello"
+        self.join("a")
+        documents = [msg for msg in self.received if isinstance(msg, MSG_SET_ALL)]
+        self.assertEqual(len(documents), 1)
+        self.assertEqual(documents[0]["document"], "hello")
+        self.assertEqual(documents[0]["revision"], self.server.backend.get_revision())
+
+    def test_name_taken(self):
+        self.join("a")
+        _, client_id = self.login("a")
+        self.assertEqual(client_id, ERR_NAME_TAKEN)
+
+    def test_resume_replaces_stale_connection(self):
+        old, client_id = self.join("a")
+        _, resumed_id = self.join("a", client_id=client_id)
+        self.assertEqual(resumed_id, client_id)
+        # The old connection is closed by the server
+        while old.recv(4096):
+            pass
+        self.assertTrue(self.server.clients[client_id].connected)
+        self.assertNotIn(client_id, self.server.departed)
+
+    def test_resume_unknown_client(self):
+        _, client_id = self.login("a", client_id=5)
+        self.assertEqual(client_id, ERR_RESUME_FAIL)
+        conn, client_id = self.join("a")
+        _, client_id = self.login("b", client_id=client_id)
+        self.assertEqual(client_id, ERR_RESUME_FAIL)
+
+
+class TestFeatures(ServerTestCase):
+
+    def test_compressed_session(self):
+        features = FEATURE_FRAMED | FEATURE_COMPRESSED
+        a = self.open_session("a", features)
+        b = self.open_session("b", 0)
+        self.assertEqual(a.features, features)
+        text = "d1 >> play('x-o-') " * 20
+        a.send(MSG_OPERATION(a.id, [text], 0))
+        self.assertEqual(b.wait_for(MSG_OPERATION)["operation"], [text])
+        self.assertEqual(a.wait_for(MSG_OPERATION)["operation"], [text])
+        b.send(MSG_OPERATION(b.id, [len(text), text], 1))
+        self.assertEqual(a.wait_for(MSG_OPERATION)["operation"], [len(text), text])
+        self.assertEqual(self.server.document, text * 2)
+
+    def test_only_supported_features(self):
+        self.server.features = FEATURE_FRAMED
+        a = self.open_session("a", FEATURE_FRAMED | FEATURE_COMPRESSED)
+        self.assertEqual(a.features, FEATURE_FRAMED)
+        a.send(MSG_OPERATION(a.id, ["abc"], 0))
+        self.assertEqual(a.wait_for(MSG_OPERATION)["operation"], ["abc"])
+
+    def test_compact_ack(self):
+        a = self.open_session("a", FEATURE_FRAMED | FEATURE_COMPACT_ACK)
+        b = self.open_session("b", 0)
+        a.send(MSG_OPERATION(a.id, ["abc"], 0))
+        self.assertEqual(b.wait_for(MSG_OPERATION)["operation"], ["abc"])
+        ack = a.wait_for(MSG_OPERATION_ACK)
+        self.assertEqual((ack["src_id"], ack["revision"]), (a.id, 1))
+        b.send(MSG_OPERATION(b.id, [3, "def"], 1))
+        self.assertEqual(b.wait_for(MSG_OPERATION)["operation"], [3, "def"])
+        msg = a.wait_for(MSG_OPERATION)
+        self.assertEqual((msg["src_id"], msg["operation"]), (b.id, [3, "def"]))
+
+
+class DispatchTestCase(unittest.TestCase):
+    """ Runs a TroopServer's dispatch thread without accepting connections """
+
+    def setUp(self):
+        self.server = TroopServer(port=58890)
+        self.server.running = True
+        self.server.msg_queue_thread.start()
+
+    def tearDown(self):
+        self.server.running = False
+        self.server.msg_queue_thread.join()
+        self.server.server.server_close()
+
+    def run_task(self, func, *args):
+        done = threading.Event()
+        result = []
+        def task():
+            result.append((threading.current_thread(), func(*args)))
+            done.set()
+        self.server.enqueue_task(task)
+        self.assertTrue(done.wait(5))
+        return result[0]
+
+
+class TestDispatch(DispatchTestCase):
+
+    def test_tasks_run_on_dispatch_thread(self):
+        thread, _ = self.run_task(lambda: None)
+        self.assertIs(thread, self.server.msg_queue_thread)
+
+    def test_remove_client_notifies_on_dispatch_thread(self):
+        calls = []
+        self.server.broadcast = lambda msg, clients=None: calls.append((threading.current_thread(), msg))
+        thread = threading.Thread(target=self.server.remove_client, args=(3,))
+        thread.start()
+        thread.join()
+        self.run_task(lambda: None)
+        self.assertEqual(calls, [(self.server.msg_queue_thread, MSG_REMOVE(3))])
+
+    def test_purge_departed_clients(self):
+        self.server.backend.acknowledge(3, 0)
+        self.server.departed[3] = time.time() - self.server.resume_timeout - 1
+        self.server.departed[4] = time.time()
+        self.run_task(self.server.purge_departed_clients)
+        self.assertEqual(list(self.server.departed), [4])
+
+
+class Handler:
+    """ The parts of a TroopRequestHandler used by a server-side Client """
+    def __init__(self, client_id, features):
+        self.request, self.peer = socket.socketpair()
+        self.peer.settimeout(5)
+        self.client_address = ("localhost", client_id)
+        self.client_id = client_id
+        self.client_info = ("localhost", str(client_id))
+        self.features = features
+        self.master = TroopRequestHandler.master
+    connect_clients = TroopRequestHandler.connect_clients
+    def get_client_id(self):
+        return self.client_id
+    def handle_client_lost(self, verbose=True):
+        pass
+
+
+class ClientTestCase(DispatchTestCase):
+    """ Adds server-side Clients that write to one end of a socket pair """
+
+    def setUp(self):
+        DispatchTestCase.setUp(self)
+        self.peers = {}
+
+    def tearDown(self):
+        for client in self.server.clients.values():
+            client.disconnect()
+        for peer in self.peers.values():
+            peer.close()
+        DispatchTestCase.tearDown(self)
+
+    def add_client(self, client_id, features=0):
+        handler = Handler(client_id, features)
+        self.server.clients[client_id] = Client(handler, name=str(client_id))
+        self.peers[client_id] = handler.peer
+        return self.server.clients[client_id]
+
+    def add_joining_client(self, client_id, features=0, revision=-1, checksum=-1):
+        """ Adds a client as the connection thread does and queues its MSG_CONNECT """
+        handler = Handler(client_id, features)
+        client = self.server.joining[client_id] = Client(handler, name=str(client_id))
+        self.peers[client_id] = handler.peer
+        self.server.enqueue(MSG_CONNECT(client_id, str(client_id), "localhost", 0, False, revision, checksum))
+        return client
+
+    def read(self, client_id, features=0):
+        """ Returns the messages sent to a client """
+        self.server.clients[client_id].flush()
+        self.peers[client_id].setblocking(False)
+        try:
+            data = self.peers[client_id].recv(65536)
+        except BlockingIOError:
+            return []
+        finally:
+            self.peers[client_id].setblocking(True)
+        return get_message_reader(features).feed(data)
+
+    def wait(self):
+        """ Waits for the messages already queued to be processed """
+        self.run_task(lambda: None)
+        self.assertTrue(self.server.msg_queue_thread.is_alive())
+
+
+class TestBroadcast(ClientTestCase):
+
+    def test_message_encoded_once(self):
+        for client_id in range(5):
+            self.add_client(client_id, FEATURE_FRAMED if client_id % 2 else 0)
+        msg = MSG_SET_MARK(0, 4)
+        with mock.patch.object(MSG_SET_MARK, "bytes", wraps=msg.bytes) as legacy:
+            with mock.patch.object(MSG_SET_MARK, "frame", wraps=msg.frame) as framed:
+                self.server.broadcast(msg)
+        self.assertEqual((legacy.call_count, framed.call_count), (1, 1))
+        for client_id in range(5):
+            self.assertEqual(self.read(client_id, self.server.clients[client_id].features), [msg])
+
+    def test_resync_when_behind(self):
+        self.server.high_water = 300
+        client = self.add_client(0)
+        self.add_client(1)
+        self.server.process_message(MSG_OPERATION(1, ["x" * 400], 0))
+        self.read(0)
+        resync = mock.Mock(wraps=self.server.resync_client)
+        # Hold the outbox so that nothing is written until the client is resynced
+        with client.outbox_ready, mock.patch.object(self.server, "resync_client", resync):
+            self.server.broadcast(MSG_SET_MARK(1, 3), [client])
+            self.server.broadcast(MSG_OPERATION_ACK(1, 1), [client])
+            self.server.broadcast(MSG_REMOVE(2), [client])
+            while resync.call_count == 0:
+                self.server.broadcast(MSG_OPERATION(1, [400, "y"], 1), [client])
+            self.assertEqual([type(msg) for msg, _ in client.outbox], [MSG_REMOVE, MSG_SET_ALL])
+            self.assertEqual(self.server.get_queue_depths()[0], (2, sum(len(data) for _, data in client.outbox)))
+            self.assertGreater(client.get_backlog()[1], self.server.high_water)
+            # The document does not count towards the backlog
+            self.server.broadcast(MSG_OPERATION(1, [400, "z"], 2), [client])
+            self.assertEqual(resync.call_count, 1)
+        received = self.read(0)
+        self.assertEqual([type(msg) for msg in received], [MSG_REMOVE, MSG_SET_ALL, MSG_OPERATION])
+        self.assertEqual(received[1]["document"], "x" * 400)
+        self.assertEqual(self.server.get_queue_depths(), {0: (0, 0), 1: (0, 0)})
+
+
+class TestResync(ClientTestCase):
+
+    def test_stale_operation_from_disconnected_client(self):
+        self.server.backend.max_operations = 2
+        self.add_client(0)
+        self.add_client(1).disconnect()
+        for revision in range(4):
+            self.server.enqueue(MSG_OPERATION(0, ["a", revision] if revision else ["a"], revision))
+        self.server.enqueue(MSG_OPERATION(1, ["b"], 0))
+        self.server.enqueue(MSG_OPERATION(0, ["c", 4], 4))
+        self.wait()
+        self.assertEqual(self.server.backend.get_revision(), 5)
+        self.assertEqual(self.server.document, "caaaa")
+
+    def test_pipelined_operations_at_resync_revision(self):
+        client = self.add_client(0, FEATURE_PIPELINED)
+        self.server.enqueue(MSG_OPERATION(0, ["abc"], 0))
+        self.run_task(self.server.resync_client, client)
+        # Sent before the document arrived
+        self.server.enqueue(MSG_PIPELINED_OPERATION(0, [3, "x"], 1, 1))
+        # The first operation after the document is not pipelined
+        self.server.enqueue(MSG_OPERATION(0, [3, "y"], 1))
+        self.server.enqueue(MSG_PIPELINED_OPERATION(0, [4, "z"], 2, 2))
+        self.wait()
+        self.assertEqual(self.server.document, "abcyz")
+
+
+class TestJoin(ClientTestCase):
+
+    def test_existing_clients_keep_editing(self):
+        self.add_client(0)
+        self.server.enqueue(MSG_OPERATION(0, ["ab"], 0))
+        self.add_joining_client(1)
+        self.server.enqueue(MSG_OPERATION(0, [2, "cd"], 1))
+        self.wait()
+        self.assertEqual(self.server.document, "abcd")
+        received = self.read(0)
+        self.assertEqual([msg["operation"] for msg in received if isinstance(msg, MSG_OPERATION)], [["ab"], [2, "cd"]])
+        self.assertEqual([msg["src_id"] for msg in received if isinstance(msg, MSG_CONNECT)], [1])
+        self.assertFalse(any(isinstance(msg, (MSG_RESET, MSG_REQUEST_ACK)) for msg in received))
+        # The new client is sent the document and then the operations after it
+        received = self.read(1)
+        documents = [msg for msg in received if isinstance(msg, MSG_SET_ALL)]
+        self.assertEqual([(msg["document"], msg["revision"]) for msg in documents], [("ab", 1)])
+        self.assertEqual([msg["operation"] for msg in received if isinstance(msg, MSG_OPERATION)], [[2, "cd"]])
+        self.assertEqual([msg["flag"] for msg in received if isinstance(msg, MSG_REQUEST_ACK)], [0])
+
+    def test_new_client_lost_while_joining(self):
+        self.add_client(0)
+        client = self.add_joining_client(1)
+        client.send = mock.Mock(side_effect=DeadClientError("1"))
+        self.server.enqueue(MSG_OPERATION(0, ["ab"], 0))
+        self.wait()
+        self.assertEqual(self.server.document, "ab")
+        self.assertIn(1, self.server.departed)
+
+    def test_existing_client_lost_while_joining(self):
+        self.add_client(0)
+        self.add_client(2).send = mock.Mock(side_effect=DeadClientError("2"))
+        self.add_joining_client(1)
+        self.server.enqueue(MSG_OPERATION(0, ["ab"], 0))
+        self.wait()
+        self.assertEqual(self.server.document, "ab")
+        self.assertIn(2, self.server.departed)
+        self.assertNotIn(1, self.server.departed)
+        self.assertEqual([msg["flag"] for msg in self.read(1) if isinstance(msg, MSG_REQUEST_ACK)], [0])
+
+
+class TestRejoin(ClientTestCase):
+
+    def rejoin(self, revision, checksum):
+        """ Returns the messages sent to a client joining at `revision` after two operations """
+        # The operations are kept for the client while it is away
+        self.server.backend.acknowledge(1, 0)
+        self.add_client(0)
+        self.server.enqueue(MSG_OPERATION(0, ["ab"], 0))
+        self.server.enqueue(MSG_OPERATION(0, [2, "cd"], 1))
+        self.wait()
+        self.add_joining_client(1, revision=revision, checksum=checksum)
+        self.wait()
+        return self.read(1)
+
+    def test_rejoin_with_checksum(self):
+        received = self.rejoin(1, zlib.crc32(b"ab"))
+        self.assertFalse(any(isinstance(msg, MSG_SET_ALL) for msg in received))
+        self.assertEqual([msg["operation"] for msg in received if isinstance(msg, MSG_OPERATION)], [[2, "cd"]])
+
+    def test_rejoin_with_wrong_checksum(self):
+        received = self.rejoin(1, zlib.crc32(b"xy"))
+        self.assertEqual([msg["document"] for msg in received if isinstance(msg, MSG_SET_ALL)], ["abcd"])
+
+    def test_snapshot_requested(self):
+        # There is no checksum stored for revision 0
+        received = self.rejoin(0, -1)
+        self.assertEqual([msg["document"] for msg in received if isinstance(msg, MSG_SET_ALL)], ["abcd"])
+        self.assertFalse(any(isinstance(msg, MSG_OPERATION) for msg in received))
+
+
+class TestPresence(ClientTestCase):
+
+    def setUp(self):
+        ClientTestCase.setUp(self)
+        # Hold presence messages until they are flushed by the test
+        self.server.presence_due = time.time() + 60
+        for client_id in range(2):
+            self.add_client(client_id)
+        self.server.process_message(MSG_OPERATION(0, ["abcdefgh"], 0))
+        self.read(0)
+        self.read(1)
+
+    def test_latest_message_kept(self):
+        for msg in (MSG_SET_MARK(0, 1), MSG_SET_MARK(0, 2), MSG_SELECT(0, 0, 1), MSG_SET_MARK(1, 3), MSG_SELECT(0, 0, 2)):
+            self.server.process_message(msg)
+        self.assertEqual(self.read(1), [])
+        self.server.flush_presence()
+        self.assertEqual(self.read(1), [MSG_SET_MARK(0, 2), MSG_SET_MARK(1, 3), MSG_SELECT(0, 0, 2)])
+        self.assertEqual(self.server.presence_stats, {"received": 5, "sent": 3, "dropped": 2})
+        self.assertEqual(self.server.presence, {})
+
+    def test_sent_when_due(self):
+        self.server.presence_due = 0
+        self.server.process_message(MSG_SET_MARK(0, 1))
+        self.assertEqual(self.read(1), [MSG_SET_MARK(0, 1)])
+        # The next message waits until the interval has passed
+        self.server.process_message(MSG_SET_MARK(0, 2))
+        self.assertEqual(self.read(1), [])
+        self.assertEqual(self.server.presence_stats["dropped"], 0)
+
+    def test_operations_not_held(self):
+        self.server.process_message(MSG_SET_MARK(0, 8))
+        self.server.process_message(MSG_OPERATION(1, ["xy", 8], 1))
+        self.assertEqual([type(msg) for msg in self.read(0)], [MSG_OPERATION])
+        self.server.flush_presence()
+        self.assertEqual(self.read(0), [MSG_SET_MARK(0, 10)])
+
+    def test_transform_presence(self):
+        for msg in (MSG_SET_MARK(0, 4), MSG_SET_MARK(1, 4), MSG_SELECT(1, 2, 6), MSG_SELECT(0, 4, 4)):
+            self.server.process_message(msg)
+        self.server.process_message(MSG_OPERATION(0, [4, "xy", 4], 1))
+        self.server.process_message(MSG_OPERATION(1, [1, -2, 7], 2))
+        self.server.flush_presence()
+        # Text inserted at a client's own location is put before it
+        self.assertEqual(self.read(1)[-4:], [MSG_SET_MARK(0, 4), MSG_SET_MARK(1, 2), MSG_SELECT(1, 1, 6), MSG_SELECT(0, 4, 4)])
+
+    def test_transform_index(self):
+        rand = random.Random(0)
+        for _ in range(2000):
+            length = rand.randint(0, 12)
+            ops, index, after_insert = random_ops(length, rand), rand.randint(0, length), rand.random() < 0.5
+            self.assertEqual(transform_index(ops, index, after_insert), cursor_after(ops, length, index, after_insert))
+
+
+def random_ops(length, rand):
+    """ Returns the ops of an operation that may edit several places in a document of `length` characters """
+    ops, i = [], 0
+    if rand.random() < 0.3:
+        ops.append("z")
+    while i < length:
+        n = rand.randint(1, length - i)
+        ops.append(n if rand.random() < 0.6 else -n)
+        i += n
+        if rand.random() < 0.4:
+            ops.append("xy"[:rand.randint(1, 2)])
+    return ops
+
+
+def cursor_after(ops, length, index, after_insert):
+    """ Returns where a cursor at `index` ends up after `ops`, found by applying
+        them to a list holding the characters and the cursor """
+    cursor = object()
+    items = list(range(length))
+    items.insert(index, cursor)
+    i = 0
+    for op in ops:
+        if isinstance(op, str):
+            # Text is inserted after the cursor unless `after_insert`
+            if not after_insert and items[i:i + 1] == [cursor]:
+                i += 1
+            items[i:i] = list(op)
+            i += len(op)
+        else:
+            for _ in range(abs(op)):
+                if items[i] is cursor:
+                    i += 1
+                if op > 0:
+                    i += 1
+                else:
+                    del items[i]
+    return items.index(cursor)
+
+
+class TestNextId(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TroopServer(port=58890)
+
+    def tearDown(self):
+        self.server.server.server_close()
+
+    def test_reuses_free_ids(self):
+        ids = [self.server.get_next_id() for _ in range(self.server.max_id + 1)]
+        self.assertEqual(ids, list(range(self.server.max_id + 1)))
+
+        class Departed:
+            connected = False
+
+        # Every ID is taken until a client has gone and can no longer resume
+        for client_id in ids:
+            self.server.joining[client_id] = Departed()
+        self.assertEqual(self.server.get_next_id(), ERR_MAX_LOGINS)
+        self.server.clients[7] = self.server.joining.pop(7)
+        self.server.departed[7] = time.time()
+        self.assertEqual(self.server.get_next_id(), ERR_MAX_LOGINS)
+        del self.server.departed[7]
+        self.assertEqual(self.server.get_next_id(), 7)
+        self.assertNotIn(7, self.server.clients)
+
+
+if __name__ == "__main__":
+    unittest.main()
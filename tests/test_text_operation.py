@@ -0,0 +1,148 @@
+import random
+import unittest
+from unittest import mock
+
+from src.ot import text_operation
+from src.ot.text_operation import TextOperation, IncompatibleOperationError
+
+
+def random_edit(length, rand):
+    """ Returns the ops of an operation that inserts or deletes at one place """
+    index = rand.randint(0, length)
+    if index < length and rand.random() < 0.5:
+        deleted = rand.randint(1, min(3, length - index))
+        return [op for op in (index, -deleted, length - index - deleted) if op]
+    string = "".join(rand.choice("ab\n") for _ in range(rand.choice((1, 1, 2, 5))))
+    return [op for op in (index, string, length - index) if op]
+
+
+def random_ops(length, rand):
+    """ Returns the ops of an operation on a document of `length` characters,
+        which is usually a single edit """
+    if rand.random() < 0.7:
+        return random_edit(length, rand)
+    operation = TextOperation()
+    left = length
+    while left > 0:
+        n = rand.randint(1, left)
+        choice = rand.random()
+        if choice < 0.4:
+            operation.retain(n)
+            left -= n
+        elif choice < 0.7:
+            operation.delete(n)
+            left -= n
+        else:
+            operation.insert("xyz"[:rand.randint(1, 3)])
+    if rand.random() < 0.3:
+        operation.insert("q")
+    return operation.ops
+
+
+def base_length(ops):
+    """ Returns the length of the document that the ops apply to """
+    return sum(op if op > 0 else -op for op in ops if isinstance(op, int))
+
+
+def result(func, *args):
+    """ Returns the ops returned by `func`, or the type of error it raised """
+    try:
+        value = func(*args)
+    except IncompatibleOperationError:
+        return IncompatibleOperationError
+    if isinstance(value, tuple):
+        return tuple(item.ops for item in value)
+    if isinstance(value, TextOperation):
+        return value.ops
+    return value
+
+
+def slow_path():
+    """ Stops operations being treated as single edits """
+    return mock.patch.object(text_operation, "_single_edit", lambda ops: None)
+
+
+class TestSingleEdits(unittest.TestCase):
+    """ Single edits are applied, composed and transformed without walking their
+        ops, which must give the same result as walking them """
+
+    def setUp(self):
+        self.rand = random.Random(1)
+
+    def cases(self, count=3000):
+        for _ in range(count):
+            length = self.rand.randint(0, 12)
+            doc = "".join(self.rand.choice("abc\n") for _ in range(length))
+            # Operations of the wrong length are sometimes used to check errors
+            ops_a = random_ops(length, self.rand)
+            ops_b = random_ops(length if self.rand.random() < 0.97 else length + 1, self.rand)
+            yield doc, ops_a, ops_b
+
+    def test_apply(self):
+        for doc, ops_a, ops_b in self.cases():
+            for ops in (ops_a, ops_b):
+                fast = result(TextOperation(ops), doc)
+                with slow_path():
+                    slow = result(TextOperation(ops), doc)
+                self.assertEqual(fast, slow, (ops, doc))
+
+    def test_transform(self):
+        for doc, ops_a, ops_b in self.cases():
+            fast = result(TextOperation.transform, TextOperation(ops_a), TextOperation(ops_b))
+            with slow_path():
+                slow = result(TextOperation.transform, TextOperation(ops_a), TextOperation(ops_b))
+            self.assertEqual(fast, slow, (ops_a, ops_b))
+
+    def test_transform_converges(self):
+        for doc, ops_a, ops_b in self.cases():
+            if base_length(ops_b) != len(doc):
+                continue
+            a, b = TextOperation(ops_a), TextOperation(ops_b)
+            a_prime, b_prime = TextOperation.transform(a, b)
+            self.assertEqual(b_prime(a(doc)), a_prime(b(doc)), (ops_a, ops_b, doc))
+
+    def test_compose(self):
+        for doc, ops_a, _ in self.cases():
+            a = TextOperation(ops_a)
+            after = a(doc)
+            ops_b = random_ops(len(after) if self.rand.random() < 0.97 else len(after) + 1, self.rand)
+            for keep_order in (False, True):
+                fast = result(TextOperation(ops_a).compose, TextOperation(ops_b), keep_order)
+                with slow_path():
+                    slow = result(TextOperation(ops_a).compose, TextOperation(ops_b), keep_order)
+                self.assertEqual(fast, slow, (ops_a, ops_b, keep_order))
+                if fast is not IncompatibleOperationError:
+                    self.assertEqual(TextOperation(fast)(doc), TextOperation(ops_b)(after))
+
+    def test_transform_against_composed(self):
+        # Composing with `keep_order` lets an operation be transformed against
+        # several operations at once
+        for doc, ops_a, ops_b in self.cases():
+            if base_length(ops_b) != len(doc):
+                continue
+            b = TextOperation(ops_b)
+            ops_c = random_ops(len(b(doc)), self.rand)
+            c = TextOperation(ops_c)
+            step, _ = TextOperation.transform(TextOperation(ops_a), b)
+            step, _ = TextOperation.transform(step, c)
+            once, _ = TextOperation.transform(TextOperation(ops_a), b.compose(c, keep_order=True))
+            self.assertEqual(once(c(b(doc))), step(c(b(doc))), (ops_a, ops_b, ops_c, doc))
+
+
+class TestAppendInsert(unittest.TestCase):
+
+    def test_insert_moves_before_delete(self):
+        self.assertEqual(TextOperation().retain(2).delete(3).insert("ab").ops, [2, "ab", -3])
+
+    def test_append_insert_keeps_order(self):
+        self.assertEqual(TextOperation().retain(2).delete(3).append_insert("ab").ops, [2, -3, "ab"])
+        self.assertEqual(TextOperation().append_insert("a").append_insert("b").ops, ["ab"])
+        self.assertEqual(TextOperation().append_insert("").ops, [])
+
+    def test_same_effect(self):
+        operation = TextOperation().retain(1).delete(2).append_insert("xy").retain(1)
+        self.assertEqual(operation("abcd"), "axyd")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,314 @@
+import random
+import unittest
+
+from tests.fake_text import TextTestCase, Root
+
+from src.message import *
+from src.ot.client import synchronized, AwaitingPipeline
+from src.ot.text_operation import TextOperation
+from src.utils import empty_operation, new_operation
+
+
+def random_edit(length, rand):
+    """ Returns the ops of a single insert or delete in a document of `length` characters """
+    index = rand.randint(0, length)
+    if index < length and rand.random() < 0.4:
+        deleted = rand.randint(1, min(5, length - index))
+        return [op for op in (index, -deleted, length - index - deleted) if op]
+    string = "".join(rand.choice("ab \n") for _ in range(rand.randint(1, 6)))
+    return [op for op in (index, string, length - index) if op]
+
+
+def random_ops(length, rand):
+    """ Returns the ops of an operation that may edit several places """
+    if rand.random() < 0.7:
+        return random_edit(length, rand)
+    ops, i = [], 0
+    while i < length:
+        n = rand.randint(1, min(6, length - i))
+        ops.append(n if rand.random() < 0.6 else -n)
+        i += n
+        if rand.random() < 0.3:
+            ops.append("x\n")
+    if rand.random() < 0.3:
+        ops.append("y")
+    return ops
+
+
+def target_length(length, ops):
+    """ Returns the length of a document of `length` characters after `ops` """
+    for op in ops:
+        if isinstance(op, str):
+            length += len(op)
+        elif op < 0:
+            length += op
+    return length
+
+
+class TestRenderOperation(TextTestCase):
+    """ Operations are rendered as targeted edits to the widget, which must
+        end up showing the same as redrawing it from the document """
+
+    def test_remote_operations(self):
+        rand = random.Random(0)
+        text = self.make_text("first line\nsecond line\n")
+        for revision in range(300):
+            ops = random_ops(len(text.document), rand)
+            text.queue.put(MSG_OPERATION(rand.choice((1, 2)), ops, revision))
+            text.process_queue()
+            self.assertWidgetMatches(text)
+        self.assertEqual(text.revision, 300)
+
+    def test_local_operations(self):
+        rand = random.Random(1)
+        text = self.make_text("some text")
+        for _ in range(100):
+            ops = random_ops(len(text.document), rand)
+            text.apply_operation(TextOperation(ops), peer=text.marker)
+            self.assertWidgetMatches(text)
+
+    def test_refresh(self):
+        text = self.make_text("abc\ndef")
+        text.queue.put(MSG_OPERATION(1, [3, "xyz", 4], 0))
+        text.process_queue()
+        rendered = text.text, text.get_tag(text.peers[1].text_tag)
+        text.refresh()
+        self.assertEqual((text.text, text.get_tag(text.peers[1].text_tag)), rendered)
+        self.assertWidgetMatches(text)
+
+
+class TestIndexConversion(TextTestCase):
+    """ Offsets are converted to tcl indices using the document's line index """
+
+    def expected_tcl(self, string, number):
+        number = max(0, min(number, len(string)))
+        before = string[:number]
+        return "{}.{}".format(before.count("\n") + 1, number - before.rfind("\n") - 1)
+
+    def test_conversions(self):
+        rand = random.Random(2)
+        for _ in range(20):
+            string = "".join(rand.choice("ab\n") for _ in range(rand.randint(0, 80)))
+            text = self.make_text(string)
+            for number in range(-2, len(string) + 3):
+                tcl = text.number_index_to_tcl(number)
+                self.assertEqual(tcl, self.expected_tcl(string, number))
+                self.assertEqual(text.tcl_index_to_number(tcl), max(0, min(number, len(string))))
+                self.assertEqual(text.number_index_to_row_col(number), tuple(int(n) for n in tcl.split(".")))
+            self.assertEqual(text.tcl_index_to_number("end"), len(string))
+
+
+class TestOperationAck(TextTestCase):
+    """ Clients that ask for compact acknowledgements are sent the revision of
+        their own operations instead of the operations themselves """
+
+    def edit(self, text, ops):
+        """ Applies a local operation and sends it as the Interface does """
+        text.apply_operation(TextOperation(ops), peer=text.marker)
+        text.handle_operation(MSG_OPERATION(text.marker.id, ops, text.revision), client=True)
+
+    def test_operation_ack(self):
+        text = self.make_text("abc")
+        self.edit(text, [3, "d"])
+        self.edit(text, [4, "e"])
+        self.assertEqual(len(self.root.sent), 1)
+        self.assertEqual(self.root.sent[0]["operation"], [3, "d"])
+
+        # Another peer's operation is applied first on the server
+
+        text.queue.put(MSG_OPERATION(1, ["x", 3], 0))
+        text.queue.put(MSG_OPERATION_ACK(text.marker.id, 2))
+        text.process_queue()
+
+        self.assertEqual(text.revision, 2)
+        self.assertEqual(len(self.root.sent), 2)
+        self.assertEqual(self.root.sent[1]["operation"], [5, "e"])
+        self.assertEqual(self.root.sent[1]["revision"], 2)
+
+        text.queue.put(MSG_OPERATION_ACK(text.marker.id, 3))
+        text.process_queue()
+
+        self.assertIs(text.state, synchronized)
+        self.assertEqual(text.revision, 3)
+        self.assertEqual(str(text.document), "xabcde")
+        self.assertWidgetMatches(text)
+
+
+class TestPipelining(TextTestCase):
+    """ Pipelined clients send operations before the previous one is acknowledged,
+        except for the first operation after a new document """
+
+    def edit(self, text, ops):
+        text.apply_operation(TextOperation(ops), peer=text.marker)
+        text.handle_operation(MSG_OPERATION(text.marker.id, ops, text.revision), client=True)
+
+    def test_first_operation_after_document(self):
+        text = self.make_text("abc")
+        text.pipelined = True
+        self.edit(text, [3, "d"])
+        self.edit(text, [4, "e"])
+        self.assertEqual([type(msg) for msg in self.root.sent], [MSG_OPERATION])
+        # The buffered operation is sent once the first is acknowledged
+        text.queue.put(MSG_OPERATION_ACK(text.marker.id, 1))
+        text.queue.put(MSG_OPERATION_ACK(text.marker.id, 2))
+        text.process_queue()
+        self.assertIs(text.state, synchronized)
+        self.edit(text, [5, "f"])
+        self.edit(text, [6, "g"])
+        self.assertEqual([type(msg) for msg in self.root.sent], [MSG_OPERATION] + [MSG_PIPELINED_OPERATION] * 3)
+        self.assertEqual([msg["seq"] for msg in self.root.sent[1:]], [1, 2, 3])
+        self.assertIsInstance(text.state, AwaitingPipeline)
+        self.assertEqual(len(text.state.outstanding), 2)
+
+class TestUndo(TextTestCase):
+    """ Undo actions are transformed against the operations from other peers
+        when they are used, which must give the same result as transforming
+        every action as each operation arrives """
+
+    def setUp(self):
+        TextTestCase.setUp(self)
+        self.text = self.make_text("first line\nsecond line\n")
+        self.text.max_undo_size = 6
+        self.eager = []
+        self.revision = 0
+
+    def local_edit(self, ops):
+        document = str(self.text.document)
+        self.text.apply_local_operation(ops, 0)
+        self.eager = self.eager[-self.text.max_undo_size:] + [TextOperation(ops).invert(document)]
+
+    def remote_edit(self, ops):
+        self.eager = [self.text.transform(action, TextOperation(ops))[0] for action in self.eager]
+        self.text.queue.put(MSG_OPERATION(1, ops, self.revision))
+        self.text.process_queue()
+        self.revision += 1
+
+    def undo(self):
+        action = self.text.get_undo_operation()
+        while True:
+            expected = self.eager.pop()
+            if not empty_operation(expected.ops) or len(self.eager) == 0:
+                break
+        self.assertEqual(action.ops, expected.ops)
+        # Applied as the Interface does
+        self.text.apply_local_operation(new_operation(*(action.ops + [len(self.text.document)])), 0, undo=True)
+
+    def test_random_edits(self):
+        rand = random.Random(3)
+        for _ in range(400):
+            action = rand.random()
+            if action < 0.3:
+                self.local_edit(random_edit(len(self.text.document), rand))
+            elif action < 0.8:
+                self.remote_edit(random_ops(len(self.text.document), rand))
+            elif len(self.text.undo_stack):
+                self.undo()
+            self.assertEqual(len(self.text.undo_stack), len(self.eager))
+            self.assertWidgetMatches(self.text)
+
+    def test_set_all_during_run(self):
+        self.local_edit([5, "!", 18])
+        self.remote_edit(["a", 24])
+        # The server resends the document, which ends the run of remote operations
+        self.text.handle_set_all(MSG_SET_ALL(-1, str(self.text.document), self.text.peer_tag_doc.to_list(), {}, self.revision))
+        self.remote_edit([25, "b"])
+        self.remote_edit([1, -2, 23])
+        self.assertEqual(len(self.text.undo_history), 2)
+        self.undo()
+        self.assertEqual(str(self.text.document), "arst line\nsecond line\nb")
+
+    def test_trim_history(self):
+        self.local_edit([0, "x", 23])
+        for i in range(4):
+            self.remote_edit([i, "y", 24 - i + 2 * i])
+            self.local_edit([1, "z", len(self.text.document) - 1])
+        self.undo()
+        self.assertTrue(len(self.text.undo_history))
+        while len(self.text.undo_stack):
+            self.undo()
+        # Nothing is kept once there is nothing left to undo
+        self.assertEqual(self.text.undo_history, [])
+        self.assertEqual(self.text.undo_offset, self.text.get_undo_revision())
+        # Only the operations after the oldest action are kept
+        for i in range(10):
+            self.local_edit([0, "x", len(self.text.document)])
+            self.remote_edit(["y", len(self.text.document)])
+        self.assertEqual(self.text.undo_offset, self.text.undo_stack[0][0])
+        self.assertEqual(len(self.text.undo_history), self.text.max_undo_size + 1)
+
+
+class TestBatching(TextTestCase):
+    """ Messages that arrive together are handled as one batch, with runs of
+        operations from the same peer composed, and must leave the text box
+        the same as handling them one at a time """
+
+    def random_burst(self, length, revision, rand):
+        """ Returns a list of operations, selections and marks from peers 1 and 2 """
+        messages = []
+        peer_id = rand.choice((1, 2))
+        for _ in range(rand.randint(1, 8)):
+            if rand.random() < 0.3:
+                peer_id = 3 - peer_id
+            if rand.random() < 0.2:
+                start = rand.randint(0, length)
+                messages.append(MSG_SELECT(peer_id, start, rand.randint(start, length)))
+            elif rand.random() < 0.1:
+                messages.append(MSG_SET_MARK(peer_id, rand.randint(0, length)))
+            else:
+                ops = random_edit(length, rand)
+                messages.append(MSG_OPERATION(peer_id, ops, revision))
+                length, revision = target_length(length, ops), revision + 1
+        return messages, length, revision
+
+    def snapshot(self, text):
+        """ Returns the state of the text box that should not depend on batching """
+        peers = {peer_id: (user.index_num, user.select_start(), user.select_end()) for peer_id, user in text.peers.items()}
+        return text.text, str(text.document), text.revision, peers, {peer_id: text.peer_tag_doc.ranges(peer_id) for peer_id in text.peers}
+
+    def test_batch_matches_single_messages(self):
+        rand = random.Random(2)
+        document = "d1 >> play('x-o-')\nd2 >> play('  * ')\n"
+        batched = self.make_text(document)
+        self.root = Root()
+        single = self.make_text(document)
+        length, revision = len(document), 0
+        for _ in range(100):
+            messages, length, revision = self.random_burst(length, revision, rand)
+            frames = batched.frames
+            for msg in messages:
+                batched.queue.put(msg)
+            batched.process_queue()
+            self.assertEqual(batched.frames, frames + 1)
+            for msg in messages:
+                single.queue.put(msg)
+                single.process_queue()
+            self.assertWidgetMatches(batched)
+            self.assertEqual(self.snapshot(batched), self.snapshot(single))
+        self.assertEqual(batched.revision, revision)
+
+    def test_coalesce_operations(self):
+        text = self.make_text("abc")
+        messages = [
+            MSG_OPERATION(1, [3, "d"], 0),
+            MSG_OPERATION(1, [4, "e"], 1),
+            MSG_OPERATION(2, ["x", 5], 2),
+            MSG_SELECT(2, 0, 1),
+            MSG_OPERATION(2, [1, -1, 4], 3),
+        ]
+        batch = text.coalesce_operations(messages)
+        self.assertEqual([(msg.type, msg["src_id"], count) for msg, count in batch], [
+            (MSG_OPERATION.type, 1, 2),
+            (MSG_OPERATION.type, 2, 1),
+            (MSG_SELECT.type, 2, 1),
+            (MSG_OPERATION.type, 2, 1),
+        ])
+        self.assertEqual(batch[0][0]["operation"], [3, "de"])
+
+    def test_coalesce_keeps_marker(self):
+        text = self.make_text("abc")
+        messages = [MSG_OPERATION(1, [3, "xyz"], 0), MSG_OPERATION(1, [3, -2, 1], 1)]
+        self.assertEqual([count for msg, count in text.coalesce_operations(messages)], [1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
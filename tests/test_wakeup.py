@@ -0,0 +1,91 @@
+import threading
+import time
+import unittest
+
+try:
+    import tkinter as Tk
+except ImportError:
+    Tk = None
+
+if Tk is not None:
+    from src.interface.wakeup import Wakeup
+
+
+@unittest.skipIf(Tk is None, "tkinter is not available")
+class TestWakeup(unittest.TestCase):
+    """ Uses a Tcl interpreter's event loop, which does not need a display """
+
+    def setUp(self):
+        self.interp = Tk.Tcl()
+        self.calls  = []
+
+    def run_loop(self, seconds=0.2):
+        end = time.time() + seconds
+        while time.time() < end:
+            self.interp.tk.dooneevent(Tk._tkinter.DONT_WAIT)
+            time.sleep(0.001)
+
+    def test_set_from_thread(self):
+        wakeup = Wakeup(self.interp, lambda: self.calls.append(threading.current_thread()))
+        thread = threading.Thread(target=wakeup.set)
+        thread.start()
+        thread.join()
+        self.run_loop()
+        self.assertEqual(self.calls, [threading.current_thread()])
+        wakeup.close()
+
+    def test_calls_are_merged(self):
+        wakeup = Wakeup(self.interp, lambda: self.calls.append(1))
+        threads = [threading.Thread(target=wakeup.set) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.run_loop()
+        self.assertEqual(self.calls, [1])
+        wakeup.close()
+
+    def test_set_during_callback(self):
+        def callback():
+            self.calls.append(1)
+            if len(self.calls) < 3:
+                wakeup.set()
+        wakeup = Wakeup(self.interp, callback)
+        wakeup.set()
+        self.run_loop()
+        self.assertEqual(self.calls, [1, 1, 1])
+        wakeup.close()
+
+    def test_idle(self):
+        wakeup = Wakeup(self.interp, lambda: self.calls.append(1))
+        self.run_loop()
+        self.assertEqual(self.calls, [])
+        wakeup.close()
+
+
+class TestWakeupPolling(unittest.TestCase):
+    """ Where file handlers are not available the flag is checked with `after` """
+
+    class Widget:
+        tk = object()
+        def __init__(self):
+            self.timers = []
+        def after(self, ms, func):
+            self.timers.append((ms, func))
+
+    def test_poll(self):
+        calls  = []
+        widget = self.Widget()
+        wakeup = Wakeup(widget, lambda: calls.append(1))
+        self.assertEqual(len(widget.timers), 1)
+        widget.timers.pop()[1]()
+        self.assertEqual(calls, [])
+        wakeup.set()
+        wakeup.set()
+        widget.timers.pop()[1]()
+        self.assertEqual(calls, [1])
+        self.assertEqual(widget.timers[0][0], Wakeup.poll_interval)
+
+
+if __name__ == "__main__":
+    unittest.main()